@@ -0,0 +1,292 @@
+'''
+Offline benchmark of ConfluenceRetrieval.py
+Starts a StubConfluence (see ConfluenceStub) on localhost, points ConfluenceRetrieval at it and times each step:
+    resolve          resolveConfIds over a mix of pageId, title and tiny links
+    resolve_per_row  the same links through getConfId one row at a time
+    fetch            fetchPages over the shared session and request scheduler
+    table_extract    table_extract of every section table, per parser backend
+    stringify_table  stringify_table of every nested table, per parser backend
+    write_excel      writeDFToExcel of every parsed page
+    end_to_end       resolveConfIds followed by processPages (fetch, parse and write pipeline)
+Results are written to a JSON file; --compare prints the change against an earlier result file.
+
+    python ConfluenceBenchmark.py --pages 200 --latency 0.05 --throttle 0.02 --output bench.json
+'''
+import argparse
+import base64
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import struct
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+try:
+    from . import ConfluenceLxml, ConfluenceRetrieval, ConfluenceSections
+    from .ConfluenceStub import StubConfluence
+except ImportError:
+    import ConfluenceLxml
+    import ConfluenceRetrieval
+    import ConfluenceSections
+    from ConfluenceStub import StubConfluence
+
+scenarioNames = ['resolve', 'resolve_per_row', 'fetch', 'table_extract', 'stringify_table', 'write_excel', 'end_to_end']
+parserNames = ['bs4', 'lxml']
+firstPageId = 100000
+
+###
+# Synthetic documentation links, cycling through the three link variations of parseConfLink
+###
+def tiny_token(page_id):
+    token = base64.b64encode(struct.pack('<Q', int(page_id))).decode().rstrip('=').rstrip('A')
+    return token.replace('/', '-').replace('+', '_')
+
+def make_links(page_ids, base_url='https://space.confluence.com'):
+    links = []
+    for position, page_id in enumerate(page_ids):
+        kind = position % 3
+        if kind == 0:
+            links.append(base_url + '/pages/viewpage.action?pageId=' + str(page_id))
+        elif kind == 1:
+            links.append(base_url + '/display/SPACE/Page+' + str(page_id))
+        else:
+            links.append(base_url + '/x/' + tiny_token(page_id))
+    return pd.Series(links)
+
+###
+# Point ConfluenceRetrieval at the stub and start from a fresh session and scheduler
+###
+def use_stub(stub, rate=None):
+    ConfluenceRetrieval.confSearchURL = stub.search_url
+    ConfluenceRetrieval.confContentURL = stub.content_url
+    if rate is not None:
+        ConfluenceRetrieval.requestRate = rate
+    ConfluenceRetrieval._session = None
+    ConfluenceRetrieval._scheduler = None
+
+###
+# Timing helpers
+###
+def timed(fn, repeat=1):
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    return runs, result
+
+def record(runs, items, **extra):
+    seconds = statistics.median(runs)
+    result = {"seconds": round(seconds, 6), "runs": [round(run, 6) for run in runs], "items": items,
+              "per_second": round(items / seconds, 3) if seconds else None}
+    result.update(extra)
+    return result
+
+###
+# Section and nested tables of a page, for the per-function scenarios
+###
+def page_tables(html, parser):
+    if parser == 'lxml':
+        root = ConfluenceLxml.parse(html)
+        index = ConfluenceSections.build_index(root, ConfluenceLxml.tree_ops)
+        nested = list(root.iterfind('.//td//table'))
+    else:
+        root = BeautifulSoup(html, "lxml")
+        index = ConfluenceSections.build_index(root, ConfluenceRetrieval.soupTreeOps)
+        nested = root.select('td table')
+    sections = [(node.element, node.first_tbody) for node in index if node.has_table and node.first_tbody is not None]
+    return root, sections, nested
+
+###
+# Scenarios
+###
+def run_resolve(stub, links, repeat, rate):
+    def resolve():
+        use_stub(stub, rate)
+        return ConfluenceRetrieval.resolveConfIds(links)
+    runs, pageIds = timed(resolve, repeat)
+    return record(runs, len(links), resolved=int(pageIds.notna().sum()))
+
+def run_resolve_per_row(stub, links, repeat, rate):
+    def resolve():
+        use_stub(stub, rate)
+        return [ConfluenceRetrieval.getConfId(index, link) for index, link in links.items()]
+    runs, pageIds = timed(resolve, repeat)
+    return record(runs, len(links), resolved=int(pd.Series(pageIds).notna().sum()))
+
+def run_fetch(stub, page_ids, repeat, rate):
+    def fetch():
+        use_stub(stub, rate)
+        return list(ConfluenceRetrieval.fetchPages(enumerate(page_ids)))
+    runs, pages = timed(fetch, repeat)
+    body_bytes = sum(len(page_data['body']['storage']['value']) for _, _, page_data in pages if page_data)
+    return record(runs, len(page_ids), fetched=sum(1 for page in pages if page[2]), body_bytes=body_bytes,
+                  scheduler=ConfluenceRetrieval.getScheduler().counters())
+
+def run_table_extract(bodies, repeat):
+    results = {}
+    for parser in parserNames:
+        table_extract = ConfluenceLxml.table_extract if parser == 'lxml' else ConfluenceRetrieval.table_extract
+        parsed = [page_tables(html, parser) for html in bodies]
+        sections = [section for _, page_sections, _ in parsed for section in page_sections]
+        runs, _ = timed(lambda: [table_extract(element, tbody) for element, tbody in sections], repeat)
+        results[parser] = record(runs, len(sections), pages=len(bodies))
+    return results
+
+def run_stringify_table(bodies, repeat):
+    results = {}
+    for parser in parserNames:
+        stringify_table = ConfluenceLxml.stringify_table if parser == 'lxml' else ConfluenceRetrieval.stringify_table
+        parsed = [page_tables(html, parser) for html in bodies]
+        nested = [table for _, _, page_nested in parsed for table in page_nested]
+        runs, _ = timed(lambda: [stringify_table(table) for table in nested], repeat)
+        results[parser] = record(runs, len(nested), pages=len(bodies))
+    return results
+
+def run_write_excel(pages, repeat, parser):
+    parsed = [ConfluenceRetrieval.parsePage(page_data, parser) for page_data in pages]
+    data = [[summary_df, sheet_names, tables, title, str(page_data['id'])]
+            for (summary_df, sheet_names, tables, title), page_data in zip(parsed, pages)]
+    runs, _ = timed(lambda: [ConfluenceRetrieval.writeDFToExcel(item) for item in data], repeat)
+    return record(runs, len(data), sheets=sum(len(item[1]) + 1 for item in data), parser=parser)
+
+def run_end_to_end(stub, links, repeat, rate, parser, excel_mode, parse_workers):
+    def end_to_end():
+        use_stub(stub, rate)
+        pageIds = ConfluenceRetrieval.resolveConfIds(links).dropna()
+        return list(ConfluenceRetrieval.processPages(zip(pageIds.index, pageIds), parser=parser,
+                                                     excel_mode=excel_mode, parse_workers=parse_workers))
+    runs, processed = timed(end_to_end, repeat)
+    return record(runs, len(links), processed=len(processed), parser=parser, excel_mode=excel_mode or ConfluenceRetrieval.excelMode,
+                  scheduler=ConfluenceRetrieval.getScheduler().counters())
+
+###
+# Run the selected scenarios against one stub server
+# Pages, excel files and printed progress go to a temporary directory and /dev/null
+###
+def run_benchmark(scenarios=None, pages=100, repeat=1, latency=0.0, jitter=0.0, throttle=0.0, retry_after=None,
+                  rate=None, parser=None, excel_mode=None, parse_workers=None, page_options=None):
+    scenarios = scenarios or scenarioNames
+    parser = parser or ConfluenceRetrieval.tableParser
+    page_ids = [firstPageId + number for number in range(pages)]
+    links = make_links(page_ids)
+
+    results = {}
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as output_directory, open(os.devnull, 'w') as devnull:
+        os.chdir(output_directory)
+        try:
+            with StubConfluence(latency, jitter, throttle, retry_after, page_options=page_options) as stub, \
+                 contextlib.redirect_stdout(devnull):
+                #Bodies for the local scenarios come from the stub without any latency or throttling
+                page_data = [json.loads(stub.page(str(page_id))) for page_id in page_ids]
+                bodies = [page['body']['storage']['value'] for page in page_data]
+
+                for name in scenarios:
+                    if name == 'resolve':
+                        results[name] = run_resolve(stub, links, repeat, rate)
+                    elif name == 'resolve_per_row':
+                        results[name] = run_resolve_per_row(stub, links, repeat, rate)
+                    elif name == 'fetch':
+                        results[name] = run_fetch(stub, page_ids, repeat, rate)
+                    elif name == 'table_extract':
+                        results[name] = run_table_extract(bodies, repeat)
+                    elif name == 'stringify_table':
+                        results[name] = run_stringify_table(bodies, repeat)
+                    elif name == 'write_excel':
+                        results[name] = run_write_excel(page_data, repeat, parser)
+                    elif name == 'end_to_end':
+                        results[name] = run_end_to_end(stub, links, repeat, rate, parser, excel_mode, parse_workers)
+                    else:
+                        raise ValueError("Unknown scenario: " + str(name))
+                stub_counters = dict(stub.counters)
+        finally:
+            os.chdir(working_directory)
+
+    return {
+        "started": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"pages": pages, "repeat": repeat, "latency": latency, "jitter": jitter, "throttle": throttle,
+                   "retry_after": retry_after, "rate": rate or ConfluenceRetrieval.requestRate, "parser": parser,
+                   "excel_mode": excel_mode or ConfluenceRetrieval.excelMode,
+                   "parse_workers": parse_workers or ConfluenceRetrieval.parseWorkers,
+                   "page_bytes": round(sum(len(body) for body in bodies) / max(1, len(bodies))),
+                   "page_options": page_options or {}},
+        "stub": stub_counters,
+        "scenarios": results,
+    }
+
+###
+# Flatten the scenario results to (name, seconds) so nested per-parser results can be compared too
+###
+def scenario_seconds(results):
+    for name, result in results["scenarios"].items():
+        if "seconds" in result:
+            yield name, result["seconds"]
+        else:
+            for variant, variant_result in result.items():
+                yield name + '.' + variant, variant_result["seconds"]
+
+def print_results(results, previous=None):
+    baseline = dict(scenario_seconds(previous)) if previous else {}
+    print('%-24s %12s %12s' % ('scenario', 'seconds', 'vs previous'))
+    for name, seconds in scenario_seconds(results):
+        change = ''
+        if baseline.get(name):
+            change = '%+.1f%%' % ((seconds / baseline[name] - 1) * 100)
+        print('%-24s %12.4f %12s' % (name, seconds, change))
+
+################
+# Run the code #
+################
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark ConfluenceRetrieval against a local stub server')
+    arg_parser.add_argument('--scenario', action='append', choices=scenarioNames, help='Scenario to run, repeat the option for several (default: all)')
+    arg_parser.add_argument('--pages', type=int, default=100, help='Number of pages and links')
+    arg_parser.add_argument('--repeat', type=int, default=1, help='Runs per scenario, the median is reported')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every stub response')
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help='Extra random seconds per stub response')
+    arg_parser.add_argument('--throttle', type=float, default=0.0, help='Share of stub responses answered with 429')
+    arg_parser.add_argument('--retry-after', type=float, default=None, help='Retry-After seconds sent with the 429 responses')
+    arg_parser.add_argument('--rate', type=float, default=None, help='Request rate of the scheduler (default: requestRate)')
+    arg_parser.add_argument('--parser', choices=parserNames, default=None, help='Backend used by write_excel and end_to_end')
+    arg_parser.add_argument('--excel-mode', choices=['dataframe', 'streaming'], default=None, help='Excel mode used by end_to_end')
+    arg_parser.add_argument('--parse-workers', type=int, default=None, help='Parse processes used by end_to_end')
+    arg_parser.add_argument('--sections', type=int, default=10, help='ui-expand sections per page')
+    arg_parser.add_argument('--depth', type=int, default=1, help='Nesting depth of the ui-expand sections')
+    arg_parser.add_argument('--rows', type=int, default=4, help='Data rows per section table')
+    arg_parser.add_argument('--columns', type=int, default=3, help='Columns per section table')
+    arg_parser.add_argument('--nested-tables', type=float, default=0.1, help='Share of cells holding a nested table')
+    arg_parser.add_argument('--content-wrappers', type=float, default=0.15, help='Share of cells holding a content-wrapper div')
+    arg_parser.add_argument('--lists', type=float, default=0.15, help='Share of cells holding a list')
+    arg_parser.add_argument('--padding', type=int, default=0, help='Characters of plain text added to every page')
+    arg_parser.add_argument('--output', default='ConfluenceBenchmark.json', help='Result file')
+    arg_parser.add_argument('--compare', default=None, help='Earlier result file to compare against')
+    args = arg_parser.parse_args()
+
+    page_options = {"sections": args.sections, "depth": args.depth, "rows": args.rows, "columns": args.columns,
+                    "nested_tables": args.nested_tables, "content_wrappers": args.content_wrappers,
+                    "lists": args.lists, "padding": args.padding}
+    results = run_benchmark(args.scenario, args.pages, args.repeat, args.latency, args.jitter, args.throttle,
+                            args.retry_after, args.rate, args.parser, args.excel_mode, args.parse_workers, page_options)
+
+    with open(args.output, 'w') as result_file:
+        json.dump(results, result_file, indent=2)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+    print_results(results, previous)
+    print('Results written to ' + args.output)
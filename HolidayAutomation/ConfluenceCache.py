@@ -0,0 +1,225 @@
+'''
+On-disk caches used by ConfluenceRetrieval.py
+PageCache stores each page in a SQLite database keyed by page ID together with its version number and version date,
+the raw body.storage HTML and the parsed summary / section tables.
+On a re-run only the pages whose version moved on Confluence need to be fetched, parsed and written again.
+Entries are evicted by age and by total size so the database does not grow without bound.
+TitleCache stores the page ID each (spaceKey, title) link resolved to, with a TTL, so title links are not looked up every run.
+'''
+import time
+import pickle
+import sqlite3
+import threading
+import zlib
+
+###
+# Page cache
+###
+class PageCache:
+
+    def __init__(self, path, max_bytes=None, max_age_days=None):
+        '''
+        Args
+        ----
+        path : str
+            Location of the SQLite database file. It is created if it does not exist.
+        max_bytes : int, defaults to None
+            If provided, least recently used entries are evicted once the stored blobs exceed this size.
+        max_age_days : float, defaults to None
+            If provided, entries fetched longer ago than this are evicted.
+        '''
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                page_id TEXT PRIMARY KEY,
+                version_number INTEGER,
+                version_when TEXT,
+                title TEXT,
+                body BLOB,
+                tables BLOB,
+                size INTEGER,
+                fetched_at REAL,
+                accessed_at REAL
+            )''')
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    #Version stored for every cached page, used for the bulk stale check
+    def versions(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT page_id, version_number FROM pages').fetchall()
+        return {page_id: version for page_id, version in rows}
+
+    #Titles of cached pages without loading their body and tables
+    def titles(self, page_ids):
+        page_ids = [str(page_id) for page_id in page_ids]
+        titles = {}
+        with self._lock:
+            for start in range(0, len(page_ids), 500):
+                batch = page_ids[start:start + 500]
+                rows = self._conn.execute('SELECT page_id, title FROM pages WHERE page_id IN (' + ','.join('?' * len(batch)) + ')', batch)
+                titles.update(rows.fetchall())
+        return titles
+
+    #A page is stale if it is not cached or the server reports a different version
+    #A page the server did not report a version for is treated as stale so it gets fetched
+    def stale(self, server_versions, page_ids=None):
+        cached = self.versions()
+        page_ids = server_versions.keys() if page_ids is None else page_ids
+        stale_ids = []
+        for page_id in page_ids:
+            page_id = str(page_id)
+            server_version = server_versions.get(page_id)
+            if server_version is None or cached.get(page_id) != int(server_version):
+                stale_ids.append(page_id)
+        return stale_ids
+
+    #Returns a dict with the page metadata, raw HTML and parsed tables, or None if the page is not cached
+    def get(self, page_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT version_number, version_when, title, body, tables FROM pages WHERE page_id = ?',
+                (str(page_id),)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE pages SET accessed_at = ? WHERE page_id = ?', (time.time(), str(page_id)))
+            self._conn.commit()
+
+        version_number, version_when, title, body, tables = row
+        return {
+            "id": str(page_id),
+            "version": version_number,
+            "when": version_when,
+            "title": title,
+            "html": zlib.decompress(body).decode('utf-8'),
+            "tables": pickle.loads(zlib.decompress(tables)),
+        }
+
+    #tables is the parsed output of a page, e.g. [summary_df, sheet names, section tables]
+    def put(self, page_data, tables):
+        body = zlib.compress(page_data['body']['storage']['value'].encode('utf-8'))
+        tables = zlib.compress(pickle.dumps(tables, protocol=pickle.HIGHEST_PROTOCOL))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(page_data['id']), int(page_data['version']['number']), page_data['version']['when'],
+                 page_data['title'], body, tables, len(body) + len(tables), now, now))
+            self._conn.commit()
+
+    def delete(self, page_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM pages WHERE page_id = ?', (str(page_id),))
+            self._conn.commit()
+
+    #Remove entries that are too old, then the least recently used ones until the cache fits in max_bytes
+    def evict(self):
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute('DELETE FROM pages WHERE fetched_at < ?', (cutoff,)).rowcount
+
+            if self.max_bytes is not None:
+                total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+                if total > self.max_bytes:
+                    victims = []
+                    for page_id, size in self._conn.execute('SELECT page_id, size FROM pages ORDER BY accessed_at'):
+                        if total <= self.max_bytes:
+                            break
+                        victims.append((page_id,))
+                        total -= size
+                    self._conn.executemany('DELETE FROM pages WHERE page_id = ?', victims)
+                    removed += len(victims)
+
+            self._conn.commit()
+            if removed:
+                self._conn.execute('VACUUM')
+        return removed
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+###
+# Title cache
+# Remembers which page ID a (spaceKey, title) pair resolved to, including pairs confirmed not to exist
+###
+class TitleCache:
+
+    def __init__(self, path, ttl_days=7, miss_ttl_days=1):
+        '''
+        Args
+        ----
+        path : str
+            Location of the SQLite database file. Can be the same file as the PageCache.
+        ttl_days : float, defaults to 7
+            How long a resolved page ID is trusted before it is looked up again.
+        miss_ttl_days : float, defaults to 1
+            How long a confirmed miss is trusted, kept shorter so newly created pages are picked up quickly.
+        '''
+        self.path = path
+        self.ttl_days = ttl_days
+        self.miss_ttl_days = miss_ttl_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS titles (
+                space_key TEXT,
+                title TEXT,
+                page_id TEXT,
+                resolved_at REAL,
+                PRIMARY KEY (space_key, title)
+            )''')
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    #Returns {(spaceKey, title): pageId or None} for every pair that has a fresh entry
+    #A value of None means the pair was confirmed not to exist
+    def get_many(self, pairs):
+        now = time.time()
+        hit_cutoff = now - self.ttl_days * 86400
+        miss_cutoff = now - self.miss_ttl_days * 86400
+
+        found = {}
+        with self._lock:
+            for space_key, title in pairs:
+                row = self._conn.execute(
+                    'SELECT page_id, resolved_at FROM titles WHERE space_key = ? AND title = ?',
+                    (space_key, title)).fetchone()
+                if row is None:
+                    continue
+                page_id, resolved_at = row
+                if resolved_at >= (hit_cutoff if page_id is not None else miss_cutoff):
+                    found[(space_key, title)] = page_id
+        return found
+
+    #results is {(spaceKey, title): pageId or None}
+    def put_many(self, results):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?)',
+                [(space_key, title, None if page_id is None else str(page_id), now)
+                 for (space_key, title), page_id in results.items()])
+            self._conn.commit()
+
+    #Drop entries that can no longer be used
+    def evict(self):
+        now = time.time()
+        with self._lock:
+            removed = self._conn.execute(
+                'DELETE FROM titles WHERE (page_id IS NOT NULL AND resolved_at < ?) OR (page_id IS NULL AND resolved_at < ?)',
+                (now - self.ttl_days * 86400, now - self.miss_ttl_days * 86400)).rowcount
+            self._conn.commit()
+        return removed
@@ -0,0 +1,150 @@
+'''
+Loader for the List_*.xlsx configuration export read by ConfluenceRetrieval.py
+The whole workbook used to be parsed with pd.read_excel on every run although only ID, DocumentationLink and Column are used.
+- only the needed columns are kept, and the calamine reader is used when python-calamine is installed
+- the loaded columns are saved to a sidecar file (Feather when pyarrow is installed, pickle otherwise),
+  keyed by the workbook's path, modification time and size, so a re-run on the same export skips the xlsx entirely
+- the latest file matching the pattern is remembered with its own and its directory's modification time and size;
+  while both are unchanged it is taken with two stats, without listing the directory. Adding, removing or renaming a
+  file changes the directory's modification time, and the directory is then listed again once
+'''
+import fnmatch
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+inputColumns = ['ID', 'DocumentationLink', 'Column']
+_stateFile = 'state.json'
+
+###
+# Optional readers
+###
+def reader_engine():
+    try:
+        import python_calamine #noqa: F401 - pandas needs it for engine='calamine'
+    except ImportError:
+        return 'openpyxl'
+    return 'calamine'
+
+def sidecar_format():
+    try:
+        import pyarrow #noqa: F401 - pandas needs it for to_feather
+    except ImportError:
+        return 'pickle'
+    return 'feather'
+
+###
+# State kept between runs: the remembered latest file and the sidecar of every loaded workbook
+###
+def _load_state(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _stateFile), encoding='utf-8') as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {"latest": {}, "sidecars": {}}
+
+def _save_state(cache_dir, state):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, _stateFile)
+    with open(path + '.tmp', 'w', encoding='utf-8') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+###
+# Latest file matching the pattern, like find_latest_file
+# Excel saves through a temporary file and a rename, so a newer export always changes the directory.
+# The run writes its excel files into the same directory, so the first call after a run lists it again.
+###
+def latest_input(pattern, directory=None, cache_dir='.confluence_input'):
+    directory = os.path.abspath(directory or os.getcwd())
+    pattern_directory, file_pattern = os.path.split(os.path.join(directory, pattern))
+    key = os.path.join(directory, pattern)
+
+    state = _load_state(cache_dir)
+    remembered = state["latest"].get(key)
+    if remembered:
+        try:
+            if (_signature(pattern_directory) == remembered["directory"] and
+                    _signature(remembered["path"]) == remembered["file"]):
+                return remembered["path"]
+        except (OSError, KeyError):
+            pass
+
+    directory_signature = _signature(pattern_directory) #Taken before listing, a file added meanwhile is seen next time
+    latest_file = latest_mtime = None
+    with os.scandir(pattern_directory) as entries:
+        for entry in entries:
+            if fnmatch.fnmatch(entry.name, file_pattern) and entry.is_file():
+                mtime = entry.stat().st_mtime_ns
+                if latest_mtime is None or mtime > latest_mtime:
+                    latest_file, latest_mtime = entry.path, mtime
+    if latest_file is None:
+        return None
+
+    state["latest"][key] = {"path": latest_file, "file": _signature(latest_file), "directory": directory_signature}
+    _save_state(cache_dir, state)
+    return latest_file
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+###
+# Read the needed columns of the workbook, from the sidecar when the workbook has not changed
+###
+def load_input(path, columns=None, cache_dir='.confluence_input', engine=None, refresh=False):
+    columns = list(columns or inputColumns)
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "columns": columns}
+
+    state = _load_state(cache_dir)
+    sidecar = state["sidecars"].get(path)
+    if not refresh and sidecar and all(sidecar.get(name) == value for name, value in key.items()):
+        try:
+            return _read_sidecar(os.path.join(cache_dir, sidecar["file"]), sidecar["format"])
+        except (OSError, ValueError, ImportError, EOFError, pickle.UnpicklingError):
+            pass #Unreadable sidecar, load the workbook again
+
+    wanted = set(columns)
+    input_df = pd.read_excel(path, header=0, usecols=lambda column: column in wanted, engine=engine or reader_engine())
+    missing = [column for column in columns if column not in input_df.columns]
+    if missing:
+        raise ValueError(os.path.basename(path) + " has no column " + ", ".join(missing))
+    input_df = input_df[columns]
+
+    file_format = sidecar_format()
+    file_name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16] + ('.feather' if file_format == 'feather' else '.pkl')
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_sidecar(input_df, os.path.join(cache_dir, file_name), file_format)
+
+    #Sidecars of workbooks that no longer exist are dropped with their entry
+    for old_path, old_sidecar in list(state["sidecars"].items()):
+        if old_path != path and not os.path.exists(old_path):
+            _remove(os.path.join(cache_dir, old_sidecar["file"]))
+            del state["sidecars"][old_path]
+    state["sidecars"][path] = dict(key, file=file_name, format=file_format)
+    _save_state(cache_dir, state)
+    return input_df
+
+def _read_sidecar(path, file_format):
+    if file_format == 'feather':
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+def _write_sidecar(input_df, path, file_format):
+    temporary = path + '.tmp'
+    if file_format == 'feather':
+        input_df.reset_index(drop=True).to_feather(temporary)
+    else:
+        input_df.to_pickle(temporary, compression=None)
+    os.replace(temporary, path)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,128 @@
+'''
+Checkpoint journal of a ConfluenceRetrieval.py run
+A run over thousands of pages used to start again from the first row after a crash or an expired token.
+The journal is a JSON-lines file appended to as the run goes, one object per line:
+    {"type": "run", "resume": false, "started": ...}                               a run started or was resumed
+    {"type": "row", "row": 3, "link": "...", "page_id": "123456"}                  page an input row resolved to
+    {"type": "page", "page_id": "123456", "status": "pending" | "done" | "failed",
+     "version": 7, "title": "...", "output": "/path/123456_Title.xlsx", "error": "..."}
+The last record of a page wins. With resume the journal is read back first: rows keep their resolved page,
+pages that are done and whose output file still exists are skipped, failed and pending pages are run again.
+A line cut short by a killed process is ignored.
+'''
+import json
+import os
+import threading
+import time
+
+pageStatuses = ['pending', 'done', 'failed']
+
+class RunJournal:
+
+    def __init__(self, path, resume=False):
+        '''
+        Args
+        ----
+        path : str
+            Location of the journal file.
+        resume : bool, defaults to False
+            If True, the existing journal is read back and appended to. Otherwise a new journal replaces it.
+        '''
+        self.path = path
+        self.resume = resume
+        self.rows = {} #row -> {"link": ..., "page_id": ...}
+        self.pages = {} #page_id -> last page record
+        self._lock = threading.Lock()
+
+        if resume:
+            self._replay()
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self._file.tell() > 0 and not self._ends_with_newline():
+            self._file.write('\n') #Do not glue the first record to a line cut short by a crash
+        self._append({"type": "run", "resume": resume, "started": time.time()})
+
+    def _replay(self):
+        try:
+            with open(self.path, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._apply(record)
+        except FileNotFoundError:
+            pass
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b'\n'
+
+    def _apply(self, record):
+        if record.get("type") == "row":
+            self.rows[record["row"]] = record
+        elif record.get("type") == "page":
+            self.pages[record["page_id"]] = record
+
+    #Flushed line by line, so a killed process loses at most the record it was writing
+    def _append(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._apply(record)
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ###
+    # Rows
+    ###
+    def record_rows(self, links, pageIds):
+        for row, link, pageId in zip(links.index, links, pageIds):
+            pageId = pageId if isinstance(pageId, str) and pageId else None
+            self._append({"type": "row", "row": int(row), "link": link, "page_id": pageId})
+
+    #{row: page_id} of rows resolved by an earlier attempt with the same link; unresolved rows are tried again
+    def resolved_rows(self, links):
+        resolved = {}
+        for row, link in zip(links.index, links):
+            record = self.rows.get(int(row))
+            if record is not None and record["link"] == link and record["page_id"]:
+                resolved[row] = record["page_id"]
+        return resolved
+
+    ###
+    # Pages
+    ###
+    def pending(self, pageIds):
+        for pageId in pageIds:
+            self._append({"type": "page", "page_id": str(pageId), "status": "pending"})
+
+    def done(self, pageId, title, output, version=None, outcome='processed'):
+        self._append({"type": "page", "page_id": str(pageId), "status": "done", "outcome": outcome,
+                      "version": version, "title": title, "output": os.path.abspath(output)})
+
+    def failed(self, pageId, error=None):
+        self._append({"type": "page", "page_id": str(pageId), "status": "failed", "error": error})
+
+    #{page_id: record} of the pages finished by an earlier attempt whose excel file is still there
+    def completed(self):
+        return {pageId: record for pageId, record in self.pages.items()
+                if record["status"] == "done" and os.path.exists(record["output"])}
+
+    def counts(self):
+        counts = dict.fromkeys(pageStatuses, 0)
+        for record in self.pages.values():
+            counts[record["status"]] += 1
+        return counts
@@ -0,0 +1,154 @@
+'''
+lxml backend for the table extraction in ConfluenceRetrieval.py
+Works directly on lxml element trees instead of BeautifulSoup and produces the same DataFrames and markdown cells
+as table_extract / stringify_list / stringify_table.
+BeautifulSoup's find_all() walks the whole subtree on every call, so testing whether a cell has children and then
+searching it again for <li> and <tbody> made nested tables cost roughly quadratic time.
+Here each cell is scanned once to find out what it contains before it is converted.
+Select it with parser='lxml' in parsePage.
+'''
+import pandas as pd
+from lxml import etree
+
+try:
+    from . import ConfluenceSections, ConfluenceTables
+    from .ConfluenceMetrics import metrics
+except ImportError:
+    import ConfluenceSections
+    import ConfluenceTables
+    from ConfluenceMetrics import metrics
+
+###
+# Parse the body.storage HTML the same way BeautifulSoup(htmlContent, "lxml") does
+###
+def parse(htmlContent):
+    root = etree.HTML(htmlContent)
+    if root is None: #empty body
+        root = etree.HTML('<html></html>')
+    return root
+
+###
+# Helpers mirroring the BeautifulSoup calls used by table_extract
+###
+
+#get_text(strip=True): every text node stripped and joined, comments are skipped by itertext
+def get_text(element):
+    return ''.join(text.strip() for text in element.itertext())
+
+#find_all(recursive=False): element children only, comments and processing instructions are not tags
+def children(element):
+    return [child for child in element if isinstance(child.tag, str)]
+
+def has_children(element):
+    for child in element:
+        if isinstance(child.tag, str):
+            return True
+    return False
+
+#One scan over the descendants to answer find_all('li') and find_all('tbody') together
+def contains_list_or_table(element):
+    has_li = False
+    has_tbody = False
+    for descendant in element.iterdescendants('li', 'tbody'):
+        if descendant.tag == 'li':
+            has_li = True
+        else:
+            has_tbody = True
+        if has_li:
+            break
+    return has_li, has_tbody
+
+def is_content_wrapper(element):
+    return 'content-wrapper' in element.get('class', '').split()
+
+###
+# Extract readable text
+###
+def stringify_list(inner_child):
+    return "\n".join(f"- {get_text(li)}" for li in inner_child.iterdescendants('li'))
+
+def stringify_table(inner_child):
+    return ConfluenceTables.stringify_table(inner_child, tree_ops)
+
+def stringify_element(element):
+    has_li, has_tbody = contains_list_or_table(element)
+    if has_li:
+        return stringify_list(element)
+    elif has_tbody:
+        return stringify_table(element)
+    return get_text(element)
+
+###
+# Extract from table
+# Rows are produced one at a time so they can be streamed straight to the excel file
+###
+def table_rows(element, tbody=None):
+    if tbody is None:
+        tbody = next(element.iterdescendants('tbody'))
+    tr_mainRows = [child for child in tbody if child.tag == 'tr']
+
+    for main_tr in tr_mainRows:
+        parts = []
+        if not has_children(main_tr):
+            parts.append(get_text(main_tr))
+        else:
+            for child in children(main_tr): #each Child is <td> element
+                if not has_children(child):
+                    parts.append(get_text(child))
+                    continue
+
+                column_parts = []
+                for inner_child in children(child): #each inner_child is an element in <td>
+                    if is_content_wrapper(inner_child):
+                        #because this is a content wrapper, we need to dive deep again
+                        column_parts.extend(stringify_element(in_c) for in_c in children(inner_child))
+                    else:
+                        column_parts.append(stringify_element(inner_child))
+
+                parts.append('\n'.join(column_parts) if len(column_parts) > 1 else column_parts[0])
+
+        yield parts
+
+@metrics.timed('table_extract')
+def table_extract(element, tbody=None):
+    rows = table_rows(element, tbody)
+    header_row = next(rows, [])
+    rows = list(rows)
+
+    if len(rows) == 0:
+        single_df = pd.DataFrame(columns = header_row, data=[[''] * len(header_row)])
+    else:
+        single_df = pd.DataFrame(columns=header_row, data=rows)
+
+    return single_df
+
+###
+# Page summary: first <th> and <td> text of every row in the first table
+###
+def summary_rows(root):
+    th_string = []
+    td_string = []
+    first_table = next(root.iter('table'))
+    for row in first_table.iterdescendants('tr'):
+        th = next(row.iterdescendants('th'), None)
+        td = next(row.iterdescendants('td'), None)
+        th_string.append(get_text(th) if th is not None else None)
+        td_string.append(get_text(td) if td is not None else None)
+    return th_string, td_string
+
+###
+# ui-expand sections, built from a single walk of the tree (see ConfluenceSections)
+###
+tree_ops = ConfluenceSections.TreeOps(
+    name=lambda element: element.tag,
+    attr=lambda element, key: element.get(key),
+    children=children,
+    text=get_text,
+    walk=lambda root: etree.iterwalk(root, events=('start', 'end'), tag=etree.Element),
+)
+
+def section_tables(root, memo=None):
+    return ConfluenceSections.section_tables(ConfluenceSections.build_index(root, tree_ops), table_extract, memo)
+
+def section_rows(root, memo=None):
+    return ConfluenceSections.section_rows(ConfluenceSections.build_index(root, tree_ops), table_rows, memo)
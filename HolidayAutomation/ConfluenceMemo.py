@@ -0,0 +1,259 @@
+'''
+Memo of the section extraction in ConfluenceRetrieval.py and ConfluenceLxml.py
+Pages created from the same template repeat the same ui-expand sections word for word, and every copy used to be
+walked and converted by table_extract again.
+Each section is keyed by a hash of its raw storage XML (with the nested table format and memoVersion), and the
+extracted DataFrame, or the rows of markdown cells in streaming mode, is kept under that key:
+- in an LRU of the most recently used entries in each process
+- optionally in a SQLite file shared by the parse processes and by later runs
+Hits and misses are counted in the metrics registry (section_memo_*), so the hit rate of the parse processes shows up
+in the summary of the main process.
+'''
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    from . import ConfluenceTables
+    from .ConfluenceMetrics import metrics
+except ImportError:
+    import ConfluenceTables
+    from ConfluenceMetrics import metrics
+
+memoVersion = 1 #Bump when table_extract / table_rows change their output, older entries are then never hit
+defaultEntries = 4096 #Entries kept in memory by each process
+
+_macroRegex = re.compile(r'<(/?)ac:structured-macro\b([^>]*?)(/?)>')
+
+###
+# Position of every ui-expand macro in the raw body, in the order of their start tags
+###
+def section_spans(htmlContent):
+    spans = []
+    open_macros = [] #(start, is ui-expand) of the macros enclosing the current position
+    for match in _macroRegex.finditer(htmlContent):
+        closing, attributes, self_closing = match.groups()
+        if closing:
+            if not open_macros:
+                return None #Unbalanced body, the sections cannot be matched to the parsed tree
+            start, expand = open_macros.pop()
+            if expand:
+                spans.append((start, match.end()))
+        elif not self_closing:
+            open_macros.append((match.start(), 'ac:name="ui-expand"' in attributes))
+    if open_macros:
+        return None
+    spans.sort()
+    return spans
+
+def section_key(source, table_format=None):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(('%d:%s:' % (memoVersion, table_format or ConfluenceTables.tableFormat)).encode('utf-8'))
+    digest.update(source.encode('utf-8'))
+    return digest.hexdigest()
+
+###
+# Memo shared by every page parsed in this process
+###
+class SectionMemo:
+
+    def __init__(self, max_entries=defaultEntries, path=None, max_age_days=90):
+        '''
+        Args
+        ----
+        max_entries : int, defaults to defaultEntries
+            Number of extracted sections kept in memory, least recently used first out.
+        path : str, defaults to None
+            If provided, SQLite file keeping the extracted sections across processes and runs.
+        max_age_days : float, defaults to 90
+            Entries of the file not used for this long are removed when it is opened.
+        '''
+        self.max_entries = max_entries
+        self.path = path
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._conn = None
+        self._pid = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.unmatched_pages = 0
+
+    ###
+    # Disk tier, opened on first use by each process
+    # A connection is never used across a fork, the child opens its own
+    ###
+    def _disk(self):
+        if self.path is None:
+            return None
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._pid = os.getpid()
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS sections (
+                    key TEXT PRIMARY KEY,
+                    value BLOB,
+                    size INTEGER,
+                    used_at REAL
+                )''')
+            if self.max_age_days is not None:
+                self._conn.execute('DELETE FROM sections WHERE used_at < ?', (time.time() - self.max_age_days * 86400,))
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    ###
+    # Lookup and store
+    ###
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.count('section_memo_hits')
+                return self._entries[key]
+
+            value = None
+            try:
+                conn = self._disk()
+                if conn is not None:
+                    row = conn.execute('SELECT value FROM sections WHERE key = ?', (key,)).fetchone()
+                    if row is not None:
+                        value = pickle.loads(zlib.decompress(row[0]))
+                        conn.execute('UPDATE sections SET used_at = ? WHERE key = ?', (time.time(), key))
+                        conn.commit()
+            except sqlite3.Error:
+                value = None #The memo is only a shortcut, a busy or broken file means extracting again
+
+            if value is None:
+                self.misses += 1
+                metrics.count('section_memo_misses')
+                return None
+            self.disk_hits += 1
+            metrics.count('section_memo_disk_hits')
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            try:
+                conn = self._disk()
+                if conn is not None:
+                    blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                    conn.execute('INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+                    conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self._entries),
+                "unmatched_pages": self.unmatched_pages, "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else None}
+
+    def page(self, htmlContent):
+        return PageMemo(self, htmlContent)
+
+###
+# Memo bound to the body of one page, handed to ConfluenceSections.section_tables / section_rows
+###
+class PageMemo:
+
+    def __init__(self, memo, htmlContent):
+        self.memo = memo
+        self.source = htmlContent
+
+    #Give every section of the index the key of its raw XML
+    #Sections are matched to the raw body by position, a body the parser saw differently is extracted without the memo
+    def label(self, index):
+        spans = section_spans(self.source)
+        if spans is None or len(spans) != len(index):
+            self.memo.unmatched_pages += 1
+            metrics.count('section_memo_unmatched_pages')
+            return
+        table_format = ConfluenceTables.tableFormat
+        for node, (start, end) in zip(index, spans):
+            node.key = section_key(self.source[start:end], table_format)
+
+    #DataFrame of table_extract; the caller adds the Section column, so a copy is handed out
+    def table(self, node, table_extract):
+        if node.key is None:
+            return table_extract(node.element, node.first_tbody)
+        key = 'frame:' + node.key
+        cached = self.memo.get(key)
+        if cached is not None:
+            return cached.copy()
+        single_df = table_extract(node.element, node.first_tbody)
+        self.memo.put(key, single_df.copy())
+        return single_df
+
+    #Rows of table_rows, header first; a section streamed to the end is stored
+    def rows(self, node, table_rows):
+        if node.key is None:
+            return table_rows(node.element, node.first_tbody)
+        key = 'rows:' + node.key
+        cached = self.memo.get(key)
+        if cached is not None:
+            return (list(parts) for parts in cached)
+        return self._store_rows(key, table_rows(node.element, node.first_tbody))
+
+    def _store_rows(self, key, rows):
+        seen = []
+        for parts in rows:
+            seen.append(list(parts))
+            yield parts
+        self.memo.put(key, seen)
+
+###
+# Memo of this process
+# The parse processes configure theirs in their pool initializer, see parseWorkerInit in ConfluenceRetrieval.py
+###
+_memo = None
+_configured = False
+
+def configure(max_entries=defaultEntries, path=None):
+    global _memo, _configured
+    if _memo is not None:
+        _memo.close()
+    _memo = SectionMemo(max_entries, path) if max_entries else None
+    _configured = True
+    return _memo
+
+def current():
+    if not _configured:
+        configure()
+    return _memo
+
+#Memo for one page body, None when the memo is turned off
+def page_memo(htmlContent):
+    memo = current()
+    return memo.page(htmlContent) if memo is not None else None
+
+#Hit rate over the section_memo_* counters of a metrics snapshot
+def summary_text(counters):
+    hits = counters.get('section_memo_hits', 0)
+    disk_hits = counters.get('section_memo_disk_hits', 0)
+    misses = counters.get('section_memo_misses', 0)
+    lookups = hits + disk_hits + misses
+    if not lookups:
+        return 'Section memo: no lookups'
+    return 'Section memo: %d of %d sections reused (%.1f%%, %d from disk)' % (hits + disk_hits, lookups, 100.0 * (hits + disk_hits) / lookups, disk_hits)
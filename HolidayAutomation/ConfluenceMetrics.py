@@ -0,0 +1,286 @@
+'''
+Per-stage timing and metrics for ConfluenceRetrieval.py
+A run used to report nothing beyond "The page X has been processed." lines. Each step now records into one registry:
+- timers: a latency histogram per function (getConfId, confluenceAPIReq, fetchPage, parsePage, table_extract, writeDFToExcel, ...)
+- counters: bytes downloaded, pages processed, ...
+- gauges: queue depth in front of every pipeline stage, last and highest value
+Timed calls carrying a page_bytes field are also grouped by page size, to show parse time against page size.
+
+Every observation can be appended to a JSON-lines log as it happens. At the end of the run summary_table() prints one line
+per metric, and prometheus_text() gives the same data in the Prometheus text format.
+Parse processes do not share the registry; their observations are captured with collect() and merged into the main process.
+'''
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+latencyBuckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+pageSizeBuckets = (16 * 1024, 64 * 1024, 256 * 1024, 1024**2, math.inf)
+
+###
+# Latency histogram with Prometheus style cumulative buckets
+###
+class Histogram:
+
+    def __init__(self, buckets=latencyBuckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    #Linear interpolation inside the bucket holding the quantile, like histogram_quantile()
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = self.max if math.isinf(bound) else min(bound, self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * max(0.0, rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+###
+# Metrics registry
+###
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {} #(name, labels) -> [last, max]
+        self._by_size = {} #name -> {size bucket: [count, seconds]}
+        self._log = None
+        self._capture = None #List of events while collect() runs in a worker process
+
+    #A forked parse process starts with its own lock and without the parent's log file
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._log = None
+        self._capture = None
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self._by_size.clear()
+
+    ###
+    # JSON-lines log, one object per observation
+    ###
+    def open_log(self, path):
+        self.close_log()
+        self._log = open(path, 'a', encoding='utf-8')
+
+    def close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    ###
+    # Recording
+    ###
+    def observe(self, name, seconds, log=True, **fields):
+        self._record({"type": "timer", "name": name, "value": seconds, "log": log, **fields})
+
+    def count(self, name, amount=1, log=False, **fields):
+        self._record({"type": "counter", "name": name, "value": amount, "log": log, **fields})
+
+    def gauge(self, name, value, log=False, **labels):
+        self._record({"type": "gauge", "name": name, "value": value, "log": log, "labels": labels})
+
+    #Time a block; fields added to the yielded dict (page size, table count, ...) are logged with it
+    @contextmanager
+    def timer(self, name, log=True, **fields):
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.observe(name, time.perf_counter() - start, log, **fields)
+
+    #Decorator form, for functions called too often to log every call
+    def timed(self, name=None, log=False):
+        def decorator(fn):
+            metric_name = name or fn.__name__
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(metric_name, time.perf_counter() - start, log)
+            return wrapper
+        return decorator
+
+    def _record(self, event):
+        event["ts"] = round(time.time(), 6)
+        with self._lock:
+            if self._capture is not None:
+                self._capture.append(event)
+                return
+            self._apply(event)
+
+    def _apply(self, event):
+        name = event["name"]
+        value = event["value"]
+        if event["type"] == "timer":
+            self._histograms.setdefault(name, Histogram()).observe(value)
+            if event.get("page_bytes") is not None:
+                bound = next(bound for bound in pageSizeBuckets if event["page_bytes"] <= bound)
+                bucket = self._by_size.setdefault(name, {}).setdefault(bound, [0, 0.0])
+                bucket[0] += 1
+                bucket[1] += value
+        elif event["type"] == "counter":
+            self._counters[name] = self._counters.get(name, 0) + value
+        else:
+            key = (name, tuple(sorted(event["labels"].items())))
+            gauge = self._gauges.setdefault(key, [value, value])
+            gauge[0] = value
+            gauge[1] = max(gauge[1], value)
+
+        if self._log is not None and event["log"]:
+            line = {key: value for key, value in event.items() if key != "log"}
+            self._log.write(json.dumps(line, default=str) + '\n')
+            self._log.flush()
+
+    ###
+    # Observations made in another process
+    ###
+    def start_capture(self):
+        with self._lock:
+            self._capture = []
+
+    def stop_capture(self):
+        with self._lock:
+            events, self._capture = self._capture or [], None
+        return events
+
+    def merge(self, events):
+        with self._lock:
+            for event in events:
+                self._apply(event)
+
+    ###
+    # Reports
+    ###
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timers": {name: {"count": histogram.count, "sum": histogram.sum, "min": histogram.min if histogram.count else None,
+                                  "max": histogram.max, "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95)}
+                           for name, histogram in self._histograms.items()},
+                "counters": dict(self._counters),
+                "gauges": {name + _label_text(labels): {"last": last, "max": peak}
+                           for (name, labels), (last, peak) in self._gauges.items()},
+                "by_page_size": {name: {_size_text(bound): {"count": count, "mean": seconds / count}
+                                        for bound, (count, seconds) in sorted(buckets.items())}
+                                 for name, buckets in self._by_size.items()},
+            }
+
+    def summary_table(self):
+        snapshot = self.snapshot()
+        lines = ['%-28s %8s %10s %9s %9s %9s %9s' % ('timer', 'count', 'total s', 'mean s', 'p50 s', 'p95 s', 'max s')]
+        for name, timer in sorted(snapshot["timers"].items(), key=lambda item: -item[1]["sum"]):
+            lines.append('%-28s %8d %10.3f %9.4f %9.4f %9.4f %9.4f' % (
+                name, timer["count"], timer["sum"], timer["sum"] / timer["count"], timer["p50"], timer["p95"], timer["max"]))
+
+        if snapshot["by_page_size"]:
+            lines.append('')
+            lines.append('%-28s %10s %8s %9s' % ('time by page size', 'size', 'count', 'mean s'))
+            for name, buckets in sorted(snapshot["by_page_size"].items()):
+                for size, bucket in buckets.items():
+                    lines.append('%-28s %10s %8d %9.4f' % (name, size, bucket["count"], bucket["mean"]))
+
+        if snapshot["counters"]:
+            lines.append('')
+            lines.append('%-28s %19s' % ('counter', 'total'))
+            for name, total in sorted(snapshot["counters"].items()):
+                lines.append('%-28s %19s' % (name, total))
+
+        if snapshot["gauges"]:
+            lines.append('')
+            lines.append('%-28s %10s %8s' % ('gauge', 'last', 'max'))
+            for name, gauge in sorted(snapshot["gauges"].items()):
+                lines.append('%-28s %10s %8s' % (name, gauge["last"], gauge["max"]))
+        return '\n'.join(lines)
+
+    def prometheus_text(self, prefix='confluence_'):
+        lines = []
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                metric = prefix + name + '_seconds'
+                lines.append('# TYPE ' + metric + ' histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{le="%s"} %d' % (metric, '+Inf' if math.isinf(bound) else repr(bound), cumulative))
+                lines.append('%s_sum %r' % (metric, histogram.sum))
+                lines.append('%s_count %d' % (metric, histogram.count))
+            for name, total in sorted(self._counters.items()):
+                metric = prefix + name + '_total'
+                lines.append('# TYPE ' + metric + ' counter')
+                lines.append('%s %r' % (metric, total))
+            gauge_names = sorted({name for name, _ in self._gauges})
+            for gauge_name in gauge_names:
+                lines.append('# TYPE ' + prefix + gauge_name + ' gauge')
+                lines.append('# TYPE ' + prefix + gauge_name + '_max gauge')
+                for (name, labels), (last, peak) in sorted(self._gauges.items()):
+                    if name == gauge_name:
+                        lines.append('%s%s%s %r' % (prefix, name, _label_text(labels), last))
+                        lines.append('%s%s_max%s %r' % (prefix, name, _label_text(labels), peak))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as prometheus_file:
+            prometheus_file.write(self.prometheus_text())
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in labels) + '}'
+
+def _size_text(bound):
+    if math.isinf(bound):
+        return '>1MB'
+    return '<=%dKB' % (bound // 1024)
+
+#Registry shared by every module of the run
+metrics = Metrics()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=metrics._after_fork)
+
+###
+# Run fn in a worker process and hand its observations back to the main process
+# Worker processes run one task at a time, so capturing everything recorded during the call is safe there
+###
+def collect(fn, *args):
+    metrics.start_capture()
+    try:
+        result = fn(*args)
+    finally:
+        events = metrics.stop_capture()
+    for event in events:
+        event["pid"] = os.getpid()
+    return result, events
@@ -0,0 +1,138 @@
+'''
+Small staged pipeline used by ConfluenceRetrieval.py
+Each stage has its own pool of worker threads and a bounded inbox, so a slow stage pushes back on the ones before it
+instead of letting every page pile up in memory.
+CPU heavy stages (parsing) hand their work to a ProcessPoolExecutor from these threads, so the GIL-bound parsing
+and the network calls no longer compete in one interpreter.
+'''
+import queue
+import threading
+
+_DONE = object()
+
+###
+# One stage of the pipeline
+###
+class Stage:
+
+    def __init__(self, name, fn, workers=1, queue_size=None):
+        '''
+        Args
+        ----
+        name : str
+            Used in error messages and counters.
+        fn : callable
+            Called with one item, returns the item for the next stage. Returning None drops the item.
+        workers : int, defaults to 1
+            Number of threads running fn.
+        queue_size : int, defaults to None
+            Capacity of the inbox. Defaults to twice the number of workers.
+        '''
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size or workers * 2)
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._running = workers
+
+    def depth(self):
+        return self.inbox.qsize()
+
+    def counters(self):
+        with self._lock:
+            return {"stage": self.name, "workers": self.workers, "queued": self.depth(),
+                    "processed": self.processed, "dropped": self.dropped, "failed": self.failed}
+
+def default_on_error(stage, item, error):
+    print('Stage ' + stage.name + ' failed for ' + repr(item[:2] if isinstance(item, tuple) else item) + ': ' + repr(error))
+
+#put that gives up when the pipeline is being stopped, so no thread stays blocked on a full queue
+def _put(target, item, stop):
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(source, stop):
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _work(stage, outbox, next_workers, stop, on_error):
+    while True:
+        item = _get(stage.inbox, stop)
+        if item is _DONE:
+            break
+        try:
+            result = stage.fn(item)
+        except Exception as error:
+            with stage._lock:
+                stage.failed += 1
+            on_error(stage, item, error)
+            continue
+
+        with stage._lock:
+            if result is None:
+                stage.dropped += 1
+            else:
+                stage.processed += 1
+        if result is not None and not _put(outbox, result, stop):
+            break
+
+    #The last worker of a stage tells every worker of the next stage to finish
+    with stage._lock:
+        stage._running -= 1
+        last = stage._running == 0
+    if last:
+        for _ in range(next_workers):
+            _put(outbox, _DONE, stop)
+
+def _feed(items, inbox, workers, stop, on_error):
+    try:
+        for item in items:
+            if not _put(inbox, item, stop):
+                return
+    except Exception as error:
+        on_error(Stage('input', None), None, error)
+    for _ in range(workers):
+        _put(inbox, _DONE, stop)
+
+###
+# Run items through the stages in order and yield what comes out of the last stage
+# Results are yielded in completion order. Closing the generator early stops every stage.
+###
+def run_pipeline(items, stages, output_size=None, on_error=None):
+    on_error = on_error or default_on_error
+    stop = threading.Event()
+    output = queue.Queue(maxsize=output_size or stages[-1].workers * 2)
+
+    threads = [threading.Thread(target=_feed, args=(items, stages[0].inbox, stages[0].workers, stop, on_error), daemon=True)]
+    for position, stage in enumerate(stages):
+        if position + 1 < len(stages):
+            outbox, next_workers = stages[position + 1].inbox, stages[position + 1].workers
+        else:
+            outbox, next_workers = output, 1
+        for _ in range(stage.workers):
+            threads.append(threading.Thread(target=_work, args=(stage, outbox, next_workers, stop, on_error), daemon=True))
+
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            result = output.get()
+            if result is _DONE:
+                break
+            yield result
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -9,31 +9,47 @@ Clean up by parsing with BeautifulSoup and breaking down all tables correctly
 Remap into new Excel sheets
 '''
 import json
-import pandas as pd
-import datetime
-from datetime import datetime, timedelta
 import glob
 import re
 import os
+import argparse
+from contextlib import contextmanager
+from urllib.parse import unquote_plus
 
 #Librarise for decoding base64 shared tinyurl
 import base64
 import struct
 
-from atlassian import Confluence
-import requests
-import json
-
 #For running threading to make operations run faster
+import threading
 import concurrent
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-#BeautifulSoup
-from bs4 import BeautifulSoup
-import lxml
+import pandas as pd
+import numpy as np
 
-#markdown table
-from py_markdown_table.markdown_table import markdown_table
+#requests, xlsxwriter, BeautifulSoup, lxml (ConfluenceLxml) and the request scheduler are imported
+#where they are first used, so importing this module to call one function does not load all of them
+
+#Sibling modules, imported relatively when this file is used from the HolidayAutomation package
+try:
+    from . import ConfluenceSections, ConfluenceTables, ConfluenceMemo
+    from .ConfluenceCache import PageCache, TitleCache #Version-aware page cache
+    from .ConfluencePipeline import Stage, run_pipeline, default_on_error #Staged fetch / parse / write pipeline
+    from .ConfluenceStore import OutputStore #Consolidated SQLite output alongside the excel files
+    from .ConfluenceMetrics import metrics, collect #Per-stage timing and metrics
+    from .ConfluenceInput import inputColumns, latest_input, load_input #Column-pruned, cached loading of the input workbook
+    from .ConfluenceJournal import RunJournal #Checkpoint journal for --resume
+except ImportError:
+    import ConfluenceSections
+    import ConfluenceTables
+    import ConfluenceMemo
+    from ConfluenceCache import PageCache, TitleCache
+    from ConfluencePipeline import Stage, run_pipeline, default_on_error
+    from ConfluenceStore import OutputStore
+    from ConfluenceMetrics import metrics, collect
+    from ConfluenceInput import inputColumns, latest_input, load_input
+    from ConfluenceJournal import RunJournal
 
 ############
 # Details  #
@@ -44,23 +60,127 @@ mainDirectory = 'FILEDIRECTORY'
 #Declare global variables
 benefitTemplate_list = []
 
+#Input workbook, only inputColumns are read. The loaded columns and the latest file are remembered in inputCacheDir
+inputPattern = 'List_*.xlsx'
+inputCacheDir = '.confluence_input'
+inputEngine = None #pandas excel engine, None picks calamine when installed and openpyxl otherwise
+
 #Credentials
 conf_auth = {
     "Username": "Username", #Confluence account ID
     "Token": "APIToken" #Confluence Personal token --> Please get from ''
 }
 
+#Confluence REST endpoints
+confSearchURL = "https://space.confluence.com/rest/api/content"
+confContentURL = "https://space.tobdarwin.com/rest/api/content/"
+
+#Fetch engine
+fetchWorkers = 8 #Maximum number of pages being downloaded at the same time
+pageExpand = "body.storage,history,version" #Summary, history, version and body in a single request per page
+
+#Pipeline stages, each with its own workers and a bounded queue in front of it
+parseWorkers = max(1, (os.cpu_count() or 2) - 1) #Processes parsing pages and extracting tables
+writeWorkers = 2 #Threads writing excel files
+stageQueueSize = None #Pages waiting in front of each stage, defaults to twice the stage's workers
+
+#Excel output, 'dataframe' builds every sheet with pandas first, 'streaming' writes rows as they are extracted
+#using xlsxwriter's constant_memory mode so memory per page does not grow with the page size
+excelMode = 'dataframe'
+
+#Optional SQLite database receiving every page's summary and section tables, None to only write excel files
+outputStore = None
+
+#Table extraction backend, 'bs4' (BeautifulSoup) or 'lxml' (element tree, see ConfluenceLxml)
+tableParser = 'bs4'
+
+#Text of tables nested in a cell, 'grid' (+---+ markdown grid) or 'tsv' (tab separated), see ConfluenceTables
+nestedTableFormat = 'grid'
+
+#Memo of extracted ui-expand sections keyed by a hash of their XML, see ConfluenceMemo
+sectionMemoEntries = 4096 #Sections kept in memory by each parse process, 0 turns the memo off
+sectionMemoFile = None #SQLite file sharing the memo between parse processes and runs, None to keep it in memory only
+
+#Checkpoint journal of the run: resolved rows and the status of every page, read back by --resume
+journalFile = 'ConfluenceRun.journal'
+
+#Row -> page link table, one line per input row with the page it points at and what happened to that page
+pageLinksFile = 'ConfluencePageLinks.xlsx'
+
+#Page cache
+cacheFile = 'ConfluencePageCache.sqlite'
+cacheMaxBytes = 2 * 1024**3 #Evict least recently used pages beyond 2GB
+cacheMaxAgeDays = 90 #Evict pages not refreshed within 90 days
+versionBatchSize = 50 #Number of page IDs checked per version query
+
+#Title to page ID cache
+titleBatchSize = 50 #Number of titles resolved per CQL search
+titleCacheTTLDays = 7 #Resolved titles are trusted for a week
+titleMissTTLDays = 1 #Titles that could not be found are looked up again after a day
+
+#Request scheduler
+requestRate = 20 #Requests per second across the whole run
+maxConcurrencyPerHost = 16 #Hard cap of requests in flight per host, the adaptive limit stays below it
+maxRetries = 5 #Retries for 429 / 5xx / connection errors before a page is given up
+requestTimeout = (10, 60) #Connect and read timeout in seconds of every Confluence call, a timed out call is retried
+
+#Metrics, see ConfluenceMetrics. The summary table is always printed at the end of the run
+metricsLog = None #JSON-lines file receiving every timed call, None to skip
+metricsPrometheus = None #File receiving a Prometheus text-format dump at the end of the run, None to skip
+
+#One keep-alive session is shared by every request so TLS connections are reused
+_session = None
+_session_lock = threading.Lock()
+_scheduler = None
+
 ################
 # Method       #
 ################
 
+###
+# Sibling modules with heavy dependencies, loaded on first use
+###
+def lxmlBackend():
+    try:
+        from . import ConfluenceLxml
+    except ImportError:
+        import ConfluenceLxml
+    return ConfluenceLxml
+
+def schedulerClass():
+    try:
+        from .ConfluenceScheduler import RequestScheduler
+    except ImportError:
+        from ConfluenceScheduler import RequestScheduler
+    return RequestScheduler
+
 ###
 # Write to excel file
 ###
+def outputFileName(pageId, title):
+    return str(pageId) + '_' + title.replace(' ', '_') + '.xlsx'
+
+#Write to a temporary file next to filename and rename it once complete
+#A killed process leaves at most a <name>.tmp.xlsx file behind, never a half-written excel file under the real name
+#The extension is kept as pandas picks and checks the excel engine by it
+@contextmanager
+def atomicFile(filename):
+    root, extension = os.path.splitext(filename)
+    temporary = root + '.tmp' + extension
+    try:
+        yield temporary
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, filename)
+
 def writeDFToExcel(data):
     
-    filename = data[4] + '_' + data[3].replace(' ', '_') + '.xlsx'
-    with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+    filename = outputFileName(data[4], data[3])
+    with metrics.timer('writeDFToExcel', page_id=str(data[4]), sheets=len(data[1]) + 1), \
+         atomicFile(filename) as temporary, \
+         pd.ExcelWriter(temporary, engine='xlsxwriter') as writer:
         
         sheets_length = len(data[1])
 
@@ -72,6 +192,43 @@ def writeDFToExcel(data):
         #worksheet = writer.sheets[sheetname]
         print("The excel file " + filename + "has been created.")
 
+###
+# Write to excel file as rows are produced
+# The workbook is opened in constant_memory mode: each row is flushed to disk once the next one starts,
+# so the summary sheet is written first and every section sheet after it, each from its rows generator
+# sections is an iterable of (section title, rows) with the header as the first row
+# When store_page is given (an OutputStore page writer), every row is stored as it passes through
+###
+def writeStreamToExcel(pageId, title, summary_df, sections, store_page=None):
+    filename = outputFileName(pageId, title)
+    import xlsxwriter
+    #Sections are extracted while they are written, so this includes the table extraction
+    with metrics.timer('writeStreamToExcel', page_id=str(pageId)) as timing, atomicFile(filename) as temporary:
+        workbook = xlsxwriter.Workbook(temporary, {'constant_memory': True})
+        #Same header look as DataFrame.to_excel
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        try:
+            summary_rows = [list(summary_df.columns)] + summary_df.values.tolist()
+            writeSheetRows(workbook.add_worksheet('Summary'), summary_rows, header_format)
+            if store_page is not None:
+                store_page.summary(summary_rows[1:])
+
+            item_count = {}
+            for section, rows in sections:
+                sheet_name = uniqueSheetName(section, item_count)
+                if store_page is not None:
+                    rows = store_page.rows(sheet_name, section, rows)
+                writeSheetRows(workbook.add_worksheet(sheet_name), rows, header_format)
+            timing['sheets'] = len(item_count) + 1
+        finally:
+            workbook.close()
+    print("The excel file " + filename + "has been created.")
+
+def writeSheetRows(worksheet, rows, header_format):
+    for row_number, row in enumerate(rows):
+        row = [None if isinstance(value, float) and np.isnan(value) else value for value in row]
+        worksheet.write_row(row_number, 0, row, header_format if row_number == 0 else None)
+
 ###
 # Find Latest file
 ###
@@ -94,21 +251,65 @@ def get_confluence_page_id_from_tiny_url(tiny_url):
         decoded_id = base64.b64decode(padded_id)
         return struct.unpack("Q", decoded_id)[0]
 
+###
+# Shared keep-alive session for all Confluence calls
+# The connection pool is sized to the number of fetch workers so every worker can hold its own connection
+###
+def getSession(pool_size=None):
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            import urllib3
+            from requests.adapters import HTTPAdapter
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+            pool_size = max(pool_size or fetchWorkers, maxConcurrencyPerHost)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            #session.auth = (conf_auth["Username"], conf_auth["Password"]) #Use token for safety
+            session.headers.update({"Authorization" : "Bearer " + conf_auth['Token']})
+            session.verify = False #WE NEED THIS TO STOP SSL ERROR
+            _session = session
+    return _session
+
+###
+# Every Confluence call goes through the shared scheduler
+# It backs off on 429 / 503, retries failures and keeps the request rate under requestRate
+###
+def getScheduler():
+    global _scheduler
+    with _session_lock:
+        if _scheduler is None:
+            _scheduler = schedulerClass()(rate=requestRate, initial_concurrency=min(fetchWorkers, maxConcurrencyPerHost),
+                                          max_concurrency=maxConcurrencyPerHost, max_retries=maxRetries, timeout=requestTimeout)
+    return _scheduler
+
+#Every call is timed, retries and waits for the scheduler included
+def confGet(url, params=None):
+    with metrics.timer('confGet', url=url) as timing:
+        response = getScheduler().get(getSession(maxConcurrencyPerHost), url, params=params, timeout=requestTimeout)
+        timing['status'] = response.status_code
+        timing['bytes'] = len(response.content)
+    metrics.count('bytes_downloaded', timing['bytes'])
+    return response
+
 ###
 # Method to retrieve Page ID from given confluence link by title and space key
 ###
+@metrics.timed('confluenceAPIReq', log=True)
 def confluenceAPIReq(title, spaceKey):
-  import urllib3
-  urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-  pageURL = "https://space.confluence.com/rest/api/content?title=" + title + "&spaceKey=" + spaceKey
+  pageURL = confSearchURL + "?title=" + title + "&spaceKey=" + spaceKey
   #print(pageURL)
-  confpage_req = requests.get(
+  confpage_req = confGet(
       url = pageURL,
       #params = {'title': title, 'spaceKey': spaceKey}, #Can't use params because + sign change to ASCII
-      #auth = (conf_auth["Username"], conf_auth["Password"]), #Use token for safety
-      headers = {"Authorization" : "Bearer " + conf_auth['Token']},
-      verify= False #WE NEED THIS TO STOP SSL ERROR
   )
+  if confpage_req.status_code != 200:
+    print(confpage_req.text)
+    return np.nan
   page_data = json.loads(confpage_req.text)
 
   #If the page does not exist, this page cannot be found
@@ -129,11 +330,13 @@ def confluenceAPIReq(title, spaceKey):
 # Variation 3: tinyurl through Shared function on confluence -> Need to decode to get page ID
 # Other variations: These includes other modifiers such as ? or # that needs to be removed properly
 ###
-def getConfId(index, urlString):
-  #print(urlString)
+def parseConfLink(urlString):
+  pageId = np.nan
+  spaceKey = None
+  title = None
 
   if type(urlString) != str:
-    pageId = np.nan
+    pass
   #PageID is provided directly
   elif 'pageId' in urlString:
     #remove contextnavpage
@@ -146,7 +349,6 @@ def getConfId(index, urlString):
     spaceKey = urlString.split('=')[1].split('&')[0]
     title = urlString.split("=")[-1]
     #print(title, spaceKey)
-    pageId = confluenceAPIReq(title,spaceKey)
   #every other combination
   else:
     #remove all ? modifiers for string
@@ -164,13 +366,212 @@ def getConfId(index, urlString):
     if spaceKey == 'x':
       pageId = get_confluence_page_id_from_tiny_url(title)
       pageId = str(pageId)
-    else:
-      pageId = confluenceAPIReq(title,spaceKey)
+      spaceKey = None
+      title = None
+
+  return pageId, spaceKey, title
+
+@metrics.timed('getConfId', log=True)
+def getConfId(index, urlString):
+  #print(urlString)
+  pageId, spaceKey, title = parseConfLink(urlString)
+
+  #title and space key need an API request to get pageId
+  if spaceKey is not None:
+    pageId = confluenceAPIReq(title,spaceKey)
 
   if(pd.isnull(pageId)):
     print("Incorrect urlString at: " + str(index))
   return pageId
 
+###
+# Resolve many (spaceKey, title) pairs through CQL search
+# Pairs are deduplicated and grouped by space, then looked up batch_size titles per request
+# Titles are matched after URL decoding ('+' and %20 both become spaces)
+# Returns {(spaceKey, title): pageId or np.nan}; confirmed misses are stored in the title cache as well
+###
+def resolveTitles(pairs, title_cache=None, batch_size=None):
+    batch_size = batch_size or titleBatchSize
+    pairs = {(spaceKey, unquote_plus(title)) for spaceKey, title in pairs}
+
+    resolved = title_cache.get_many(pairs) if title_cache is not None else {}
+    missing = pairs - resolved.keys()
+
+    by_space = {}
+    for spaceKey, title in missing:
+        by_space.setdefault(spaceKey, []).append(title)
+
+    looked_up = {}
+    for spaceKey, titles in by_space.items():
+        for start in range(0, len(titles), batch_size):
+            batch = titles[start:start + batch_size]
+            quoted = ",".join('"' + title.replace('\\', '\\\\').replace('"', '\\"') + '"' for title in batch)
+            confpage_req = confGet(
+                url = confSearchURL + "/search",
+                params = {"cql": 'space = "' + spaceKey + '" and title in (' + quoted + ')', "limit": len(batch) * 2}
+            )
+            if confpage_req.status_code != 200:
+                #Leave the batch unresolved rather than caching misses we have not confirmed
+                print(confpage_req.text)
+                continue
+
+            found = {}
+            for result in json.loads(confpage_req.text).get('results', []):
+                found[result['title'].lower()] = str(result['id'])
+            for title in batch:
+                looked_up[(spaceKey, title)] = found.get(title.lower())
+
+    if title_cache is not None and looked_up:
+        title_cache.put_many(looked_up)
+    resolved.update(looked_up)
+
+    return {pair: (np.nan if pageId is None else pageId) for pair, pageId in resolved.items()}
+
+###
+# Column-wise version of parseConfLink over a whole Series of links
+# Every link is classified with the same rules as parseConfLink:
+#   pageId  -> the ID is taken from the link
+#   title   -> spaceKey and title need a lookup
+#   tiny    -> the ID is decoded from the /x/ shared link
+#   invalid -> not a string or not a recognisable link
+# Returns a frame of (row, kind, pageId, spaceKey, title) in the order of the input
+###
+linkKinds = ['pageId', 'title', 'tiny', 'invalid']
+_firstValueRegex = re.compile(r'^[^=]*=([^&=]*)')
+_lastValueRegex = re.compile(r'([^=]*)$')
+_pageIdValueRegex = re.compile(r'^[^&]*=([^&=]*)(?:&|$)')
+_pathTailRegex = re.compile(r'^([^?]*)/([^/?]*)/([^/?#]*)')
+_tinyTokenRegex = re.compile(r'^[A-Za-z0-9_-]{1,11}$')
+
+def classifyLinks(links):
+    rows = links.index
+    links = links.reset_index(drop=True) #Work on positions so duplicate row labels are kept apart
+    is_str = links.map(lambda urlString: isinstance(urlString, str)).astype(bool)
+    text = links.where(is_str).astype(object)
+
+    kind = pd.Series('invalid', index=links.index, dtype=object)
+    pageId = pd.Series(np.nan, index=links.index, dtype=object)
+    spaceKey = pd.Series(np.nan, index=links.index, dtype=object)
+    title = pd.Series(np.nan, index=links.index, dtype=object)
+
+    if is_str.any():
+        text = text[is_str].astype(str)
+        has_pageId = text.str.contains('pageId', regex=False)
+        has_title = ~has_pageId & (text.str.contains('title', regex=False) | text.str.contains('spaceKey', regex=False)) \
+                    & text.str.contains('=', regex=False)
+        other = ~has_pageId & ~has_title
+
+        #PageID is provided directly, keep only the digits after the last = before the first &
+        id_links = text[has_pageId]
+        id_values = id_links.str.extract(_pageIdValueRegex, expand=False)
+        id_values = id_values.fillna(id_links.str.split('&', n=1).str[0])
+        pageId[id_links.index] = id_values.str.replace(r'\D', '', regex=True)
+        kind[id_links.index] = 'pageId'
+
+        #title and space key is provided as query parameters
+        title_links = text[has_title]
+        spaceKey[title_links.index] = title_links.str.extract(_firstValueRegex, expand=False)
+        title[title_links.index] = title_links.str.extract(_lastValueRegex, expand=False)
+        kind[title_links.index[spaceKey[title_links.index].notna()]] = 'title'
+
+        #every other combination, spaceKey and title are the last two path segments
+        path_parts = text[other].str.extract(_pathTailRegex)
+        path_parts = path_parts.dropna(subset=[1, 2])
+        is_tiny = path_parts[1] == 'x'
+
+        display = path_parts[~is_tiny]
+        spaceKey[display.index] = display[1]
+        title[display.index] = display[2]
+        kind[display.index] = 'title'
+
+        tiny = path_parts[is_tiny]
+        valid_tiny = tiny[2].str.match(_tinyTokenRegex)
+        pageId[valid_tiny.index[valid_tiny]] = decodeTinyIds(tiny[2][valid_tiny])
+        kind[valid_tiny.index[valid_tiny]] = 'tiny'
+
+    return pd.DataFrame({
+        'row': rows,
+        'kind': pd.Categorical(kind, categories=linkKinds),
+        'pageId': pageId.values,
+        'spaceKey': spaceKey.values,
+        'title': title.values,
+    })
+
+###
+# Decode a Series of /x/ tiny URL tokens in one pass
+# Each token is padded to 12 base64 characters so the whole column decodes as a single string of 9-byte records,
+# the first 8 bytes of each record are the little-endian page ID (same as struct.unpack("Q") in get_confluence_page_id_from_tiny_url)
+###
+def decodeTinyIds(tokens):
+    if len(tokens) == 0:
+        return pd.Series([], index=tokens.index, dtype=object)
+
+    padded = tokens.str.replace('-', '/', regex=False).str.replace('_', '+', regex=False).str.ljust(12, 'A')
+    decoded = base64.b64decode(''.join(padded))
+    records = np.frombuffer(decoded, dtype=np.uint8).reshape(len(tokens), 9)[:, :8]
+    pageIds = np.ascontiguousarray(records).view('<u8').ravel()
+    return pd.Series(pageIds.astype(str), index=tokens.index, dtype=object)
+
+###
+# Resolve the Confluence ID of every link in a Series
+# Links carrying the pageId or a tiny URL are resolved locally; only title links go to the network through resolveTitles
+###
+def resolveConfIds(links, title_cache=None):
+    with metrics.timer('classifyLinks', links=len(links)):
+        classified = classifyLinks(links)
+
+    lookups = classified[classified['kind'] == 'title']
+    with metrics.timer('resolveTitles', lookups=len(lookups)):
+        titles = resolveTitles(zip(lookups['spaceKey'], lookups['title']), title_cache)
+    pageIds = classified['pageId'].copy()
+    pageIds[lookups.index] = [titles.get((spaceKey, unquote_plus(title)), np.nan)
+                              for spaceKey, title in zip(lookups['spaceKey'], lookups['title'])]
+    pageIds.index = links.index
+
+    for index in pageIds.index[pageIds.isna() | (pageIds == '')]:
+        print("Incorrect urlString at: " + str(index))
+    return pageIds
+
+###
+# Row -> page link table
+# Many rows link to the same page through a pageId link, a title link and a tiny link
+# Each page is fetched, parsed and written once, the link table maps the result back to every row pointing at it
+###
+def canonicalPageId(pageId):
+    if pd.isnull(pageId):
+        return None
+    pageId = str(pageId).strip()
+    if pageId.isdigit():
+        return str(int(pageId)) #'00123' and '123' are the same page
+    return pageId or None
+
+#One entry per row: (Row, ID, DocumentationLink, PageID), PageID is None when the link did not resolve to a page
+def pageLinks(rows, pageIds):
+    return pd.DataFrame({
+        'Row': rows.index,
+        'ID': rows['ID'].values,
+        'DocumentationLink': rows['DocumentationLink'].values,
+        'PageID': pd.Series([canonicalPageId(pageId) for pageId in pageIds], dtype=object),
+    })
+
+#(row, pageId) of the first row linking to each page, in the order the pages first appear
+def uniquePages(links):
+    first_rows = links[links['PageID'].notna()].drop_duplicates(subset='PageID')
+    return list(zip(first_rows['Row'], first_rows['PageID']))
+
+#Map the result of every page back to its rows; results is {pageId: (status, title)}, pages missing from it failed
+#and rows without a page are 'unresolved'
+def linkResults(links, results):
+    links = links.copy()
+    outcome = [results.get(pageId, ('failed', None)) if pageId is not None else ('unresolved', None)
+               for pageId in links['PageID']]
+    links['Status'] = [status for status, _ in outcome]
+    links['Title'] = [title for _, title in outcome]
+    links['OutputFile'] = [outputFileName(pageId, title) if isinstance(title, str) else None
+                           for pageId, title in zip(links['PageID'], links['Title'])]
+    links['RowsForPage'] = links['PageID'].map(links['PageID'].value_counts()).fillna(0).astype(int)
+    return links
+
 ###
 # Extract readable text
 ###
@@ -180,33 +581,19 @@ def stringify_list(inner_child):
         list_items.append(f"- {li.get_text(strip=True)}")
     return "\n".join(list_items)
 
+#Nested table as a text grid (or TSV), see ConfluenceTables
 def stringify_table(inner_child):
-    th_rows = []
-    tr_rows = []
-    th_rows = [inner_th.get_text(strip=True) for inner_th in inner_child.find_all('th')]
-
-    for idx, inner_tr in enumerate(inner_child.find_all('tr')):
-        if idx == 0:
-            continue
-        else:
-            tr_items = {}
-            for id, inner_td in enumerate(inner_tr.find_all('td')):
-                tr_items[th_rows[id]] = inner_td.get_text(strip=True)
-            
-            tr_rows.append(tr_items)
-    
-    markdown_t = markdown_table(tr_rows).get_markdown()
-
-    return markdown_t
+    return ConfluenceTables.stringify_table(inner_child, soupTreeOps)
 
 ###
 # Extract from table
+# Rows are produced one at a time so they can be streamed straight to the excel file
 ###
-def table_extract(element):
-  tr_mainRows = element.find('tbody').find_all('tr', recursive=False)
+def table_rows(element, tbody=None):
+  if tbody is None:
+    tbody = element.find('tbody')
+  tr_mainRows = tbody.find_all('tr', recursive=False)
 
-  header_row = []
-  rows = []
   for main_tr in tr_mainRows:
       #print("ele", element)
       parts = []
@@ -239,10 +626,17 @@ def table_extract(element):
                   parts.append('\n'.join(column_parts) if len(column_parts) > 1 else column_parts[0])
           
       #print("td: ", parts)
-      if len(header_row) == 0:
-          header_row = parts
-      else:
-          rows.append(parts)
+      yield parts
+
+###
+# The first row of the table is the header, every other row is data
+# A table with only a header still gets one empty row
+###
+@metrics.timed('table_extract')
+def table_extract(element, tbody=None):
+  rows = table_rows(element, tbody)
+  header_row = next(rows, [])
+  rows = list(rows)
 
   if len(rows) == 0:
      single_df = pd.DataFrame(columns = header_row, data=[[''] * len(header_row)])
@@ -252,49 +646,115 @@ def table_extract(element):
   return single_df
 
 ###
-#Get content from Confluence
+# Fetch a single page from Confluence
+# Summary, history, version and body are folded into one request through expand
 ###
-def getContentFromConfluence(idx, pageId):
-    confpage_summaryReq = requests.get(
-      url = "https://space.tobdarwin.com/rest/api/content/"+ pageId,
-      headers = {"Authorization" : "Bearer " + conf_auth['Token']},
-      verify=False #WE NEED THIS TO STOP SSL Error
-    )
-    conf_summary_json = json.loads(confpage_summaryReq.text)
-    page_title = conf_summary_json['title']
-    page_id = conf_summary_json['id']
-    page_creator = conf_summary_json['history']['createdBy']['displayName']
-    page_createdDate = conf_summary_json['history']['createdDate']
-    page_currentVersion = conf_summary_json['version']['number']
-    page_lastModifier = conf_summary_json['version']['by']['displayName']
-    page_lastModified = conf_summary_json['version']['when']
-
-    confpage_req = requests.get(
-      url = "https://space.tobdarwin.com/rest/api/content/"+ pageId + "?expand=body.storage",
-      headers = {"Authorization" : "Bearer " + conf_auth['Token']},
-      verify=False #WE NEED THIS TO STOP SSL Error
-    )
+def fetchPage(idx, pageId):
+    with metrics.timer('fetchPage', page_id=str(pageId)) as timing:
+        confpage_req = confGet(
+          url = confContentURL + str(pageId),
+          params = {"expand": pageExpand}
+        )
+        timing['page_bytes'] = len(confpage_req.content)
 
     if confpage_req.status_code != 200:
       print(confpage_req.text)
+      print('No page found for row: ' + str(idx))
+      return None
 
     try:
         page_data = json.loads(confpage_req.text)
-    except:
+    except ValueError:
        print('No page found for row: ' + str(idx))
-    else:
-       htmlContent = page_data['body']['storage']['value']
-       htmlPageTitle = page_data['title']
-    
-    #parse the HTML content with BeautifulSoup to remove HTML tags. Parser is lxml
-    soup = BeautifulSoup(htmlContent, "lxml")
-    
+       return None
+    return page_data
+
+###
+# Fetch many pages concurrently over the shared session
+# pages is an iterable of (idx, pageId); results are yielded as (idx, pageId, page_data) in completion order
+# At most max_workers requests are in flight, and at most twice that many pages are held before being consumed
+###
+def fetchPages(pages, max_workers=None):
+    import requests
+    max_workers = max_workers or fetchWorkers
+    getSession(max_workers)
+
+    pages = iter(pages)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            #Top up the window of submitted pages
+            for idx, pageId in pages:
+                pending[executor.submit(fetchPage, idx, pageId)] = (idx, pageId)
+                if len(pending) >= max_workers * 2:
+                    break
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                idx, pageId = pending.pop(future)
+                try:
+                    page_data = future.result()
+                except requests.RequestException as e:
+                    print('Request failed for row: ' + str(idx) + ' ' + str(e))
+                    page_data = None
+                yield idx, pageId, page_data
+
+###
+# Retrieve the current version of many pages in bulk
+# One CQL search per batch of page IDs, only the version is expanded so the response stays small
+# Returns {pageId: version number}; pages missing from the result are not included
+###
+def fetchVersions(pageIds, batch_size=None):
+    batch_size = batch_size or versionBatchSize
+    pageIds = [str(pageId) for pageId in pageIds]
+
+    versions = {}
+    for start in range(0, len(pageIds), batch_size):
+        batch = pageIds[start:start + batch_size]
+        confpage_req = confGet(
+            url = confSearchURL + "/search",
+            params = {"cql": "id in (" + ",".join(batch) + ")", "expand": "version", "limit": len(batch)}
+        )
+        if confpage_req.status_code != 200:
+            print(confpage_req.text)
+            continue
+
+        for result in json.loads(confpage_req.text).get('results', []):
+            versions[str(result['id'])] = int(result['version']['number'])
+    return versions
+
+###
+#Get content from Confluence
+#page_data can be passed in when the page has already been fetched by fetchPages
+#When a cache is given, the raw page and the parsed tables are stored for the next run, once the excel file is written:
+#a page cached at a version its file never reached would be taken as unchanged and not written again
+###
+@metrics.timed('getContentFromConfluence', log=True)
+def getContentFromConfluence(idx, pageId, page_data=None, cache=None):
+    if page_data is None:
+        page_data = fetchPage(idx, pageId)
+        if page_data is None:
+            return None
+
+    pageId = str(pageId)
+    summary_df, updated_sheetName_list, tables, htmlPageTitle = parsePage(page_data)
+
+    writeDFToExcel([summary_df, updated_sheetName_list, tables, htmlPageTitle, pageId])
+
+    if cache is not None:
+        cache.put(page_data, [summary_df, updated_sheetName_list, tables, htmlPageTitle])
+    return print("The page " + pageId + "has been processed.")
+
+###
+# Page summary from the first table: first <th> and <td> text of every row
+###
+def summaryRows(soup):
     #Find all rows
     first_table = soup.find('table')
     rows = first_table.find_all('tr')
 
-    #For the page information
-    page_summary = {}
     th_string = []
     td_string = []
     for row in rows:
@@ -306,11 +766,138 @@ def getContentFromConfluence(idx, pageId):
        th_text = th.get_text(strip=True) if th else None
        td_text = td.get_text(strip=True) if td else None
 
-       #Store the pair in the dictionary
-       #page_summary[th_text] = td_text
        th_string.append(th_text)
        td_string.append(td_text)
+    return th_string, td_string
 
+###
+# One table per ui-expand section, built from a single walk of the page (see ConfluenceSections)
+###
+soupTreeOps = ConfluenceSections.TreeOps(
+    name=lambda element: element.name,
+    attr=lambda element, key: element.get(key),
+    children=lambda element: [child for child in element.children if child.name is not None], #Tags only, strings and comments have no name
+    text=lambda element: element.get_text(strip=True),
+)
+
+def sectionTables(soup, memo=None):
+    return ConfluenceSections.section_tables(ConfluenceSections.build_index(soup, soupTreeOps), table_extract, memo)
+
+###
+# Parse the body into (summary rows, section tables) with the chosen backend
+# 'bs4' walks the page with BeautifulSoup, 'lxml' uses the element tree backend in ConfluenceLxml
+# Sections already extracted on another page come from the section memo unless memo is False
+###
+def extractPage(htmlContent, parser=None, memo=True):
+    parser = parser or tableParser
+    page_memo = ConfluenceMemo.page_memo(htmlContent) if memo else None
+    if parser == 'lxml':
+        ConfluenceLxml = lxmlBackend()
+        root = ConfluenceLxml.parse(htmlContent)
+        return ConfluenceLxml.summary_rows(root), ConfluenceLxml.section_tables(root, page_memo)
+    elif parser == 'bs4':
+        from bs4 import BeautifulSoup
+        #parse the HTML content with BeautifulSoup to remove HTML tags. Parser is lxml
+        soup = BeautifulSoup(htmlContent, "lxml")
+        return summaryRows(soup), sectionTables(soup, page_memo)
+    raise ValueError("Unknown parser: " + str(parser))
+
+###
+# Same as extractPage but the sections are a generator of (section title, rows) for writeStreamToExcel
+# The parsed tree is kept alive by the generator until the last section has been written
+###
+def extractPageRows(htmlContent, parser=None):
+    parser = parser or tableParser
+    if parser == 'lxml':
+        ConfluenceLxml = lxmlBackend()
+        root = ConfluenceLxml.parse(htmlContent)
+        return ConfluenceLxml.summary_rows(root), ConfluenceLxml.section_rows(root, ConfluenceMemo.page_memo(htmlContent))
+    elif parser == 'bs4':
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(htmlContent, "lxml")
+        return summaryRows(soup), ConfluenceSections.section_rows(ConfluenceSections.build_index(soup, soupTreeOps), table_rows, ConfluenceMemo.page_memo(htmlContent))
+    raise ValueError("Unknown parser: " + str(parser))
+
+###
+# Parse a fetched page and stream it to its excel file without building the section DataFrames
+# Returns the same shape as parsePage with only the summary filled in, which is what the page cache keeps in this mode
+###
+# With a store, the rows are written to it in the same pass
+###
+def streamPage(page_data, parser=None, store=None):
+    htmlContent = page_data['body']['storage']['value']
+    with metrics.timer('streamPage', **pageShape(page_data['id'], htmlContent)):
+        (th_string, td_string), sections = extractPageRows(htmlContent, parser)
+        summary_df = pageSummary(page_data, th_string, td_string)
+        if store is None:
+            writeStreamToExcel(str(page_data['id']), page_data['title'], summary_df, sections)
+        else:
+            with store.page(page_data['id'], page_data['version']['number'], page_data['title']) as store_page:
+                writeStreamToExcel(str(page_data['id']), page_data['title'], summary_df, sections, store_page)
+    return summary_df, None, None, page_data['title']
+
+#Fields logged with the parse time of a page, counted on the raw body so both backends report the same numbers
+def pageShape(pageId, htmlContent):
+    return {"page_id": str(pageId), "page_bytes": len(htmlContent.encode('utf-8')),
+            "tables": htmlContent.count('<table'), "sections": htmlContent.count('ac:name="ui-expand"')}
+
+###
+# Recreate the excel file of an unchanged page from the page cache
+# Pages cached in streaming mode only keep the summary, their sections are extracted again from the cached body
+###
+def writeFromCache(pageId, cached, parser=None):
+    summary_df, updated_sheetName_list, tables, htmlPageTitle = cached['tables']
+    if tables is None:
+        _, sections = extractPageRows(cached['html'], parser)
+        writeStreamToExcel(pageId, htmlPageTitle, summary_df, sections)
+    else:
+        writeDFToExcel([summary_df, updated_sheetName_list, tables, htmlPageTitle, pageId])
+
+#Store an unchanged page from the page cache, for a store that is new or was last written with another version
+def storeFromCache(pageId, cached, store, parser=None):
+    summary_df, updated_sheetName_list, tables, htmlPageTitle = cached['tables']
+    if tables is not None:
+        store.write_frames(pageId, cached['version'], htmlPageTitle, summary_df, updated_sheetName_list, tables)
+        return
+    _, sections = extractPageRows(cached['html'], parser)
+    with store.page(pageId, cached['version'], htmlPageTitle) as store_page:
+        store_page.summary(summary_df.values.tolist())
+        item_count = {}
+        for section, rows in sections:
+            for _ in store_page.rows(uniqueSheetName(section, item_count), section, rows):
+                pass
+
+###
+# Compare both backends on the same body
+# Returns a list of differences, empty when the summary rows and every section table are identical
+###
+def compareParsers(htmlContent):
+    (bs4_summary, bs4_tables) = extractPage(htmlContent, 'bs4', memo=False)
+    (lxml_summary, lxml_tables) = extractPage(htmlContent, 'lxml', memo=False)
+
+    differences = []
+    if bs4_summary != lxml_summary:
+        differences.append('summary')
+    if len(bs4_tables) != len(lxml_tables):
+        differences.append('section count ' + str(len(bs4_tables)) + ' != ' + str(len(lxml_tables)))
+    for position, (bs4_df, lxml_df) in enumerate(zip(bs4_tables, lxml_tables)):
+        if not bs4_df.equals(lxml_df) or list(bs4_df.columns) != list(lxml_df.columns):
+            differences.append('section ' + str(position))
+    return differences
+
+###
+# Summary sheet: the rows of the first table followed by the page information
+###
+def pageSummary(page_data, th_string, td_string):
+    page_title = page_data['title']
+    page_id = page_data['id']
+    page_creator = page_data['history']['createdBy']['displayName']
+    page_createdDate = page_data['history']['createdDate']
+    page_currentVersion = page_data['version']['number']
+    page_lastModifier = page_data['version']['by']['displayName']
+    page_lastModified = page_data['version']['when']
+
+    #For the page information
     page_summary = {
        "Header": th_string,
        "Description": td_string 
@@ -320,78 +907,299 @@ def getContentFromConfluence(idx, pageId):
     additional_info = {"Header": ["Page Title", "Page ID", "Created By", "Created Date", "Current Version", "Last Modified By", "Last Modified Date"],
                         "Description": [page_title, page_id, page_creator, page_createdDate, int(page_currentVersion), page_lastModifier, page_lastModified]}
     summary_df = pd.concat([summary_df, pd.DataFrame(additional_info)], ignore_index=True)
+    return summary_df
 
-    #For the different section
-    expands = soup.find_all('ac:structured-macro', {"ac:name":"ui-expand"})
+###
+# Parse a fetched page into the summary table, the sheet names and one table per expand section
+###
+def parsePage(page_data, parser=None):
+    htmlContent = page_data['body']['storage']['value']
+    htmlPageTitle = page_data['title']
+
+    with metrics.timer('parsePage', **pageShape(page_data['id'], htmlContent)):
+        (th_string, td_string), tables = extractPage(htmlContent, parser)
+        summary_df = pageSummary(page_data, th_string, td_string)
 
-    tables = []
+    #Get the sheet names
+    #For each Section which is stored as a column, take only one instance through unique
     item_count = {}
-    updated_sheetName_list = []
-    count = 0
-    for expand in expands:
+    updated_sheetName_list = [uniqueSheetName(eachPage['Section'].unique()[0], item_count) for eachPage in tables]
 
-      #These finds the different expanded section
-      title_header = expand.find('ac:parameter', {"ac:name":"title"})
-      title_text = title_header.get_text(strip=True) if title_header else None
+    return summary_df, updated_sheetName_list, tables, htmlPageTitle
 
-      #For the specific section that has nested ui-expand
-      print(title_text)
-      if 'SomeText' in title_text:
-        nested_expand = expand.find_all('ac:structured-macro', {'ac:name': 'ui-expand'})
+###
+# Sheet name for a section
+# Remove all additional text in parantheses and characters excel does not allow,
+# then, since excel sheet name can only be 31 characters long, truncate to 31 characters
+# item_count keeps the names already used in the workbook so repeated names get a number suffix
+###
+def uniqueSheetName(section, item_count):
+    item = section.split('(')[0].strip()
+    item = re.sub(r'[\[\]:*?\\/]', ' ', item)
+    if item in item_count:
+      item_count[item] += 1
+      updated_item = f"{item[:28]} {item_count[item]}"[:31] #Truncate to 28 characters to allow for suffix
+    else:
+       item_count[item] = 1
+       updated_item = item[:31] #Truncate to 31 characters
+    return updated_item
 
-        if len(nested_expand) > 0:
-          for sub_expand in nested_expand:
-            subtitle_header = sub_expand.find('ac:parameter', {"ac:name":"title"})
-            subtitle_text = subtitle_header.get_text(strip=True) if subtitle_header else None
+###
+# Pipeline stages
+# (1) IDs are resolved in bulk by resolveConfIds before the pipeline starts
+# (2) fetch on fetch_workers threads sharing the keep-alive session
+# (3) parse and extract tables in a pool of parse_workers processes
+# (4) write the excel files (and the page cache) on write_workers threads
+# Items travel as (idx, pageId, page_data, parsed); at most a few pages per stage are held in memory at once
+# Yields (idx, pageId, title) of every page written; pages should be unique, see uniquePages
+###
+def fetchStage(item, journal=None):
+    idx, pageId = item
+    page_data = fetchPage(idx, pageId)
+    if page_data is None:
+        if journal is not None:
+            journal.failed(pageId, 'No page found')
+        return None
+    return idx, str(pageId), page_data
 
-            sub_df = table_extract(sub_expand)
-            sub_df['Section'] = title_text + " " + subtitle_text
+#In streaming mode the excel file (and the store rows) were already written by streamPage in the parse process
+#With a journal the page is marked done once its excel file is in place
+#The page is only cached once the excel file and the store rows are written, see getContentFromConfluence
+def writeStage(item, cache=None, store=None, journal=None):
+    idx, pageId, page_data, (summary_df, updated_sheetName_list, tables, htmlPageTitle) = item
+    if tables is not None:
+        writeDFToExcel([summary_df, updated_sheetName_list, tables, htmlPageTitle, pageId])
+        if store is not None:
+            with metrics.timer('storeWrite', page_id=pageId):
+                store.write_frames(page_data['id'], page_data['version']['number'], htmlPageTitle, summary_df, updated_sheetName_list, tables)
+    if cache is not None:
+        cache.put(page_data, [summary_df, updated_sheetName_list, tables, htmlPageTitle])
+    if journal is not None:
+        journal.done(pageId, htmlPageTitle, outputFileName(pageId, htmlPageTitle), page_data['version']['number'])
+    metrics.count('pages_processed')
+    print("The page " + pageId + "has been processed.")
+    return idx, pageId, htmlPageTitle
 
-            tables.append(sub_df)
-        else:
-          single_df = table_extract(expand)
-          single_df['Section'] = title_text
+#Parse processes do not see the settings of the main process, they are handed over when the pool starts
+def parseWorkerInit(table_format, memo_entries, memo_file):
+    ConfluenceTables.set_format(table_format)
+    ConfluenceMemo.configure(memo_entries, memo_file)
 
-          tables.append(single_df)
-      else:
-        if expand.find_parents('ac:structured-macro', {"ac:name": "ui-expand"}):
-          continue
-        
-        if expand.find_all('table'):
-          single_df = table_extract(expand)
-          single_df['Section'] = title_text
+def parseWorkerArgs():
+    return ConfluenceTables.tableFormat, sectionMemoEntries, sectionMemoFile
+
+#Forward a fetched page to the parse processes and wait for it
+#Timings recorded in the parse process come back with the result and are merged here
+def parseStageFor(executor, parser, streaming=False, store=None):
+    def parseStage(item):
+        idx, pageId, page_data = item
+        if streaming:
+            parsed, events = executor.submit(collect, streamPage, page_data, parser, store).result()
         else:
-          single_df = pd.DataFrame({'Section': [title_text]})
+            parsed, events = executor.submit(collect, parsePage, page_data, parser).result()
+        metrics.merge(events)
+        return idx, pageId, page_data, parsed
+    return parseStage
 
-        tables.append(single_df)
-      
-      # if count == 0:
-      #    break
-    
-    #Get the sheet names
-    #For each Section which is stored as a column, take only one instance through unique, and remove all additional text in parantheses
-    #Then, since excel sheet name can only be 31 characters long, truncate to 31 characters
-    sheetName_list = [eachPage['Section'].unique()[0].split('(')[0].strip() for eachPage in tables]
-
-    for item in sheetName_list:
-      item = re.sub(r'[\[\]:*?\\/]', ' ', item)
-      if item in item_count:
-        item_count[item] += 1
-        updated_item = f"{item[:28]} {item_count[item]}"[:31] #Truncate to 28 characters to allow for suffix
-      else:
-         item_count[item] = 1
-         updated_item = item[:31] #Truncate to 31 characters
-      updated_sheetName_list.append(updated_item)
+#A journal (ConfluenceJournal.RunJournal) records every page written and every page that failed in a stage
+def processPages(pages, cache=None, parser=None, fetch_workers=None, parse_workers=None, write_workers=None, queue_size=None, excel_mode=None, store=None, journal=None):
+    parser = parser or tableParser #Passed explicitly, worker processes do not see changes to the global
+    streaming = (excel_mode or excelMode) == 'streaming'
+    fetch_workers = fetch_workers or fetchWorkers
+    getSession(fetch_workers)
 
-    writeDFToExcel([summary_df, updated_sheetName_list, tables, htmlPageTitle, pageId])
-    return print("The page " + pageId + "has been processed.")
+    def on_error(stage, item, error):
+        default_on_error(stage, item, error)
+        if journal is not None and isinstance(item, tuple):
+            journal.failed(item[1], stage.name + ': ' + repr(error))
+
+    with ProcessPoolExecutor(max_workers=parse_workers or parseWorkers, initializer=parseWorkerInit, initargs=parseWorkerArgs()) as executor:
+        stages = [
+            Stage('fetch', lambda item: fetchStage(item, journal), fetch_workers, queue_size or stageQueueSize),
+            Stage('parse', parseStageFor(executor, parser, streaming, store), parse_workers or parseWorkers, queue_size or stageQueueSize),
+            Stage('write', lambda item: writeStage(item, cache, store, journal), write_workers or writeWorkers, queue_size or stageQueueSize),
+        ]
+        for idx, pageId, htmlPageTitle in run_pipeline(pages, stages, on_error=on_error):
+            for stage in stages:
+                metrics.gauge('queue_depth', stage.depth(), stage=stage.name)
+            yield idx, pageId, htmlPageTitle
+
+###
+# Library entry point: stream parsed pages to the caller instead of writing excel files
+# ids is an iterable of page IDs, duplicates are fetched once
+# Yields (page_meta, summary_df, sections) in completion order, sections being a list of (sheet name, DataFrame)
+# Only the pages in the pipeline queues are held in memory; closing the generator stops the fetch and parse stages
+###
+def iter_pages(ids, parser=None, fetch_workers=None, parse_workers=None, queue_size=None):
+    parser = parser or tableParser
+    fetch_workers = fetch_workers or fetchWorkers
+    getSession(fetch_workers)
+
+    def uniqueIds():
+        seen = set()
+        for position, pageId in enumerate(ids):
+            pageId = canonicalPageId(pageId)
+            if pageId is not None and pageId not in seen:
+                seen.add(pageId)
+                yield position, pageId
+
+    with ProcessPoolExecutor(max_workers=parse_workers or parseWorkers, initializer=parseWorkerInit, initargs=parseWorkerArgs()) as executor:
+        stages = [
+            Stage('fetch', fetchStage, fetch_workers, queue_size or stageQueueSize),
+            Stage('parse', parseStageFor(executor, parser), parse_workers or parseWorkers, queue_size or stageQueueSize),
+        ]
+        for idx, pageId, page_data, (summary_df, updated_sheetName_list, tables, htmlPageTitle) in run_pipeline(uniqueIds(), stages):
+            yield pageMeta(page_data), summary_df, list(zip(updated_sheetName_list, tables))
+
+#Page information without the body
+def pageMeta(page_data):
+    return {
+        "id": str(page_data['id']),
+        "title": page_data['title'],
+        "version": int(page_data['version']['number']),
+        "created_by": page_data['history']['createdBy']['displayName'],
+        "created_date": page_data['history']['createdDate'],
+        "last_modified_by": page_data['version']['by']['displayName'],
+        "last_modified": page_data['version']['when'],
+        "page_bytes": len(page_data['body']['storage']['value'].encode('utf-8')),
+    }
 
 ################
 # Run the code #
 ################
 
-latest_FullFile = find_latest_file('List_*.xlsx')
-List_df = pd.read_excel(latest_FullFile, header=0)
+###
+# Command line run: load the input workbook, resolve the links and write one excel file per page
+###
+def main(argv=None):
+    global tableParser, excelMode, sectionMemoEntries, sectionMemoFile
+
+    arg_parser = argparse.ArgumentParser(description='Retrieve documentation tables from Confluence')
+    arg_parser.add_argument('--full-refresh', action='store_true', help='Ignore the page cache and fetch every page again')
+    arg_parser.add_argument('--resume', action='store_true', help='Continue the last run from its journal: skip finished pages, retry failed and pending ones')
+    arg_parser.add_argument('--journal', default=journalFile, help='Checkpoint journal of the run')
+    arg_parser.add_argument('--parser', choices=['bs4', 'lxml'], default=tableParser, help='Backend used to extract the tables')
+    arg_parser.add_argument('--excel-mode', choices=['dataframe', 'streaming'], default=excelMode, help='How the excel files are written')
+    arg_parser.add_argument('--table-format', choices=ConfluenceTables.tableFormats, default=nestedTableFormat, help='Text of the tables nested in a cell')
+    arg_parser.add_argument('--section-memo', type=int, default=sectionMemoEntries, help='Extracted sections kept in memory by each parse process, 0 to turn the memo off')
+    arg_parser.add_argument('--section-memo-file', default=sectionMemoFile, help='SQLite file keeping extracted sections across processes and runs')
+    arg_parser.add_argument('--store', default=outputStore, help='SQLite database that also receives every page, replaced per page and version')
+    arg_parser.add_argument('--metrics-log', default=metricsLog, help='JSON-lines file receiving every timed call')
+    arg_parser.add_argument('--reload-input', action='store_true', help='Read the input workbook again instead of its cached columns')
+    arg_parser.add_argument('--metrics-prometheus', default=metricsPrometheus, help='File receiving the metrics in Prometheus text format')
+    args = arg_parser.parse_args(argv)
+    tableParser = args.parser
+    excelMode = args.excel_mode
+    ConfluenceTables.set_format(args.table_format)
+    sectionMemoEntries = args.section_memo
+    sectionMemoFile = args.section_memo_file
+    ConfluenceMemo.configure(sectionMemoEntries, sectionMemoFile)
+    output_store = OutputStore(args.store) if args.store else None
+    if args.metrics_log:
+        metrics.open_log(args.metrics_log)
+
+    with metrics.timer('loadInput') as timing:
+        latest_FullFile = latest_input(inputPattern, cache_dir=inputCacheDir)
+        List_df = load_input(latest_FullFile, inputColumns, inputCacheDir, inputEngine, refresh=args.reload_input)
+        timing['rows'] = len(List_df)
+
+    exclude_list = List_df[~(List_df['Column'].str.contains('https://space.confluence.com/', na=False))][['ID', 'DocumentationLink']]
+    possible_df = List_df[~List_df.index.isin(exclude_list.index)].reset_index(drop=True)
+
+    journal = RunJournal(args.journal, resume=args.resume)
+    if args.resume:
+        print("Resuming from " + args.journal + ": " + json.dumps(journal.counts()))
+
+    #Store the Confluence ID for each row
+    #When resuming, rows resolved by the interrupted run keep their page and only the others are resolved
+    links = possible_df['DocumentationLink']
+    resolved_rows = journal.resolved_rows(links)
+    pageIds = pd.Series(resolved_rows, index=links.index, dtype=object)
+    unresolved = links.index.difference(list(resolved_rows))
+    if len(unresolved):
+        title_cache = TitleCache(cacheFile, ttl_days=titleCacheTTLDays, miss_ttl_days=titleMissTTLDays)
+        pageIds[unresolved] = resolveConfIds(links[unresolved], title_cache)
+        title_cache.evict()
+        title_cache.close()
+        journal.record_rows(links[unresolved], pageIds[unresolved])
+    possible_df['ConfluenceID'] = pageIds
+
+    #Rows linking to the same page share one fetch, parse and excel file
+    #Rows whose link did not resolve stay in the link table as 'unresolved'
+    page_links = pageLinks(possible_df, possible_df['ConfluenceID'])
+    rows_linked = int(page_links['PageID'].notna().sum())
+    all_pageIds = page_links['PageID'].dropna().unique()
+    metrics.count('rows_linked', rows_linked)
+    metrics.count('rows_unresolved', len(page_links) - rows_linked)
+    metrics.count('unique_pages', len(all_pageIds))
+    print(str(len(all_pageIds)) + " unique pages linked from " + str(rows_linked) + " rows, " +
+          str(len(page_links) - rows_linked) + " rows unresolved")
+
+    #Pages finished by the interrupted run are not checked or fetched again
+    page_results = {}
+    linked_pageIds = set(all_pageIds)
+    for pageId, record in journal.completed().items():
+        if pageId in linked_pageIds:
+            page_results[pageId] = (record.get("outcome", 'processed'), record["title"])
+    remaining_pageIds = [pageId for pageId in all_pageIds if pageId not in page_results]
+    if args.resume:
+        print(str(len(page_results)) + " pages already done, " + str(len(remaining_pageIds)) + " left")
+
+    #Only pages whose version moved since the last run are fetched again
+    page_cache = PageCache(cacheFile, max_bytes=cacheMaxBytes, max_age_days=cacheMaxAgeDays)
+    server_versions = {}
+    if args.full_refresh:
+        stale_pageIds = set(remaining_pageIds)
+    else:
+        server_versions = fetchVersions(remaining_pageIds)
+        stale_pageIds = set(page_cache.stale(server_versions, remaining_pageIds))
+    print(str(len(stale_pageIds)) + " of " + str(len(remaining_pageIds)) + " pages changed since the last run")
+
+    #Unchanged pages only need their excel file recreated if it has gone missing,
+    #and their rows stored if the store does not hold this version of the page
+    cached_titles = page_cache.titles(set(remaining_pageIds) - stale_pageIds)
+    cached_versions = page_cache.versions() if output_store is not None else {}
+    for pageId, title in cached_titles.items():
+        missing_file = not os.path.exists(outputFileName(pageId, title))
+        missing_store = output_store is not None and output_store.version(pageId) != cached_versions.get(pageId)
+        if missing_file or missing_store:
+            cached = page_cache.get(pageId)
+            if missing_file:
+                writeFromCache(pageId, cached)
+            if missing_store:
+                storeFromCache(pageId, cached, output_store)
+        page_results[pageId] = ('unchanged', title)
+        journal.done(pageId, title, outputFileName(pageId, title), server_versions.get(pageId), outcome='unchanged')
+
+    #Download, parse and write changed pages through the staged pipeline
+    stale_pages = [(row, pageId) for row, pageId in uniquePages(page_links) if pageId in stale_pageIds]
+    journal.pending(pageId for _, pageId in stale_pages)
+    for idx, pageId, htmlPageTitle in processPages(stale_pages, page_cache, store=output_store, journal=journal):
+        page_results[pageId] = ('processed', htmlPageTitle)
+    print("Journal: " + json.dumps(journal.counts()))
+    journal.close()
+
+    #Map every page's result back to the rows linking to it
+    page_links = linkResults(page_links, page_results)
+    with atomicFile(pageLinksFile) as temporary:
+        page_links.to_excel(temporary, index=False, engine='openpyxl')
+    if output_store is not None:
+        output_store.write_links(page_links)
+        output_store.close()
+
+    page_cache.evict()
+    page_cache.close()
+
+    #How close the run came to the server's limits
+    print(json.dumps(getScheduler().counters(), indent=2))
+
+    #Where the time went
+    print(metrics.summary_table())
+    print(ConfluenceMemo.summary_text(metrics.snapshot()["counters"]))
+    if args.metrics_prometheus:
+        metrics.write_prometheus(args.metrics_prometheus)
+    metrics.close_log()
 
-exclude_list = List_df[~(List_df['Column'].str.contains('https://space.confluence.com/', na=False))][['ID', 'DocumentationLink']]
-possible_df = List_df[~List_df.index.isin(exclude_list.index)].reset_index(drop=True)
+#Worker processes import this file again, so the run only starts from the main process
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+'''
+Shared request scheduler for every Confluence call made by ConfluenceRetrieval.py
+Once many pages are fetched in parallel the server starts answering 429 / 503, and those pages used to fail silently.
+Every request goes through RequestScheduler.request, which
+- takes a token from a token bucket so the overall request rate stays under the configured limit
+- caps the number of requests in flight per host, using an AIMD limit that halves on 429 / 503 and grows back on success
+- retries throttled, 5xx, connection failures and timeouts with jittered exponential backoff, honouring Retry-After
+  up to retryAfterMax, so a server asking for a day's pause does not stall a worker for a day
+- gives every request a connect and read timeout, so a hung connection is retried instead of blocking a worker
+- keeps counters so a run can report how close it ran to the limit
+'''
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+
+requestTimeout = (10, 60) #Connect and read timeout in seconds, used when the caller does not pass one
+retryAfterMax = 120.0 #Longest Retry-After honoured, in seconds
+
+###
+# Per host concurrency state
+###
+class _HostState:
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.blocked_until = 0.0 #Set from Retry-After, no new request starts before this time
+        self.condition = threading.Condition()
+
+def parse_retry_after(response):
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+###
+# Scheduler
+###
+class RequestScheduler:
+
+    def __init__(self, rate=20.0, burst=None, initial_concurrency=4, min_concurrency=1, max_concurrency=16,
+                 max_retries=5, backoff_base=0.5, backoff_max=60.0, retry_statuses=(429, 500, 502, 503, 504), timeout=requestTimeout,
+                 retry_after_max=retryAfterMax):
+        '''
+        Args
+        ----
+        rate : float, defaults to 20
+            Requests per second allowed by the token bucket, across all hosts.
+        burst : int, defaults to None
+            Size of the token bucket. Defaults to one second worth of requests.
+        initial_concurrency, min_concurrency, max_concurrency : int
+            Starting, lowest and highest number of requests in flight per host. max_concurrency is the hard per-host cap.
+        max_retries : int, defaults to 5
+            Retries after the first attempt before the last response (or error) is returned to the caller.
+        backoff_base, backoff_max : float
+            Exponential backoff in seconds, base * 2 ** attempt with full jitter, capped at backoff_max.
+        retry_statuses : tuple
+            HTTP statuses that are retried.
+        timeout : tuple or float, defaults to requestTimeout
+            (connect, read) timeout of a request that does not set its own.
+        retry_after_max : float, defaults to retryAfterMax
+            Longest Retry-After, in seconds or as a date, that is waited for; longer ones are cut to this.
+        '''
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = set(retry_statuses)
+        self.timeout = timeout
+        self.retry_after_max = float(retry_after_max)
+
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._bucket_lock = threading.Lock()
+
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+        self._counter_lock = threading.Lock()
+        self._counters = {"requests": 0, "succeeded": 0, "retries": 0, "throttled": 0, "server_errors": 0,
+                          "connection_errors": 0, "failed": 0, "token_wait_seconds": 0.0, "backoff_seconds": 0.0}
+
+    def _count(self, key, amount=1):
+        with self._counter_lock:
+            self._counters[key] += amount
+
+    def _host(self, url):
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostState(min(self.initial_concurrency, self.max_concurrency))
+            return self._hosts[host]
+
+    ###
+    # Token bucket
+    ###
+    def _take_token(self):
+        waited = 0.0
+        while True:
+            with self._bucket_lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+        if waited:
+            self._count("token_wait_seconds", waited)
+
+    ###
+    # AIMD concurrency per host
+    ###
+    def _acquire(self, state):
+        with state.condition:
+            while True:
+                pause = state.blocked_until - time.monotonic()
+                if pause > 0:
+                    state.condition.wait(pause)
+                elif state.in_flight >= max(1, int(state.limit)):
+                    state.condition.wait()
+                else:
+                    break
+            state.in_flight += 1
+            state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+
+    def _release(self, state, throttled, retry_after=None):
+        with state.condition:
+            state.in_flight -= 1
+            if throttled:
+                #Multiplicative decrease
+                state.limit = max(self.min_concurrency, state.limit / 2)
+                if retry_after:
+                    state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+            else:
+                #Additive increase, about one extra slot per limit's worth of successful requests
+                state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+            state.condition.notify_all()
+
+    ###
+    # Retry helpers
+    ###
+    #Seconds to wait from the Retry-After header, capped at retry_after_max; None without a usable header
+    def retry_after(self, response):
+        delay = parse_retry_after(response)
+        return None if delay is None else min(delay, self.retry_after_max)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    ###
+    # Send a request through the scheduler
+    # Returns the final response; a connection error is raised only when every retry failed
+    ###
+    def request(self, session, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        state = self._host(url)
+        attempt = 0
+        while True:
+            self._take_token()
+            self._acquire(state)
+            response = None
+            error = None
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                status = response.status_code if response is not None else None
+                throttled = status in (429, 503)
+                self._release(state, throttled, self.retry_after(response) if throttled else None)
+            self._count("requests")
+
+            if error is None and status not in self.retry_statuses:
+                self._count("succeeded" if status < 400 else "failed")
+                return response
+
+            if error is not None:
+                self._count("connection_errors")
+            elif status == 429:
+                self._count("throttled")
+            else:
+                self._count("server_errors")
+                if status == 503:
+                    self._count("throttled")
+
+            if attempt >= self.max_retries:
+                self._count("failed")
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self.retry_after(response)
+            if delay is None:
+                delay = self.backoff(attempt)
+            self._count("retries")
+            self._count("backoff_seconds", delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, session, url, **kwargs):
+        return self.request(session, 'GET', url, **kwargs)
+
+    ###
+    # Counters, including the current concurrency limit and peak in-flight requests per host
+    ###
+    def counters(self):
+        with self._counter_lock:
+            counters = dict(self._counters)
+        with self._hosts_lock:
+            hosts = dict(self._hosts)
+        counters["hosts"] = {host: {"limit": round(state.limit, 2), "in_flight": state.in_flight,
+                                    "peak_in_flight": state.peak_in_flight, "max_concurrency": self.max_concurrency}
+                             for host, state in hosts.items()}
+        counters["throttle_ratio"] = counters["throttled"] / counters["requests"] if counters["requests"] else 0.0
+        return counters
@@ -0,0 +1,195 @@
+'''
+Index of the ui-expand sections of a Confluence page
+The storage-format document is walked once and every ui-expand macro becomes a SectionNode holding its title,
+nesting depth, parent, child sections and the tables it directly owns.
+The section loop used to call find_parents() and find_all() for every expand, walking the same subtrees again and again;
+it now runs over this index instead.
+The walk works on BeautifulSoup and lxml trees alike through a TreeOps describing how to read an element.
+'''
+from collections import namedtuple
+
+import pandas as pd
+
+#name(element) -> tag name, attr(element, key) -> attribute value or None,
+#children(element) -> element children only, text(element) -> get_text(strip=True)
+#walk(root) -> optional faster generator of ('start' / 'end', element) events, built from children() when not given
+TreeOps = namedtuple('TreeOps', ['name', 'attr', 'children', 'text', 'walk'], defaults=[None])
+
+###
+# One ui-expand section
+###
+class SectionNode:
+
+    def __init__(self, element, parent=None):
+        self.element = element
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.title = None #Text of the first title parameter inside the section, like expand.find('ac:parameter', ...)
+        self.children = []
+        self.tables = [] #Outermost tables whose nearest enclosing section is this one
+        self.first_tbody = None #First <tbody> anywhere inside the section, used by table_extract
+        self.has_table = False #Any table inside the section, nested sections included
+        self.key = None #Hash of the section's raw XML, set by ConfluenceMemo when the memo is on
+
+    #Every nested section in document order
+    def descendants(self):
+        stack = list(reversed(self.children))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def __repr__(self):
+        return 'SectionNode(title=%r, depth=%d, tables=%d, children=%d)' % (self.title, self.depth, len(self.tables), len(self.children))
+
+###
+# All sections of a page
+###
+class SectionIndex:
+
+    def __init__(self):
+        self.roots = [] #Top level sections
+        self.sections = [] #Every section in document order
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+def is_expand(ops, element):
+    return ops.name(element) == 'ac:structured-macro' and ops.attr(element, 'ac:name') == 'ui-expand'
+
+#Depth-first start / end events over the element children
+def walk(root, ops):
+    stack = [(root, False)]
+    while stack:
+        element, leaving = stack.pop()
+        if leaving:
+            yield 'end', element
+            continue
+        yield 'start', element
+        stack.append((element, True))
+        stack.extend((child, False) for child in reversed(ops.children(element)))
+
+###
+# Walk the document once and build the section index
+###
+def build_index(root, ops):
+    index = SectionIndex()
+    open_sections = [] #Sections enclosing the current element, innermost last
+    open_tables = [] #Number of open tables inside each open section
+
+    events = ops.walk(root) if ops.walk is not None else walk(root, ops)
+    for event, element in events:
+        name = ops.name(element)
+
+        if event == 'end':
+            if open_sections and open_sections[-1].element is element:
+                open_sections.pop()
+                open_tables.pop()
+            elif name == 'table' and open_sections:
+                open_tables[-1] -= 1
+            continue
+
+        if is_expand(ops, element):
+            parent = open_sections[-1] if open_sections else None
+            node = SectionNode(element, parent)
+            (parent.children if parent is not None else index.roots).append(node)
+            index.sections.append(node)
+            open_sections.append(node)
+            open_tables.append(0)
+
+        elif name == 'ac:parameter' and ops.attr(element, 'ac:name') == 'title':
+            title_text = None
+            for section in open_sections:
+                if section.title is None:
+                    if title_text is None:
+                        title_text = ops.text(element)
+                    section.title = title_text
+
+        elif name == 'table' and open_sections:
+            if open_tables[-1] == 0:
+                open_sections[-1].tables.append(element)
+            open_tables[-1] += 1
+            for section in reversed(open_sections):
+                if section.has_table:
+                    break
+                section.has_table = True
+
+        elif name == 'tbody':
+            for section in reversed(open_sections):
+                if section.first_tbody is not None:
+                    break
+                section.first_tbody = element
+
+    return index
+
+###
+# Sections that become a sheet, following the rules of the original expand loop:
+#   a section whose title contains 'SomeText' is split into its nested sections, titled "<title> <subtitle>"
+#   any other nested section is skipped, as it is already part of its top level section
+#   a section without any table still gets a row with its title, nested sections of a 'SomeText' section included
+# Yields (section title, node whose table is extracted or None for a title only section)
+###
+def sheet_sources(index):
+    for node in index:
+        title_text = node.title
+
+        #For the specific section that has nested ui-expand
+        if 'SomeText' in title_text:
+            nested_expand = list(node.descendants())
+
+            if len(nested_expand) > 0:
+                for sub_node in nested_expand:
+                    yield title_text + " " + sub_node.title, (sub_node if sub_node.has_table else None)
+            else:
+                yield title_text, (node if node.has_table else None)
+        else:
+            if node.parent is not None:
+                continue
+
+            yield title_text, (node if node.has_table else None)
+
+###
+# One DataFrame per sheet, with the section title in a 'Section' column
+# With a memo (ConfluenceMemo.PageMemo) a section already extracted on another page is not walked again
+###
+def section_tables(index, table_extract, memo=None):
+    if memo is not None:
+        memo.label(index)
+    tables = []
+    for section, node in sheet_sources(index):
+        if node is not None:
+            single_df = table_extract(node.element, node.first_tbody) if memo is None else memo.table(node, table_extract)
+            single_df['Section'] = section
+        else:
+            single_df = pd.DataFrame({'Section': [section]})
+        tables.append(single_df)
+    return tables
+
+###
+# Same sheets as section_tables without building DataFrames
+# Yields (section title, rows) where rows is a generator of lists, header first, with the 'Section' column appended
+###
+def section_rows(index, table_rows, memo=None):
+    if memo is not None:
+        memo.label(index)
+    for section, node in sheet_sources(index):
+        yield section, _rows_with_section(section, node, table_rows, memo)
+
+def _rows_with_section(section, node, table_rows, memo=None):
+    if node is None:
+        yield ['Section']
+        yield [section]
+        return
+
+    rows = table_rows(node.element, node.first_tbody) if memo is None else memo.rows(node, table_rows)
+    header_row = next(rows, [])
+    yield header_row + ['Section']
+    empty = True
+    for parts in rows:
+        empty = False
+        yield parts + [section]
+    if empty:
+        yield [''] * len(header_row) + [section]
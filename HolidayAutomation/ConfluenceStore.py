@@ -0,0 +1,198 @@
+'''
+Consolidated output store for ConfluenceRetrieval.py
+Besides the per-page <pageId>_<title>.xlsx files, every page's summary rows and section tables can be appended to one
+SQLite database so reporting across all documentation is a query instead of reopening thousands of workbooks.
+
+    pages   (page_id, version, title, written_at)
+    summary (page_id, version, row, header, description)
+    cells   (page_id, version, sheet, section, row, column, header, value)
+    links   (row, id, documentation_link, page_id, title, status, output_file), one entry per input row
+
+Writes are per page: the previous rows of the page are replaced in one transaction, so a re-run only rewrites the
+pages that changed and a failed page never leaves half of its rows behind.
+Each process opens its own connection, so pages can be written from the parse processes in streaming mode.
+'''
+import os
+import sqlite3
+import threading
+import time
+
+_batch_size = 500 #Rows inserted per executemany
+
+###
+# Output store
+###
+class OutputStore:
+
+    def __init__(self, path, timeout=60):
+        '''
+        Args
+        ----
+        path : str
+            Location of the SQLite database file. It is created if it does not exist.
+        timeout : float, defaults to 60
+            Seconds to wait for another process to finish writing its page.
+        '''
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock() #One page transaction at a time on this process' connection
+        self._connect_lock = threading.Lock()
+
+    #Connections cannot be shared with forked processes, so a new one is opened per process
+    def _connection(self):
+        with self._connect_lock:
+            if self._conn is None or self._pid != os.getpid():
+                self._open()
+            return self._conn
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        self._pid = os.getpid()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                page_id TEXT PRIMARY KEY,
+                version INTEGER,
+                title TEXT,
+                written_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS summary (
+                page_id TEXT,
+                version INTEGER,
+                row INTEGER,
+                header TEXT,
+                description TEXT
+            );
+            CREATE TABLE IF NOT EXISTS cells (
+                page_id TEXT,
+                version INTEGER,
+                sheet TEXT,
+                section TEXT,
+                row INTEGER,
+                column INTEGER,
+                header TEXT,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS links (
+                row INTEGER,
+                id TEXT,
+                documentation_link TEXT,
+                page_id TEXT,
+                title TEXT,
+                status TEXT,
+                output_file TEXT
+            );
+            CREATE INDEX IF NOT EXISTS summary_page ON summary (page_id);
+            CREATE INDEX IF NOT EXISTS cells_page ON cells (page_id);
+            CREATE INDEX IF NOT EXISTS cells_section ON cells (section);
+        ''')
+
+    def __getstate__(self):
+        return {"path": self.path, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["timeout"])
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def version(self, page_id):
+        row = self._connection().execute('SELECT version FROM pages WHERE page_id = ?', (str(page_id),)).fetchone()
+        return row[0] if row else None
+
+    #Start replacing a page, use as a context manager
+    def page(self, page_id, version, title):
+        return PageWriter(self._connection(), self._lock, str(page_id), int(version), title)
+
+    #Write a page parsed into DataFrames (parsePage output)
+    def write_frames(self, page_id, version, title, summary_df, sheet_names, tables):
+        with self.page(page_id, version, title) as page:
+            page.summary(summary_df.values.tolist())
+            for sheet, table in zip(sheet_names, tables):
+                section = table['Section'].iloc[0] if 'Section' in table.columns and len(table) else sheet
+                for _ in page.rows(sheet, section, [list(table.columns)] + table.values.tolist()):
+                    pass
+
+    #Replace the row -> page link table of the run (see pageLinks in ConfluenceRetrieval)
+    def write_links(self, links_df):
+        columns = ['Row', 'ID', 'DocumentationLink', 'PageID', 'Title', 'Status', 'OutputFile']
+        rows = [tuple(_value(value) for value in row) for row in links_df[columns].itertuples(index=False)]
+        conn = self._connection()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('DELETE FROM links')
+                conn.executemany('INSERT INTO links VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+###
+# Rows of one page, written in a single transaction
+###
+class PageWriter:
+
+    def __init__(self, conn, lock, page_id, version, title):
+        self.conn = conn
+        self.lock = lock
+        self.page_id = page_id
+        self.version = version
+        self.title = title
+        self._pending = []
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute('DELETE FROM summary WHERE page_id = ?', (self.page_id,))
+            self.conn.execute('DELETE FROM cells WHERE page_id = ?', (self.page_id,))
+        except Exception:
+            self.lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is not None:
+                self.conn.execute('ROLLBACK')
+                return False
+            self._flush()
+            self.conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)', (self.page_id, self.version, self.title, time.time()))
+            self.conn.execute('COMMIT')
+            return False
+        finally:
+            self.lock.release()
+
+    def _flush(self):
+        if self._pending:
+            self.conn.executemany('INSERT INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?)', self._pending)
+            self._pending = []
+
+    def summary(self, rows):
+        self.conn.executemany('INSERT INTO summary VALUES (?, ?, ?, ?, ?)',
+                              [(self.page_id, self.version, row_number, _value(row[0]), _value(row[1]))
+                               for row_number, row in enumerate(rows)])
+
+    #Pass rows through while storing them, header first, so the same generator can feed the excel writer
+    def rows(self, sheet, section, rows):
+        header_row = None
+        for row_number, row in enumerate(rows):
+            if header_row is None:
+                header_row = [str(header) for header in row]
+            else:
+                for column, value in enumerate(row):
+                    header = header_row[column] if column < len(header_row) else None
+                    self._pending.append((self.page_id, self.version, sheet, section, row_number - 1, column, header, _value(value)))
+                if len(self._pending) >= _batch_size:
+                    self._flush()
+            yield row
+
+def _value(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return value if isinstance(value, (int, float)) else str(value)
@@ -0,0 +1,284 @@
+'''
+Local stand-in for the Confluence REST API, used by ConfluenceBenchmark.py
+Serves the three endpoints ConfluenceRetrieval.py calls:
+    /rest/api/content/<id>?expand=...               page JSON with a generated storage-format body
+    /rest/api/content?title=...&spaceKey=...        title lookup used by confluenceAPIReq
+    /rest/api/content/search?cql=...                CQL search for "id in (...)" (versions) and "title in (...)" (titles)
+Page <id> is titled "Page <id>" in every space, so title, tiny and pageId links of the same page all resolve to it.
+Latency, 429 injection and the generated page shape are configurable so runs can be repeated without the real server.
+'''
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote_plus
+
+_titleRegex = re.compile(r'^Page (\d+)$', re.IGNORECASE)
+_cqlIdsRegex = re.compile(r'id in \(([^)]*)\)')
+_cqlTitlesRegex = re.compile(r'title in \((.*)\)\s*$')
+_cqlQuotedRegex = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+###
+# Synthetic storage-format pages
+###
+def generate_page(seed=0, sections=10, depth=1, rows=4, columns=3, nested_tables=0.1, content_wrappers=0.15,
+                  lists=0.15, padding=0, merged_cells=0.0, empty_sections=0.0):
+    '''
+    Args
+    ----
+    seed : int, defaults to 0
+        Same seed, same page.
+    sections : int, defaults to 10
+        Top level ui-expand sections. Every fifth one is titled 'SomeText' and holds nested sections.
+    depth : int, defaults to 1
+        Levels of ui-expand nested inside the 'SomeText' sections.
+    rows, columns : int
+        Data rows and columns of each section table.
+    nested_tables, content_wrappers, lists : float
+        Share of the cells holding a nested table, a content-wrapper div (text with a list or a table) and a list.
+    padding : int, defaults to 0
+        Characters of plain text added outside the sections to grow the payload without adding tables.
+    merged_cells : float, defaults to 0.0
+        Share of the nested tables with a colspan and a rowspan cell.
+    empty_sections : float, defaults to 0.0
+        Share of the sections without a table of their own, alternately with no content and with a paragraph only.
+    '''
+    generator = random.Random(seed)
+    shape = {"rows": rows, "columns": columns, "nested_tables": nested_tables,
+             "content_wrappers": content_wrappers, "lists": lists, "merged_cells": merged_cells,
+             "empty_sections": empty_sections}
+
+    parts = ['<table><tbody>',
+             '<tr><th>Owner</th><td>Team %d</td></tr>' % generator.randint(1, 20),
+             '<tr><th>Area</th><td>Benefit %d</td></tr>' % generator.randint(1, 200),
+             '<tr><th>Status</th><td>Active</td></tr>',
+             '</tbody></table>']
+    if padding:
+        parts.append('<p>' + ('lorem ipsum ' * (padding // 12 + 1))[:padding] + '</p>')
+    for number in range(sections):
+        if number % 5 == 4:
+            parts.append(_expand(generator, 'SomeText %d (nested)' % number, depth, shape))
+        else:
+            parts.append(_expand(generator, 'Section %d (detail)' % number, 0, shape))
+    return ''.join(parts)
+
+#The options added after the first ones only draw from generator when set, so existing seeds give the same pages
+def _expand(generator, title, depth, shape):
+    if shape['empty_sections'] and generator.random() < shape['empty_sections']:
+        body = '<p>No entries</p>' if generator.random() < 0.5 else ''
+    else:
+        body = _table(generator, shape['rows'], shape['columns'], shape)
+    for number in range(depth and 2):
+        body += _expand(generator, 'Sub %d' % number, depth - 1, shape)
+    return ('<ac:structured-macro ac:name="ui-expand" ac:schema-version="1">'
+            '<ac:parameter ac:name="title">' + title + '</ac:parameter>'
+            '<ac:rich-text-body>' + body + '</ac:rich-text-body></ac:structured-macro>')
+
+#A nested table always has a <th> per column, stringify_table indexes the headers by column
+def _table(generator, rows, columns, shape=None):
+    html = ['<table><tbody><tr>']
+    html.extend('<th>Header %d</th>' % column for column in range(columns))
+    html.append('</tr>')
+    for _ in range(rows):
+        html.append('<tr>')
+        html.extend('<td>' + (_cell(generator, shape) if shape else 'v%d' % generator.randint(0, 999)) + '</td>'
+                    for _ in range(columns))
+        html.append('</tr>')
+    html.append('</tbody></table>')
+    return ''.join(html)
+
+def _cell(generator, shape):
+    roll = generator.random()
+    if roll < shape['nested_tables']:
+        return _nested_table(generator, shape)
+    roll -= shape['nested_tables']
+    if roll < shape['content_wrappers']:
+        inner = _nested_table(generator, shape) if generator.random() < 0.5 else _list(generator)
+        return '<div class="content-wrapper"><p>Note %d</p>%s</div>' % (generator.randint(0, 99), inner)
+    roll -= shape['content_wrappers']
+    if roll < shape['lists']:
+        return _list(generator)
+    if generator.random() < 0.5:
+        return '<p>Value %d</p><p>Detail <strong>%d</strong></p>' % (generator.randint(0, 999), generator.randint(0, 9))
+    return 'Value %d' % generator.randint(0, 999)
+
+#3 x 3 table with a cell spanning two columns and one spanning two rows
+def _nested_table(generator, shape):
+    if not (shape['merged_cells'] and generator.random() < shape['merged_cells']):
+        return _table(generator, 2, 2)
+    values = ['v%d' % generator.randint(0, 999) for _ in range(4)]
+    return ('<table><tbody><tr><th>Header 0</th><th>Header 1</th><th>Header 2</th></tr>'
+            '<tr><td colspan="2">%s</td><td rowspan="2">%s</td></tr>'
+            '<tr><td>%s</td><td>%s</td></tr></tbody></table>' % tuple(values))
+
+def _list(generator):
+    return '<ul>' + ''.join('<li>Item %d</li>' % generator.randint(0, 99) for _ in range(generator.randint(2, 5))) + '</ul>'
+
+def page_json(page_id, body, version=1):
+    return {
+        "id": str(page_id),
+        "type": "page",
+        "title": "Page " + str(page_id),
+        "history": {"createdBy": {"displayName": "Stub Author"}, "createdDate": "2024-01-01T00:00:00.000Z"},
+        "version": {"number": version, "by": {"displayName": "Stub Editor"}, "when": "2024-06-01T00:00:00.000Z"},
+        "body": {"storage": {"value": body, "representation": "storage"}},
+    }
+
+###
+# Stub server
+###
+class StubConfluence:
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle=0.0, retry_after=None, version=1, page_options=None,
+                 host='127.0.0.1', port=0):
+        '''
+        Args
+        ----
+        latency : float, defaults to 0
+            Seconds added to every response.
+        jitter : float, defaults to 0
+            Extra random seconds, uniform between 0 and jitter.
+        throttle : float, defaults to 0
+            Share of the requests answered with 429 instead of the real response.
+        retry_after : float, defaults to None
+            Retry-After header sent with the 429 responses, omitted when None.
+        version : int, defaults to 1
+            Version number reported for every page.
+        page_options : dict, defaults to None
+            Keyword arguments of generate_page, the page ID is used as the seed.
+        host, port : str, int
+            Address to listen on, port 0 picks a free port.
+        '''
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.version = version
+        self.page_options = page_options or {}
+        self._pages = {} #Encoded page responses, generated once per ID
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self.counters = {"requests": 0, "throttled": 0, "pages": 0, "searches": 0, "bytes": 0}
+
+        stub = self
+        class Handler(_Handler):
+            server_stub = stub
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    #confSearchURL and confContentURL of ConfluenceRetrieval pointing at this server
+    @property
+    def search_url(self):
+        return self.url + '/rest/api/content'
+
+    @property
+    def content_url(self):
+        return self.url + '/rest/api/content/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.counters[key] += amount
+
+    def _throttled(self):
+        with self._lock:
+            return self.throttle > 0 and self._random.random() < self.throttle
+
+    def page(self, page_id):
+        with self._lock:
+            encoded = self._pages.get(page_id)
+        if encoded is None:
+            body = generate_page(seed=int(page_id), **self.page_options)
+            encoded = json.dumps(page_json(page_id, body, self.version)).encode()
+            with self._lock:
+                self._pages[page_id] = encoded
+        return encoded
+
+    def search(self, query):
+        cql = query.get('cql', [''])[0]
+        results = []
+        if 'cql' not in query:
+            #Legacy ?title=...&spaceKey=... lookup
+            match = _titleRegex.match(unquote_plus(query.get('title', [''])[0]))
+            if match:
+                results.append({"id": match.group(1), "type": "page", "title": "Page " + match.group(1)})
+        else:
+            ids = _cqlIdsRegex.search(cql)
+            titles = _cqlTitlesRegex.search(cql)
+            if ids:
+                for page_id in ids.group(1).split(','):
+                    page_id = page_id.strip()
+                    if page_id.isdigit():
+                        results.append({"id": page_id, "type": "page", "title": "Page " + page_id,
+                                        "version": {"number": self.version}})
+            elif titles:
+                for quoted in _cqlQuotedRegex.findall(titles.group(1)):
+                    match = _titleRegex.match(quoted.replace('\\"', '"').replace('\\\\', '\\'))
+                    if match:
+                        results.append({"id": match.group(1), "type": "page", "title": "Page " + match.group(1)})
+        return json.dumps({"results": results, "size": len(results)}).encode()
+
+class _Handler(BaseHTTPRequestHandler):
+    server_stub = None
+    protocol_version = 'HTTP/1.1' #Keep-alive, like the real server
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        stub = self.server_stub
+        stub._count("requests")
+        delay = stub.latency + (random.uniform(0, stub.jitter) if stub.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        if stub._throttled():
+            stub._count("throttled")
+            headers = {} if stub.retry_after is None else {"Retry-After": str(stub.retry_after)}
+            return self._send(429, b'{"message": "Rate limit exceeded"}', headers)
+
+        parts = urlsplit(self.path)
+        path = parts.path.rstrip('/')
+        query = parse_qs(parts.query)
+        if path in ('/rest/api/content', '/rest/api/content/search'):
+            stub._count("searches")
+            return self._send(200, stub.search(query))
+
+        page_id = path.rsplit('/', 1)[-1]
+        if path.startswith('/rest/api/content/') and page_id.isdigit():
+            stub._count("pages")
+            return self._send(200, stub.page(page_id))
+        return self._send(404, b'{"message": "No content found"}')
+
+    def _send(self, status, body, headers=None):
+        self.server_stub._count("bytes", len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,144 @@
+'''
+Renderer for the tables nested inside a cell, used by stringify_table in ConfluenceRetrieval.py and ConfluenceLxml.py
+Nested tables used to go through py_markdown_table: a dict per row keyed by header text, measured again on every call.
+Rows with more <td> than <th> raised an IndexError, rows with fewer (or a table without data rows) a ValueError,
+and duplicate header names silently dropped a column.
+Here a table is read into plain lists of cell texts:
+- colspan / rowspan are expanded into a rectangular grid, the text is repeated in every cell it spans
+- ragged rows are padded with empty cells, duplicate headers are kept as separate columns
+- column widths are measured in one pass over the grid
+The 'grid' format is the text py_markdown_table 1.2 and later produce for regular tables, with the top and bottom
+borders drawn like the row separators (+--+---+). Releases before 1.2 drew those two borders as one run of dashes
+(+------+), so pages saved with an older py_markdown_table differ in those lines only. 'tsv' is a compact alternative.
+Works on BeautifulSoup and lxml trees through the TreeOps of ConfluenceSections.
+'''
+tableFormats = ['grid', 'tsv']
+tableFormat = 'grid'
+
+_maxColspan = 1000 #Same limits as browsers
+_maxRowspan = 65534
+
+#Worker processes do not see the main process' globals, processPages passes the format through this initializer
+def set_format(table_format):
+    global tableFormat
+    if table_format not in tableFormats:
+        raise ValueError("Unknown table format: " + str(table_format))
+    tableFormat = table_format
+
+###
+# Read a table
+###
+
+#Tables directly under element (or element itself), tables nested inside those are part of their cells
+def outer_tables(element, ops):
+    if ops.name(element) == 'table':
+        return [element]
+    tables = []
+    stack = list(reversed(ops.children(element)))
+    while stack:
+        node = stack.pop()
+        if ops.name(node) == 'table':
+            tables.append(node)
+        else:
+            stack.extend(reversed(ops.children(node)))
+    return tables
+
+#Rows of the table itself, not of the tables nested in its cells: (text, colspan, rowspan) for every <th> / <td>
+def table_cells(table, ops):
+    rows = []
+    for child in ops.children(table):
+        name = ops.name(child)
+        if name == 'tr':
+            rows.append(_row_cells(child, ops))
+        elif name in ('thead', 'tbody', 'tfoot'):
+            rows.extend(_row_cells(tr, ops) for tr in ops.children(child) if ops.name(tr) == 'tr')
+    return rows
+
+def _row_cells(tr, ops):
+    return [(ops.text(cell), _span(ops.attr(cell, 'colspan'), _maxColspan), _span(ops.attr(cell, 'rowspan'), _maxRowspan))
+            for cell in ops.children(tr) if ops.name(cell) in ('th', 'td')]
+
+def _span(value, limit):
+    try:
+        return min(max(int(value), 1), limit)
+    except (TypeError, ValueError):
+        return 1
+
+###
+# Expand colspan / rowspan into a grid of texts
+###
+def span_grid(rows):
+    grid = []
+    carried = {} #column -> (text, rows still covered) from rowspans of the rows above
+    for row in rows:
+        line = []
+        next_carried = {}
+        for text, colspan, rowspan in row:
+            _take_carried(line, carried, next_carried)
+            for _ in range(colspan):
+                if rowspan > 1:
+                    next_carried[len(line)] = (text, rowspan - 1)
+                line.append(text)
+        _take_carried(line, carried, next_carried)
+
+        #Rowspans further right than the last cell of this row
+        while carried:
+            line.extend([''] * (min(carried) - len(line)))
+            _take_carried(line, carried, next_carried)
+        carried = next_carried
+        grid.append(line)
+    return grid
+
+def _take_carried(line, carried, next_carried):
+    while len(line) in carried:
+        text, left = carried.pop(len(line))
+        if left > 1:
+            next_carried[len(line)] = (text, left - 1)
+        line.append(text)
+
+###
+# Render
+###
+
+#centerleft padding of py_markdown_table: the extra space of an odd margin goes to the left
+def _center(text, width):
+    right = (width - len(text)) // 2
+    return text.rjust(width - right).ljust(width)
+
+#First row is the header, every row is followed by a +---+ separator, which is also the top border
+def render_grid(grid):
+    if not grid:
+        return ''
+    columns = max(len(row) for row in grid)
+    widths = [0] * columns
+    for row in grid:
+        for column, text in enumerate(row):
+            if len(text) > widths[column]:
+                widths[column] = len(text)
+
+    separator = '+' + '+'.join('-' * width for width in widths) + '+'
+    lines = [separator]
+    for row in grid:
+        cells = row + [''] * (columns - len(row))
+        lines.append('|' + '|'.join(_center(text, width) for text, width in zip(cells, widths)) + '|')
+        lines.append(separator)
+    return '```\n' + '\n'.join(lines) + '```'
+
+#Tab separated lines, tabs and line breaks inside a cell become spaces
+def render_tsv(grid):
+    columns = max((len(row) for row in grid), default=0)
+    return '\n'.join('\t'.join(_tsv_cell(text) for text in row + [''] * (columns - len(row))) for row in grid)
+
+def _tsv_cell(text):
+    return text.replace('\t', ' ').replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+
+def render(grid, table_format=None):
+    if (table_format or tableFormat) == 'tsv':
+        return render_tsv(grid)
+    return render_grid(grid)
+
+###
+# Text of every table under element, one after the other
+###
+def stringify_table(element, ops, table_format=None):
+    return '\n'.join(render(span_grid(table_cells(table, ops)), table_format) for table in outer_tables(element, ops))
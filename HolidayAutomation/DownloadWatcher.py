@@ -0,0 +1,222 @@
+'''
+Download completion watcher for HolidayFileDownloadAutomation.py
+download_wait slept a second per loop, listed the whole directory looking for .crdownload files, and was pointed at the
+working directory instead of the Files download directory, so it mostly ran out its timeout. The export was then picked
+as the newest *.xlsx by creation time, which could be the wrong file when several exports ran together.
+The watcher is started on the download directory before the export is clicked and reports the exact file:
+- Chrome writes <name>.crdownload and renames it to <name> when done, so the rename (or the close of a file written
+  in place) is the event waited for
+- the file must also keep the same size for settle seconds before it is returned
+Events come from inotify on Linux (through ctypes, no package needed), from watchdog when it is installed elsewhere,
+and from a fast scandir poll when neither is available.
+'''
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import queue
+import select
+import struct
+import time
+
+downloadPatterns = ('*.xlsx',)
+ignoredPatterns = ('*.crdownload', '*.tmp', '*.tmp.*', '*.part', '~$*') #Downloads in progress and office lock files
+watcherBackends = ['inotify', 'watchdog', 'poll']
+
+###
+# Event sources, each read(timeout) returns the names of the files closed, moved in or changed since the last call
+###
+
+#Raw inotify: IN_CLOSE_WRITE for files written in place, IN_MOVED_TO for the final rename of a download
+class InotifySource:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    _header = struct.Struct('iIII') #wd, mask, cookie, len
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, 'inotify_add_watch failed for ' + directory)
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset + self._header.size <= len(data):
+            _, _, _, length = self._header.unpack_from(data, offset)
+            offset += self._header.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class WatchdogSource:
+
+    def __init__(self, directory):
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        events = self._events = queue.Queue()
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    events.put(os.path.basename(getattr(event, 'dest_path', '') or event.src_path))
+        self._observer = Observer()
+        self._observer.schedule(Handler(), directory, recursive=False)
+        self._observer.start()
+
+    def read(self, timeout):
+        try:
+            names = [self._events.get(timeout=max(0.0, timeout))]
+        except queue.Empty:
+            return []
+        while not self._events.empty():
+            names.append(self._events.get_nowait())
+        return names
+
+    def close(self):
+        self._observer.stop()
+        self._observer.join()
+
+#Last resort: compare size and modification time of the entries every interval
+class PollSource:
+
+    def __init__(self, directory, interval=0.1):
+        self.directory = directory
+        self.interval = interval
+        self._seen = _entries(directory)
+
+    def read(self, timeout):
+        time.sleep(max(0.0, min(timeout, self.interval)))
+        entries = _entries(self.directory)
+        names = [name for name, state in entries.items() if self._seen.get(name) != state]
+        self._seen = entries
+        return names
+
+    def close(self):
+        pass
+
+def _entries(directory):
+    entries = {}
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if entry.is_file():
+                stat = entry.stat()
+                entries[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return entries
+
+def open_source(directory, backend=None):
+    if backend in (None, 'inotify') and hasattr(select, 'select') and os.name == 'posix':
+        try:
+            return InotifySource(directory)
+        except (OSError, AttributeError):
+            if backend == 'inotify':
+                raise
+    if backend in (None, 'watchdog'):
+        try:
+            return WatchdogSource(directory)
+        except ImportError:
+            if backend == 'watchdog':
+                raise
+    return PollSource(directory)
+
+###
+# Watch a directory for the next finished download
+###
+class DownloadWatcher:
+
+    def __init__(self, directory, patterns=downloadPatterns, settle=0.3, backend=None):
+        '''
+        Args
+        ----
+        directory : str
+            The folder the browser downloads to. It is created if it does not exist.
+        patterns : tuple of str, defaults to downloadPatterns
+            Names of the files waited for.
+        settle : float, defaults to 0.3
+            Seconds the size of a finished file must stay the same before it is returned.
+        backend : str, defaults to None
+            'inotify', 'watchdog' or 'poll'; None picks the first one available.
+        '''
+        self.directory = os.path.abspath(directory)
+        self.patterns = patterns
+        self.settle = settle
+        self.backend = backend
+        self._source = None
+        self._before = {}
+
+    #Start before the download is triggered, files already there and unchanged are never returned
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._before = _entries(self.directory)
+        self._source = open_source(self.directory, self.backend)
+        return self
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def wanted(self, name):
+        return (any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns) and
+                not any(fnmatch.fnmatch(name, pattern) for pattern in ignoredPatterns))
+
+    #Path of the first wanted file that finished and kept its size, TimeoutError after timeout seconds
+    def wait(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        candidates = {} #name -> (size, time the size was last seen changing)
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                raise TimeoutError('No download finished in ' + self.directory + ' within ' + str(timeout) + ' seconds')
+
+            wait_for = deadline - now
+            if candidates:
+                wait_for = min(wait_for, max(0.0, min(since + self.settle for _, since in candidates.values()) - now))
+            for name in self._source.read(wait_for):
+                if self.wanted(name) and name not in candidates:
+                    candidates[name] = (None, time.monotonic())
+
+            now = time.monotonic()
+            for name, (size, since) in list(candidates.items()):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del candidates[name] #Renamed or removed again
+                    continue
+                if self._before.get(name) == (stat.st_size, stat.st_mtime_ns):
+                    del candidates[name] #Touched without changing, not a new download
+                    continue
+                if stat.st_size != size or stat.st_size == 0:
+                    candidates[name] = (stat.st_size, now)
+                elif now - since >= self.settle:
+                    return path
+
+#One-shot form: watch, run trigger (the click starting the download) and wait
+def wait_for_download(directory, trigger, timeout=120, **options):
+    with DownloadWatcher(directory, **options) as watcher:
+        trigger()
+        return watcher.wait(timeout)
@@ -0,0 +1,187 @@
+'''
+Retention of the dated output files, replacing the :cleanup loop of AutoRun.txt
+The loop wrote every base name to a temp file, sorted it, and then ran dir | findstr over the whole folder twice per
+base name to find the newest file and move the others, so a folder of a few thousand dated files took minutes.
+Here the folder is read once with os.scandir:
+- files named <base>_YYYYMMDD.<ext> are grouped by <base>; files without the date suffix are left where they are
+- in each group the latest keep files stay, newest by the date in the name and then by modification time;
+  with max_age_days those dated longer ago are archived too, but the newest file of a group always stays
+- the others are moved to the archive folder with os.replace (a rename, the archive is on the same drive),
+  or with compress appended to one <base>.zip per group and removed
+- every archived file is appended to manifest.jsonl in the archive, one JSON object per line,
+  so what was archived and where can be looked up without listing the archive
+
+    python FileRetention.py <folder> --keep 1 --compress
+    python FileRetention.py <folder> --keep 30 --max-age-days 90
+'''
+import argparse
+import fnmatch
+import json
+import os
+import re
+import time
+import zipfile
+from datetime import date, timedelta
+
+archiveFolder = 'archive'
+manifestFile = 'manifest.jsonl'
+retentionPatterns = ('*.xlsx',)
+keepLatest = 1 #Files kept per base name, AutoRun.txt kept the newest one
+maxAgeDays = None #Days after the date in the name a file is archived even within keepLatest, None for no age limit
+batchSize = 1000 #Files moved before the manifest is written out
+
+_datedName = re.compile(r'^(?P<base>.+)_(?P<date>\d{8})$')
+
+###
+# One pass over the folder: {base name: [(date, mtime, name), ...]}
+###
+def scan(folder, patterns=retentionPatterns):
+    groups = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns):
+                continue
+            match = _datedName.match(os.path.splitext(entry.name)[0])
+            if match is None or not entry.is_file(follow_symlinks=False):
+                continue
+            groups.setdefault(match.group('base'), []).append((match.group('date'), entry.stat().st_mtime, entry.name))
+    return groups
+
+#Names to archive: all but the keep newest of every group, and those dated before max_age_days ago but the newest
+def expired(groups, keep=None, max_age_days=None, today=None):
+    keep = keep if keep is not None else keepLatest
+    max_age_days = max_age_days if max_age_days is not None else maxAgeDays
+    cutoff = None
+    if max_age_days is not None:
+        cutoff = ((today or date.today()) - timedelta(days=max_age_days)).strftime('%Y%m%d')
+    for base, files in groups.items():
+        files.sort(reverse=True)
+        for position, (file_date, _, name) in enumerate(files):
+            if position >= keep or (position > 0 and cutoff is not None and file_date < cutoff):
+                yield base, name
+
+###
+# Archive folder with its manifest
+###
+class Archive:
+
+    def __init__(self, folder, compress=False):
+        '''
+        Args
+        ----
+        folder : str
+            The archive folder. It is created if it does not exist.
+        compress : bool, defaults to False
+            If True, files go into <base>.zip (deflated) in the archive instead of being moved as they are.
+        '''
+        self.folder = folder
+        self.compress = compress
+        self.manifest = os.path.join(folder, manifestFile)
+        self._pending = []
+        os.makedirs(folder, exist_ok=True)
+
+    #A file gone since the scan is skipped; the manifest is written even when a move fails
+    def archive(self, source_folder, moves):
+        moved = 0
+        try:
+            if self.compress:
+                by_base = {}
+                for base, name in moves:
+                    by_base.setdefault(base, []).append(name)
+                for base, names in by_base.items():
+                    for start in range(0, len(names), batchSize):
+                        moved += self._zip(source_folder, base, names[start:start + batchSize])
+            else:
+                for base, name in moves:
+                    try:
+                        os.replace(os.path.join(source_folder, name), os.path.join(self.folder, name))
+                    except FileNotFoundError:
+                        print(name + " is no longer in " + source_folder + ", skipped")
+                        continue
+                    self._record(base, name, name)
+                    moved += 1
+        finally:
+            self.flush()
+        return moved
+
+    #One open of the zip per batch; originals are only removed once the zip is closed.
+    #A name the zip already holds is left in the folder rather than overwritten
+    def _zip(self, source_folder, base, names):
+        location = base + '.zip'
+        with zipfile.ZipFile(os.path.join(self.folder, location), 'a', compression=zipfile.ZIP_DEFLATED) as archive_zip:
+            existing = set(archive_zip.namelist())
+            added = []
+            for name in names:
+                if name in existing:
+                    continue
+                try:
+                    archive_zip.write(os.path.join(source_folder, name), arcname=name)
+                except FileNotFoundError:
+                    print(name + " is no longer in " + source_folder + ", skipped")
+                    continue
+                added.append(name)
+        for name in added:
+            os.remove(os.path.join(source_folder, name))
+            self._record(base, name, location)
+        already = sum(1 for name in names if name in existing)
+        if already:
+            print(str(already) + " files of " + base + " are already in " + location + ", left in place")
+        return len(added)
+
+    def _record(self, base, name, location):
+        self._pending.append({"base": base, "name": name, "location": location, "archived_at": time.time()})
+        if len(self._pending) >= batchSize:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with open(self.manifest, 'a', encoding='utf-8') as manifest_file:
+                manifest_file.write(''.join(json.dumps(record) + '\n' for record in self._pending))
+            self._pending = []
+
+    #{name: record} of the archived files, from the manifest only; a later record of a name wins
+    def index(self, base=None):
+        records = {}
+        try:
+            with open(self.manifest, encoding='utf-8') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if base is None or record["base"] == base:
+                        records[record["name"]] = record
+        except FileNotFoundError:
+            pass
+        return records
+
+###
+# Keep the latest files of every base name in folder and archive the rest
+# Returns the number of files archived; with dry_run nothing is moved and the names are only printed
+###
+def apply_retention(folder, keep=None, archive_folder=None, compress=False, patterns=retentionPatterns, dry_run=False,
+                    max_age_days=None, today=None):
+    archive_folder = archive_folder or os.path.join(folder, archiveFolder)
+    groups = scan(folder, patterns)
+    moves = list(expired(groups, keep, max_age_days, today))
+    print(str(len(groups)) + " base names, " + str(len(moves)) + " files to archive")
+    if dry_run:
+        for _, name in moves:
+            print("Would archive " + name)
+        return 0
+    moved = Archive(archive_folder, compress).archive(folder, moves)
+    print(str(moved) + " files moved to " + archive_folder)
+    return moved
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Keep the latest dated files of every base name and archive the others')
+    arg_parser.add_argument('folder', nargs='?', default='.', help='Folder holding the <base>_YYYYMMDD files')
+    arg_parser.add_argument('--keep', type=int, default=keepLatest, help='Files kept per base name')
+    arg_parser.add_argument('--max-age-days', type=int, default=maxAgeDays, help='Also archive files dated longer ago than this, except the newest')
+    arg_parser.add_argument('--archive', default=None, help='Archive folder, defaults to <folder>/archive')
+    arg_parser.add_argument('--compress', action='store_true', help='Archive into one zip per base name')
+    arg_parser.add_argument('--pattern', action='append', default=None, help='Files looked at, repeat for several (default: *.xlsx)')
+    arg_parser.add_argument('--dry-run', action='store_true', help='Only print what would be archived')
+    args = arg_parser.parse_args()
+    apply_retention(args.folder, args.keep, args.archive, args.compress, tuple(args.pattern or retentionPatterns), args.dry_run,
+                    args.max_age_days)
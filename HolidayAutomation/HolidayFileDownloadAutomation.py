@@ -4,68 +4,52 @@ The Excel will be saved to a designated location.
 Thereafter, ExcelWriter will be used to make some changes to remove private information.
 This is the first part in a series of automation to send a holiday management file
 to assigned person for resource allocation on a weekly basis.
+
+Run it as a script, or import it and call main() / the individual steps.
+Selenium, webdriver_manager and openpyxl are only imported by the steps that need them, so importing this module
+does not start Chrome or load the browser libraries.
+The export is first tried without a browser, posting the site's forms directly (HolidayHttpExport.py);
+Chrome is only started when that fails, or always with --backend selenium.
 '''
 
 import glob
-import time
 import os
 import sys
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium import webdriver
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service
+import argparse
 from datetime import datetime
 from datetime import timedelta
-from dateutil.relativedelta import relativedelta
-from openpyxl import load_workbook
-from openpyxl.worksheet.table import Table
-from openpyxl.utils.cell import get_column_letter
-
-import requests
-import json
-import io
-
-import os.path
-
-#for SSL cert
-import ssl
-import certifi
-from urllib.request import urlopen
-
-#set a watcher for when file is downloading before proceeding to close
-def download_wait(directory, timeout, nfiles=None):
-    '''
-    Wait for downloads to finish with a specified timeout
-
-    Args
-    ----
-    directory : str
-        The path to the folder where the files will be downloaded.
-    timeout : int
-        How many seconds to wait until timing out.
-    nfiles : int, defaults to None
-        If provided, also wait for the expected number of files
-    '''
-    seconds = 0
-    dl_wait = True
-    while dl_wait and seconds < timeout:
-        time.sleep(1)
-        dl_wait = False
-        files = os.listdir(directory)
-        if nfiles and len(files) != nfiles:
-            dl_wait = True
-        
-        for fname in files:
-            if fname.endswith('.crdownload'):
-                dl_wait = True
-        
-        seconds += 1
-    return seconds
+
+#Watcher reporting the exact file of a finished download, see DownloadWatcher.py
+def download_watcher():
+    try:
+        from . import DownloadWatcher
+    except ImportError:
+        import DownloadWatcher
+    return DownloadWatcher
+
+#Cached chromedriver and saved login session, see HolidaySession.py
+def holiday_session():
+    try:
+        from . import HolidaySession
+    except ImportError:
+        import HolidaySession
+    return HolidaySession
+
+#Leave history the weekly file can be written from, see HolidayHistory.py
+def holiday_history():
+    try:
+        from . import HolidayHistory
+    except ImportError:
+        import HolidayHistory
+    return HolidayHistory
+
+#Long windows exported in parallel shards, see HolidayShards.py
+def holiday_shards():
+    try:
+        from . import HolidayShards
+    except ImportError:
+        import HolidayShards
+    return HolidayShards
 
 '''
 Section for downloading from TMF
@@ -77,229 +61,525 @@ myCompanyCode = ''
 myEeId = ''
 myPassword = ''
 
+#Site
+loginURL = 'https://app2.unit4hrms.com/prosoft/web'
+leaveReportURL = "HTML OF BUTTON TO CLICK"
+
+#How the report is exported: 'http' posts the forms without a browser, 'selenium' drives Chrome,
+#'auto' tries http first and falls back to Selenium
+exportBackend = 'auto'
+exportBackends = ['auto', 'http', 'selenium']
+
 #Set the download directory
 temp_directory = ''
-# chrome_options = Options()
-
-chrome_options = webdriver.ChromeOptions()
-chrome_options.add_experimental_option("prefs", {
-    "download.default_directory": os.getcwd() + "\Files\\",
-    "download.prompt_for_download": False,
-    "profile.default_content_settings.popups": 0,
-    "download.directory_upgrade": True,
-    "safebrowsing_for_trusted_sources_enabled": False,
-    "safebrowsing.enabled": False
-})
-chromeLocalStatePrefs = {'browser.enabled_labs_experiments': ['download-bubble@2', 'download-bubble-v2@2']}
-chrome_options.add_experimental_option('localState', chromeLocalStatePrefs)
-
-#Set SSL verify as false
-os.environ['WDM_SSL_VERIFY'] = '0'
-
-sys.path.insert(0, '/usr/lib/chromium-browser/chromedriver')
-
-#Had error where chromedriver doesn't match, so added new one that covers that
-#driver = webdriver.Chrome(options= chrome_options)
-chrome_install = ChromeDriverManager().install()
-folder = os.path.dirname(chrome_install)
-chromedriver_path = os.path.join(folder, "chromedriver.exe")
-chrome_service = webdriver.ChromeService(chromedriver_path)
-driver = webdriver.Chrome(service=chrome_service, options=chrome_options)
-wait = WebDriverWait(driver,20)
-
-#Save this current window handle
-parent_handle = driver.current_window_handle
-
-#Open the page
-driver.get('https://app2.unit4hrms.com/prosoft/web')
-#implicit wait
-driver.implicitly_wait(10) #seconds
-
-LoggedIn = len(driver.find_elements(By.ID, 'ctl00_cph1_lblName_eLeave'))
-tries = 0
-
-while LoggedIn < 1:
-
-    #Identify the company box
-    co_box = driver.find_element(By.ID, 'txtClientCode')
-    #send company information
-    co_box.send_keys(Keys.CONTROL + "a")
-    co_box.send_keys(Keys.DELETE)
-    co_box.send_keys(myCompanyCode)
-    driver.implicitly_wait(3) #seconds
-
-    #Identify the user box
-    id_box = driver.find_element(By.ID, 'txtUserID')
-    #send user information
-    id_box.send_keys(Keys.CONTROL + "a")
-    id_box.send_keys(Keys.DELETE)
-    id_box.send_keys(myEeId)
-    driver.implicitly_wait(3) #seconds
-
-    #identiy the password box
-    password_box = driver.find_element(By.ID, 'txtPassword')
-    #send password information
-    password_box.send_keys(Keys.CONTROL + "a")
-    password_box.send_keys(Keys.DELETE)
-    password_box.send_keys(myPassword)
-    driver.implicitly_wait(3) #seconds
-
-    #Click the button to login
-    driver.find_element(By.NAME, 'btnSignIn').click()
+downloadDirectory = os.path.join(os.getcwd(), 'Files') #Chrome saves the export here
+downloadTimeout = 120 #Seconds to wait for the export to finish downloading
+waitTimeout = 10 #Seconds to wait for an element of the site to show up
+outdir = os.path.join('.', 'Files') #Renamed export
+finaldir = os.path.join('.', 'Files', 'Processed') #Redacted copy
+
+###
+# Chrome with downloads going straight to downloadDirectory
+###
+def build_chrome_options(download_directory=None):
+    from selenium import webdriver
+
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_experimental_option("prefs", {
+        "download.default_directory": os.path.join(download_directory or downloadDirectory, ''),
+        "download.prompt_for_download": False,
+        "profile.default_content_settings.popups": 0,
+        "download.directory_upgrade": True,
+        "safebrowsing_for_trusted_sources_enabled": False,
+        "safebrowsing.enabled": False
+    })
+    chromeLocalStatePrefs = {'browser.enabled_labs_experiments': ['download-bubble@2', 'download-bubble-v2@2']}
+    chrome_options.add_experimental_option('localState', chromeLocalStatePrefs)
+    return chrome_options
+
+###
+# chromedriver matching the installed Chrome, looked up over the network by webdriver_manager
+###
+def resolve_driver():
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    #Set SSL verify as false
+    os.environ['WDM_SSL_VERIFY'] = '0'
+
+    #Had error where chromedriver doesn't match, so added new one that covers that
+    chrome_install = ChromeDriverManager().install()
+    folder = os.path.dirname(chrome_install)
+    return os.path.join(folder, "chromedriver.exe" if sys.platform.startswith('win') else "chromedriver")
+
+#The resolved driver is reused until Chrome moves to a new major version
+def start_driver(chrome_options=None):
+    from selenium import webdriver
+
+    sys.path.insert(0, '/usr/lib/chromium-browser/chromedriver')
+
+    #driver = webdriver.Chrome(options= chrome_options)
+    chromedriver_path = holiday_session().cached_driver(resolve_driver)
+    chrome_service = webdriver.ChromeService(chromedriver_path)
+    return webdriver.Chrome(service=chrome_service, options=chrome_options or build_chrome_options())
+
+###
+# Log in, retrying a few times as the login page does not always take the first attempt
+# The session saved by the last run is tried first; the form is only filled in when the site asks for it.
+# Each step waits for the element it needs (or for the page to change) instead of a fixed implicit wait.
+###
+def login(driver, company_code=None, ee_id=None, password=None, max_tries=5, jar=None):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    wait = WebDriverWait(driver, waitTimeout)
+    logged_in_or_form = EC.any_of(EC.presence_of_element_located((By.ID, 'ctl00_cph1_lblName_eLeave')),
+                                  EC.presence_of_element_located((By.ID, 'txtClientCode')))
+
+    #Open the page, and again with the saved cookies if there are any
+    driver.get(loginURL)
+    if jar is not None and jar.restore_driver(driver):
+        driver.get(loginURL)
+    wait.until(logged_in_or_form)
 
     LoggedIn = len(driver.find_elements(By.ID, 'ctl00_cph1_lblName_eLeave'))
-    print('Still trying to log in...')
-
-    if(tries > 5):
-        break
-
-    tries = tries+1
+    tries = 0
+
+    while LoggedIn < 1:
+
+        #Identify the company box
+        co_box = driver.find_element(By.ID, 'txtClientCode')
+        #send company information
+        co_box.send_keys(Keys.CONTROL + "a")
+        co_box.send_keys(Keys.DELETE)
+        co_box.send_keys(company_code if company_code is not None else myCompanyCode)
+
+        #Identify the user box
+        id_box = driver.find_element(By.ID, 'txtUserID')
+        #send user information
+        id_box.send_keys(Keys.CONTROL + "a")
+        id_box.send_keys(Keys.DELETE)
+        id_box.send_keys(ee_id if ee_id is not None else myEeId)
+
+        #identiy the password box
+        password_box = driver.find_element(By.ID, 'txtPassword')
+        #send password information
+        password_box.send_keys(Keys.CONTROL + "a")
+        password_box.send_keys(Keys.DELETE)
+        password_box.send_keys(password if password is not None else myPassword)
+
+        #Click the button to login, then wait for the posted page to replace the form
+        sign_in = driver.find_element(By.NAME, 'btnSignIn')
+        sign_in.click()
+        wait.until(EC.staleness_of(sign_in))
+        wait.until(logged_in_or_form)
+
+        LoggedIn = len(driver.find_elements(By.ID, 'ctl00_cph1_lblName_eLeave'))
+        print('Still trying to log in...')
+
+        if(tries > max_tries):
+            break
 
-print("Logged in successfully!")
+        tries = tries+1
 
-#Enter the Leave section
-driver.find_element(By.ID, 'ctl00_cph1_lblName_eLeave').click()
+    if LoggedIn < 1:
+        raise RuntimeError('Login failed after ' + str(tries) + ' tries')
+    if jar is not None:
+        jar.save_driver(driver)
+    print("Logged in successfully!")
 
-driver.implicitly_wait(5) #seconds
+###
+# Go to the leave report page
+###
+def open_leave_reports(driver):
+    from selenium.webdriver.common.action_chains import ActionChains
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
 
-action = ActionChains(driver)
+    wait = WebDriverWait(driver, waitTimeout)
 
-#Find the bar menu to hover over
-leave_MenuButton = driver.find_element(By.XPATH, '//*[@id="ctl00_ucHeader1_radm1"]/ul/li[3]/a/span')
-action.move_to_element(leave_MenuButton).perform()
+    #Enter the Leave section
+    wait.until(EC.element_to_be_clickable((By.ID, 'ctl00_cph1_lblName_eLeave'))).click()
 
-driver.implicitly_wait(5) #seconds
+    action = ActionChains(driver)
 
-#find the Leave Reports links
-leave_MenuSecondary = driver.find_element(By.XPATH, '//*[@id="ctl00_ucHeader1_radm1"]/ul/li[3]/div/ul/li/div/div/table/tbody/tr/td[3]/table/tbody/tr[2]/td/a')
+    #Find the bar menu to hover over
+    leave_MenuButton = wait.until(EC.visibility_of_element_located((By.XPATH, '//*[@id="ctl00_ucHeader1_radm1"]/ul/li[3]/a/span')))
+    action.move_to_element(leave_MenuButton).perform()
 
-#click to enter the Leave Section
-#leave_MenuSecondary.click()
-#action.move_to_element(leave_MenuSecondary).perform()
-driver.get("HTML OF BUTTON TO CLICK")
+    #find the Leave Reports links
+    leave_MenuSecondary = wait.until(EC.presence_of_element_located((By.XPATH, '//*[@id="ctl00_ucHeader1_radm1"]/ul/li[3]/div/ul/li/div/div/table/tbody/tr/td[3]/table/tbody/tr[2]/td/a')))
 
-driver.implicitly_wait(5) #seconds
+    #click to enter the Leave Section
+    #leave_MenuSecondary.click()
+    #action.move_to_element(leave_MenuSecondary).perform()
+    driver.get(leaveReportURL)
+    wait.until(EC.presence_of_element_located((By.ID, 'ctl00_cph1_ucDateStartEnd_dpDateStart_input')))
 
 # A new window will open after clicking the button
 # It will take a while to load, hence the implict wait and checking for action taken as the file downloads
 #Because there is a new window, we will close this new window
 #As there is no registered action in selenium, we will wait for 2nd window to load before closing it
-def windowCheckClose():
+#wait_download is called before the window is closed and its result returned, so the download is not cut short
+def windowCheckClose(driver, parent_handle, wait_download=None):
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    wait = WebDriverWait(driver,20)
     wait.until(EC.number_of_windows_to_be(2))
     all_han = driver.window_handles
+    downloaded = None
 
     for window_handle in all_han:
-        download_wait(os.getcwd(), 8, 1)
-
         if(window_handle != parent_handle):
+            if wait_download is not None:
+                downloaded = wait_download()
             driver.switch_to.window(window_handle)
             driver.close()
             break
-    
+
     #switch back to original window
     driver.switch_to.window(parent_handle)
+    return downloaded
 
 '''
 Download the monthly file and change the name
 '''
 
-# Check if current date is Monday Day 0
-# If it is, then take days as of last Friday instead
-now = datetime.now()
-
-if now.weekday() == 0:
-    start_date = now - timedelta(days=3)
-else:
-    start_date = now + timedelta(days = 3) #Get Current sending date + 3 days (for Monday)
-start_date = datetime.now() + timedelta(days = 3)
-start_date_Format = start_date.strftime("%d-%m-%Y")
-print(start_date)
-#Get end date + 1 month
-one_mon_rel = relativedelta(months=1)
-end_date = start_date + one_mon_rel
-end_date_Format = end_date.strftime('%d-%m-%Y')
-print(start_date_Format + " to " + end_date_Format)
-
-#Select start date, clear, and enter variable
-startDate_box = driver.find_element(By.ID, 'ctl00_cph1_ucDateStartEnd_dpDateStart_input')
-#Clear the box of existing date
-startDate_box.clear()
-#Enter in the start Date
-startDate_box.send_keys(start_date_Format)
-
-#Select end date, clear and enter variable
-endDate_box = driver.find_element(By.ID, 'ctl00_cph1_ucDateStartEnd_dpDateEnd_input')
-#Clear the box of existing date
-endDate_box.clear()
-#Enter in the End Date
-endDate_box.send_keys(end_date_Format)
-
-#Download the Reports file
-driver.find_element(By.NAME, 'ctl00$cph1$btnExportToExcelWorkbook').click()
-
-windowCheckClose()
-print("One Month File downloaded")
-
-#Rename the monthly file to make changes for it
-
-#get the list of files
-list_of_files = glob.glob(os.path.join(os.getcwd(), "Files", "*.xlsx"))
-#Get latest file after downloading
-latest_file = max(list_of_files, key=os.path.getctime)
-#currentTimeStamp = datetime.now().strftime('%Y%m%d')
-startDateTimeStamp = start_date.strftime("%Y%m%d")
-print("Now renaming " + latest_file)
-
-outdir = r'.\\Files'
-filename = 'SG_LeaveRecordsReportSingle_' + startDateTimeStamp + '.xlsx'
-dir_filename = os.path.join(outdir, filename)
-if(os.path.exists(dir_filename)):
-    os.remove(dir_filename)
-os.rename(latest_file, dir_filename)
-print("One Month File renamed")
-
-#Close the Chrome browser
-driver.quit()
+###
+# Report window: starts three days from now and runs for one month
+###
+def report_dates(now=None):
+    from dateutil.relativedelta import relativedelta
+
+    # Check if current date is Monday Day 0
+    # If it is, then take days as of last Friday instead
+    now = now or datetime.now()
+
+    if now.weekday() == 0:
+        start_date = now - timedelta(days=3)
+    else:
+        start_date = now + timedelta(days = 3) #Get Current sending date + 3 days (for Monday)
+    start_date = now + timedelta(days = 3)
+    #Get end date + 1 month
+    one_mon_rel = relativedelta(months=1)
+    end_date = start_date + one_mon_rel
+    return start_date, end_date
+
+def export_report(driver, start_date, end_date):
+    from selenium.webdriver.common.by import By
+
+    start_date_Format = start_date.strftime("%d-%m-%Y")
+    end_date_Format = end_date.strftime('%d-%m-%Y')
+    print(start_date_Format + " to " + end_date_Format)
+
+    #Select start date, clear, and enter variable
+    startDate_box = driver.find_element(By.ID, 'ctl00_cph1_ucDateStartEnd_dpDateStart_input')
+    #Clear the box of existing date
+    startDate_box.clear()
+    #Enter in the start Date
+    startDate_box.send_keys(start_date_Format)
+
+    #Select end date, clear and enter variable
+    endDate_box = driver.find_element(By.ID, 'ctl00_cph1_ucDateStartEnd_dpDateEnd_input')
+    #Clear the box of existing date
+    endDate_box.clear()
+    #Enter in the End Date
+    endDate_box.send_keys(end_date_Format)
+
+    #Download the Reports file
+    driver.find_element(By.NAME, 'ctl00$cph1$btnExportToExcelWorkbook').click()
+
+###
+# Rename the download to SG_LeaveRecordsReportSingle_<start date>.xlsx
+# downloaded_file is the file reported by the download watcher; without it the newest *.xlsx is taken
+###
+def report_filename(start_date):
+    return 'SG_LeaveRecordsReportSingle_' + start_date.strftime("%Y%m%d") + '.xlsx'
+
+def rename_download(start_date, download_directory=None, output_directory=None, downloaded_file=None):
+    output_directory = output_directory or outdir
+
+    latest_file = downloaded_file
+    if latest_file is None:
+        #get the list of files
+        list_of_files = glob.glob(os.path.join(download_directory or downloadDirectory, "*.xlsx"))
+        #Get latest file after downloading
+        latest_file = max(list_of_files, key=os.path.getctime)
+    #currentTimeStamp = datetime.now().strftime('%Y%m%d')
+    print("Now renaming " + latest_file)
+
+    filename = report_filename(start_date)
+    dir_filename = os.path.join(output_directory, filename)
+    if(os.path.exists(dir_filename)):
+        os.remove(dir_filename)
+    os.rename(latest_file, dir_filename)
+    print("One Month File renamed")
+    return dir_filename
+
+###
+# Export the report for the window with the chosen backend
+# Returns the path of the export, named by report_filename in outdir (or output_directory)
+# saved_session=False logs in afresh without the saved session, for exports running side by side
+###
+def download_report(start_date=None, end_date=None, backend=None, output_directory=None, download_directory=None, saved_session=True):
+    import requests
+
+    backend = backend or exportBackend
+    if start_date is None:
+        start_date, end_date = report_dates()
+    print(start_date)
+
+    if backend in ('auto', 'http'):
+        try:
+            return download_report_http(start_date, end_date, output_directory, saved_session)
+        except (http_backend().ExportError, requests.RequestException, OSError) as error:
+            if backend == 'http':
+                raise
+            print('Export without a browser failed, using Selenium: ' + repr(error))
+    return download_report_selenium(start_date, end_date, output_directory, download_directory, saved_session)
+
+#One export for the window, or shards of it exported side by side and merged into one
+def export_window(start_date, end_date, backend=None, shards=1, max_parallel=None):
+    if shards and shards > 1:
+        return holiday_shards().download_report_sharded(start_date, end_date, shards, backend, max_parallel)
+    return download_report(start_date, end_date, backend=backend)
+
+def http_backend():
+    try:
+        from . import HolidayHttpExport
+    except ImportError:
+        import HolidayHttpExport
+    return HolidayHttpExport
+
+###
+# Without a browser: log in and post the export form over one session, the workbook is streamed straight to outdir
+###
+def download_report_http(start_date, end_date, output_directory=None, saved_session=True):
+    output_directory = output_directory or outdir
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    dir_filename, size = http_backend().download_report(
+        start_date, end_date, os.path.join(output_directory, report_filename(start_date)),
+        loginURL, leaveReportURL, myCompanyCode, myEeId, myPassword,
+        jar=holiday_session().SessionJar() if saved_session else None)
+    print("One Month File downloaded (" + str(size) + " bytes)")
+    return dir_filename
+
+###
+# Browser part: log in, export the report for the window and rename the download
+###
+def download_report_selenium(start_date, end_date, output_directory=None, download_directory=None, saved_session=True):
+    download_directory = download_directory or downloadDirectory
+    driver = start_driver(build_chrome_options(download_directory))
+    try:
+        #Save this current window handle
+        parent_handle = driver.current_window_handle
+
+        login(driver, jar=holiday_session().SessionJar() if saved_session else None)
+        open_leave_reports(driver)
+
+        #Watch the download directory from before the click, so a quick download cannot finish unseen
+        with download_watcher().DownloadWatcher(download_directory) as watcher:
+            export_report(driver, start_date, end_date)
+            downloaded_file = windowCheckClose(driver, parent_handle, lambda: watcher.wait(downloadTimeout))
+        print("One Month File downloaded: " + downloaded_file)
+
+        #Rename the monthly file to make changes for it
+        return rename_download(start_date, output_directory=output_directory, downloaded_file=downloaded_file)
+    finally:
+        #Close the Chrome browser
+        driver.quit()
 
 '''
 Files has been downloaded
 This section is for processing the downloaded files
 '''
 
-#get the list of files
-list_of_files = glob.glob(os.path.join(os.getcwd(), "Files", "*.xlsx"))
-#Get latest file after downloading
-latest_file = max(list_of_files, key=os.path.getctime)
-currentTimeStamp = datetime.now().strftime('%Y%m%d')
-print("Now processing " + latest_file)
-
-finaldir = r'.\\Files\Processed'
-
-#check if Files directory exists
-if not os.path.exists(outdir):
-    os.mkdir(outdir)
-
-fulldirectory = os.path.join(finaldir,filename)
-
-
-#Check if file has been created before. If not, we create
-if not os.path.exists(fulldirectory):
-    #Using Openpyxl to drop a couple of columns for privacy reasons
-
-    wb = load_workbook(filename=dir_filename)
-    sheet = wb.active
-    #Delete EE number col
-    sheet.delete_cols(idx=1, amount = 1)
-    #Delete some cols
-    sheet.delete_cols(idx=4, amount = 3)
-    sheet.delete_cols(idx=11, amount = 25)
-
-    #make a table
-    table = Table(displayName="HolidayList", ref="A1:" + get_column_letter(sheet.max_column) + str(sheet.max_row))
-    sheet.add_table(table)
-
-    wb.save(filename=fulldirectory)
-    wb.close()
-    print('New copy of One Month saved. Existing Workbook Closed')
-else:
-    print("One Month File" + filename + " has been processed before")
+###
+# Columns kept in the redacted copy: those left by the former delete_cols calls (drop 1, then 4-6, then 11-35 of
+# what remained), so columns 2-4, 8-14 and everything from 40 on, however many columns the export has.
+# keepColumns can name the kept columns by their header instead; when any of them is not in the export,
+# the columns are kept by position as before rather than failing the run.
+###
+keepColumns = None
+legacyDroppedPositions = [1, 5, 6, 7] + list(range(15, 40)) #1-based, in the original export
+
+def legacy_positions(column_count):
+    return [position for position in range(column_count) if position + 1 not in legacyDroppedPositions]
+
+def kept_positions(header, keep_columns=None):
+    keep_columns = keep_columns or keepColumns
+    legacy = legacy_positions(len(header))
+    if not keep_columns:
+        return legacy
+
+    positions = {}
+    for position, name in enumerate(header):
+        if name is not None:
+            positions.setdefault(str(name).strip(), position)
+    missing = [name for name in keep_columns if name not in positions]
+    if missing:
+        print("The export has no column " + ", ".join(missing) + ", keeping the columns by position")
+        return legacy
+    return [positions[name] for name in keep_columns]
+
+###
+# Redacted copy of the export with the HolidayList table, written to finaldir once per export
+# The export is read row by row (read_only) and the kept columns written row by row (write_only) in one pass,
+# so memory stays flat whatever the size of the export. Cell styles of the export are not carried over.
+###
+def redact_report(dir_filename, final_directory=None, keep_columns=None):
+    from openpyxl import load_workbook
+
+    final_directory = final_directory or finaldir
+    filename = os.path.basename(dir_filename)
+    print("Now processing " + dir_filename)
+
+    #check if Processed directory exists
+    if not os.path.exists(final_directory):
+        os.makedirs(final_directory)
+
+    fulldirectory = os.path.join(final_directory,filename)
+
+
+    #Check if file has been created before. If not, we create
+    if not os.path.exists(fulldirectory):
+        #Using Openpyxl to drop a couple of columns for privacy reasons
+        source = load_workbook(filename=dir_filename, read_only=True)
+        try:
+            rows = source.active.iter_rows(values_only=True)
+            header = next(rows, ())
+            positions = kept_positions(header, keep_columns)
+            write_holiday_list(fulldirectory, [header[position] for position in positions],
+                               ([row[position] if position < len(row) else None for position in positions] for row in rows),
+                               sheet_title=source.active.title)
+        finally:
+            source.close()
+        print('New copy of One Month saved. Existing Workbook Closed')
+    else:
+        print("One Month File" + filename + " has been processed before")
+    return fulldirectory
+
+###
+# Weekly file from the leave history
+# Only the near-term dates and those no recent export has covered are exported and merged in, then the whole window is
+# written from the history to finaldir, with the entries that are new, changed or cancelled since the last run
+###
+def changes_filename(start_date):
+    return 'SG_LeaveChanges_' + start_date.strftime("%Y%m%d") + '.xlsx'
+
+def report_from_history(history_file=None, backend=None, start_date=None, end_date=None, final_directory=None, shards=1, max_parallel=None):
+    final_directory = final_directory or finaldir
+    if start_date is None:
+        start_date, end_date = report_dates()
+    if not os.path.exists(final_directory):
+        os.makedirs(final_directory)
+
+    with holiday_history().LeaveHistory(history_file) as history:
+        windows = history.pending_windows(start_date, end_date)
+        if not windows:
+            print("Every date of the window is in the leave history, nothing to export")
+        else:
+            run_ids = []
+            for window_start, window_end in windows:
+                dir_filename = export_window(window_start, window_end, backend, shards, max_parallel)
+                run_ids.append(history.merge_report(dir_filename, window_start, window_end)[0])
+            print("Changes saved to " + history.write_changes(os.path.join(final_directory, changes_filename(start_date)), run_ids))
+        return history.write_report(os.path.join(final_directory, report_filename(start_date)), start_date, end_date)
+
+###
+# Write header and rows to destination as one sheet with an excel table over them
+# Rows are written as they come (write_only), and the workbook is saved under a temporary name first,
+# a half-written copy would count as processed on the next run
+###
+def write_holiday_list(destination, header, rows, sheet_title='Sheet1', table_name='HolidayList'):
+    import warnings
+    from openpyxl import Workbook
+    from openpyxl.worksheet.table import Table, TableColumn
+    from openpyxl.utils.cell import get_column_letter
+
+    target = Workbook(write_only=True)
+    sheet = target.create_sheet(sheet_title)
+
+    kept_header = table_headers(header)
+    sheet.append(kept_header)
+    row_count = 1
+    for row in rows:
+        sheet.append(row)
+        row_count += 1
+
+    #make a table; cells cannot be read back in write_only mode, so its columns are named here
+    table = Table(displayName=table_name, ref="A1:" + get_column_letter(len(kept_header)) + str(row_count))
+    table.tableColumns = [TableColumn(id=number, name=name) for number, name in enumerate(kept_header, start=1)]
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='In write-only mode you must add table columns manually')
+        sheet.add_table(table)
+
+    root, extension = os.path.splitext(destination)
+    temporary = root + '.tmp' + extension
+    target.save(temporary)
+    os.replace(temporary, destination)
+    return destination
+
+#Table column names must be unique, non-empty text; repeated names get a number like Excel gives them
+def table_headers(names):
+    headers = []
+    seen = set()
+    for number, name in enumerate(names, start=1):
+        name = str(name) if name is not None and str(name) != '' else 'Column' + str(number)
+        unique_name = name
+        suffix = 2
+        while unique_name in seen:
+            unique_name = name + str(suffix)
+            suffix += 1
+        seen.add(unique_name)
+        headers.append(unique_name)
+    return headers
+
+################
+# Run the code #
+################
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Download the holiday report and save a redacted copy')
+    arg_parser.add_argument('--redact-only', default=None, help='Skip the download and only redact this export')
+    arg_parser.add_argument('--backend', choices=exportBackends, default=exportBackend, help='How the report is exported')
+    arg_parser.add_argument('--fresh-login', action='store_true', help='Forget the saved session and log in again')
+    arg_parser.add_argument('--history', nargs='?', const='', default=None, metavar='FILE',
+                            help='Keep a leave history (LeaveHistory.db by default), export only the dates it does not cover '
+                                 'and write the weekly file from it')
+    arg_parser.add_argument('--start', type=lambda text: datetime.strptime(text, '%d-%m-%Y'), default=None,
+                            help='First date of the window (dd-mm-yyyy) instead of three days from now')
+    arg_parser.add_argument('--end', type=lambda text: datetime.strptime(text, '%d-%m-%Y'), default=None,
+                            help='Last date of the window (dd-mm-yyyy), defaults to one month after the start')
+    arg_parser.add_argument('--shards', type=int, default=1, help='Export the window in this many parts side by side')
+    arg_parser.add_argument('--max-parallel', type=int, default=None, help='Shards exported at the same time')
+    args = arg_parser.parse_args(argv)
+
+    if args.fresh_login:
+        holiday_session().SessionJar().clear()
+
+    start_date, end_date = report_dates()
+    if args.start is not None:
+        from dateutil.relativedelta import relativedelta
+        start_date = args.start
+        end_date = args.end or start_date + relativedelta(months=1)
+    elif args.end is not None:
+        end_date = args.end
+
+    if args.history is not None and not args.redact_only:
+        return report_from_history(args.history or None, args.backend, start_date, end_date,
+                                   shards=args.shards, max_parallel=args.max_parallel)
+
+    dir_filename = args.redact_only or export_window(start_date, end_date, args.backend, args.shards, args.max_parallel)
+    if args.history is not None:
+        with holiday_history().LeaveHistory(args.history or None) as history:
+            history.merge_report(dir_filename)
+    return redact_report(dir_filename)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+'''
+Incremental leave history for HolidayFileDownloadAutomation.py
+Every weekly run exported a whole month from three days ahead, so three weeks of it had already been downloaded and
+redacted the week before, and nothing told what had changed since.
+The history is one SQLite database of the leave entries, with only the columns kept in the redacted copy:
+
+    leave    (employee, leave_type, date_from, day_type, values, row_hash, state, first_seen, last_seen, date_to)
+    coverage (window_start, window_end, exported_at, source)     date windows an export has listed completely
+    changes  (run_id, change, employee, leave_type, date_from, day_type, before, after)
+    runs     (run_id, started, window_start, window_end, source, new, changed, cancelled, unchanged)
+
+An entry is keyed by employee name, leave type, start date and day type (two half days on the same date are two entries).
+Each export is merged in as an upsert in one transaction, comparing a hash of the kept values:
+- new: the key was never seen, or was cancelled and is listed again
+- changed: the values differ from the stored ones (status, dates, number of days, ...)
+- cancelled: the status turned Cancelled, or an entry overlapping the exported window is no longer listed
+Dates covered by an export in the last coverageMaxAgeDays are not exported again (pending_windows), except the next
+refreshDays, where leave is still being booked and cancelled, which are exported on every run. The weekly file is
+written from the history instead of from the export, with the changes of the run as a by-product; it lists the
+leave overlapping the window, like the export does.
+'''
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+historyFile = 'LeaveHistory.db'
+coverageMaxAgeDays = 28 #Dates covered longer ago than this are exported again
+refreshDays = 14 #Dates up to this many days from today are exported on every run
+cancelledStatus = 'Cancelled'
+changeKinds = ['new', 'changed', 'cancelled']
+
+#Columns of the export kept for each entry, found by their header; the same columns the redacted copy keeps
+historyColumns = ['Employee Name', 'Department', 'Designation', 'Leave Type', 'Date From', 'Date To', 'Day Type',
+                  'No. of Days', 'Status', 'Applied Date', 'Last Updated']
+
+#Columns of the kept values the key is made of
+employeeColumn = 'Employee Name'
+leaveTypeColumn = 'Leave Type'
+dateFromColumn = 'Date From'
+dateToColumn = 'Date To'
+dayTypeColumn = 'Day Type'
+statusColumn = 'Status'
+
+_dateFormats = ['%d-%m-%Y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y %H:%M:%S', '%d %b %Y']
+
+###
+# Dates as they come out of the export: datetime cells, or text the way the site shows it
+###
+def as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    text = str(value or '').strip()
+    for date_format in _dateFormats:
+        try:
+            return datetime.datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+#Values are kept as JSON; excel dates are tagged so they are written back as dates
+def _encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return {"date": value.isoformat()}
+    return value
+
+def _decode(value):
+    if isinstance(value, dict) and "date" in value:
+        return datetime.datetime.fromisoformat(value["date"])
+    return value
+
+def _dumps(values):
+    return json.dumps([_encode(value) for value in values], default=str, ensure_ascii=False)
+
+def _loads(text):
+    return [_decode(value) for value in json.loads(text)] if text else None
+
+###
+# Leave history store
+###
+class LeaveHistory:
+
+    def __init__(self, path=None, columns=None, timeout=60):
+        '''
+        Args
+        ----
+        path : str, defaults to historyFile
+            Location of the SQLite database file. It is created if it does not exist.
+        columns : list of str, defaults to historyColumns
+            Columns kept for each entry, found by their header in the export. They must include the key columns.
+        timeout : float, defaults to 60
+            Seconds to wait for another process to finish merging its export.
+        '''
+        self.path = path or historyFile
+        self.columns = list(columns or historyColumns)
+        self.timeout = timeout
+        missing = [column for column in (employeeColumn, leaveTypeColumn, dateFromColumn, dateToColumn, dayTypeColumn, statusColumn)
+                   if column not in self.columns]
+        if missing:
+            raise ValueError("The history needs the columns " + ", ".join(missing))
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS leave (
+                    employee TEXT,
+                    leave_type TEXT,
+                    date_from TEXT,
+                    day_type TEXT,
+                    "values" TEXT,
+                    row_hash TEXT,
+                    state TEXT,
+                    first_seen REAL,
+                    last_seen REAL,
+                    date_to TEXT,
+                    PRIMARY KEY (employee, leave_type, date_from, day_type)
+                );
+                CREATE TABLE IF NOT EXISTS coverage (
+                    window_start TEXT,
+                    window_end TEXT,
+                    exported_at REAL,
+                    source TEXT
+                );
+                CREATE TABLE IF NOT EXISTS changes (
+                    run_id INTEGER,
+                    change TEXT,
+                    employee TEXT,
+                    leave_type TEXT,
+                    date_from TEXT,
+                    day_type TEXT,
+                    before TEXT,
+                    after TEXT
+                );
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started REAL,
+                    window_start TEXT,
+                    window_end TEXT,
+                    source TEXT,
+                    new INTEGER,
+                    changed INTEGER,
+                    cancelled INTEGER,
+                    unchanged INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS leave_date ON leave (date_from);
+                CREATE INDEX IF NOT EXISTS changes_run ON changes (run_id);
+            ''')
+            #Histories written before date_to was kept; their entries count as one-day leave until listed again
+            if 'date_to' not in [column[1] for column in self._conn.execute('PRAGMA table_info(leave)')]:
+                self._conn.execute('ALTER TABLE leave ADD COLUMN date_to TEXT')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ###
+    # Coverage
+    ###
+
+    #Dates of start_date..end_date to export, as consecutive (start, end) windows; empty when the history holds them all.
+    #A date is taken from the history when an export listed it in the last max_age_days and it is more than
+    #refresh_days from today
+    def pending_windows(self, start_date, end_date, max_age_days=None, refresh_days=None, today=None):
+        max_age_days = max_age_days if max_age_days is not None else coverageMaxAgeDays
+        refresh_days = refresh_days if refresh_days is not None else refreshDays
+        start, end = as_date(start_date), as_date(end_date)
+        refresh_until = as_date(today or datetime.date.today()) + datetime.timedelta(days=refresh_days)
+        covered = self._connection().execute(
+            'SELECT window_start, window_end, exported_at FROM coverage WHERE window_end >= ? AND window_start <= ? AND exported_at >= ?',
+            (start.isoformat(), end.isoformat(), time.time() - max_age_days * 86400)).fetchall()
+
+        windows = []
+        reused = []
+        day = start
+        while day <= end:
+            iso = day.isoformat()
+            ages = [exported_at for window_start, window_end, exported_at in covered if window_start <= iso <= window_end]
+            if ages and day > refresh_until:
+                reused.append((day, max(ages)))
+            elif windows and windows[-1][1] == day - datetime.timedelta(days=1):
+                windows[-1][1] = day
+            else:
+                windows.append([day, day])
+            day += datetime.timedelta(days=1)
+
+        if reused:
+            oldest = min(exported_at for _, exported_at in reused)
+            print("Leave history: " + str(len(reused)) + " dates of the window taken from earlier exports, the oldest " +
+                  str(round((time.time() - oldest) / 86400, 1)) + " days ago")
+        return [(_like(start_date, window_start), _like(end_date, window_end)) for window_start, window_end in windows]
+
+    ###
+    # Merge an export
+    ###
+    def merge_report(self, path, start_date=None, end_date=None):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(filename=path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, ())
+            positions = self.positions(header)
+            return self.merge_rows(([row[position] if position < len(row) else None for position in positions] for row in rows),
+                                   start_date, end_date, source=os.path.basename(path))
+        finally:
+            workbook.close()
+
+    #Positions of self.columns in the export header; unlike the redacted copy the history cannot fall back on
+    #positions, its key needs the named columns
+    def positions(self, header):
+        names = {}
+        for position, name in enumerate(header):
+            if name is not None:
+                names.setdefault(str(name).strip(), position)
+        missing = [column for column in self.columns if column not in names]
+        if missing:
+            raise ValueError("The export has no column " + ", ".join(missing) + "; columns are " + ", ".join(map(str, header)))
+        return [names[column] for column in self.columns]
+
+    #rows hold the values of self.columns in order. With a window, entries overlapping it that are not listed are
+    #cancelled and the window counts as covered; without one (a single file merged by hand) nothing is cancelled.
+    #Returns the run id and the number of entries per kind of change
+    def merge_rows(self, rows, start_date=None, end_date=None, source=None):
+        index = {column: position for position, column in enumerate(self.columns)}
+        start, end = as_date(start_date), as_date(end_date)
+
+        listed = {}
+        for values in rows:
+            values = list(values)
+            if all(value is None or value == '' for value in values):
+                continue
+            date_from = as_date(values[index[dateFromColumn]])
+            key = (str(values[index[employeeColumn]] or ''), str(values[index[leaveTypeColumn]] or ''),
+                   date_from.isoformat() if date_from else str(values[index[dateFromColumn]] or ''),
+                   str(values[index[dayTypeColumn]] or ''))
+            date_to = as_date(values[index[dateToColumn]]) or date_from
+            listed[key] = (values, date_to.isoformat() if date_to else key[2])
+
+        conn = self._connection()
+        now = time.time()
+        counts = dict.fromkeys(changeKinds + ['unchanged'], 0)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            run_id = conn.execute('INSERT INTO runs (started, window_start, window_end, source) VALUES (?, ?, ?, ?)',
+                                  (now, start and start.isoformat(), end and end.isoformat(), source)).lastrowid
+            stored = self._stored(conn, listed, start, end)
+            upserts = []
+            changes = []
+
+            for key, (values, date_to) in listed.items():
+                row_hash = hashlib.blake2b(_dumps(values).encode('utf-8'), digest_size=16).hexdigest()
+                cancelled = str(values[index[statusColumn]] or '').strip() == cancelledStatus
+                state = 'cancelled' if cancelled else 'active'
+                previous = stored.get(key)
+                first_seen = previous[3] if previous is not None else now
+                if previous is None or (previous[2] == 'cancelled' and not cancelled):
+                    change = 'new'
+                elif previous[1] == row_hash:
+                    change = None
+                elif cancelled and previous[2] != 'cancelled':
+                    change = 'cancelled'
+                else:
+                    change = 'changed'
+                upserts.append(key + (_dumps(values), row_hash, state, first_seen, now, date_to))
+                if change is None:
+                    counts['unchanged'] += 1
+                else:
+                    counts[change] += 1
+                    changes.append((run_id, change) + key + (previous[0] if previous else None, _dumps(values)))
+
+            #Listed before overlapping the window, gone from this export
+            if start is not None and end is not None:
+                for key, (values_text, row_hash, state, first_seen, date_to) in stored.items():
+                    if key not in listed and state != 'cancelled' and key[2] <= end.isoformat() and date_to >= start.isoformat():
+                        upserts.append(key + (values_text, row_hash, 'cancelled', first_seen, now, date_to))
+                        changes.append((run_id, 'cancelled') + key + (values_text, None))
+                        counts['cancelled'] += 1
+                conn.execute('INSERT INTO coverage VALUES (?, ?, ?, ?)', (start.isoformat(), end.isoformat(), now, source))
+
+            conn.executemany('INSERT OR REPLACE INTO leave (employee, leave_type, date_from, day_type, "values", row_hash, state, '
+                             'first_seen, last_seen, date_to) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', upserts)
+            conn.executemany('INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)', changes)
+            conn.execute('UPDATE runs SET new = ?, changed = ?, cancelled = ?, unchanged = ? WHERE run_id = ?',
+                         (counts['new'], counts['changed'], counts['cancelled'], counts['unchanged'], run_id))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        print("Leave history: " + ", ".join(str(count) + " " + kind for kind, count in counts.items()))
+        return run_id, counts
+
+    #{key: (values, row_hash, state, first_seen, date_to)} of the stored entries listed in the export or overlapping its window
+    def _stored(self, conn, listed, start, end):
+        dates = [key[2] for key in listed] + [date_to for _, date_to in listed.values()]
+        if start is not None and end is not None:
+            dates += [start.isoformat(), end.isoformat()]
+        if not dates:
+            return {}
+        low, high = min(dates), max(dates)
+        return {tuple(row[:4]): tuple(row[4:]) for row in conn.execute(
+            'SELECT employee, leave_type, date_from, day_type, "values", row_hash, state, first_seen, COALESCE(date_to, date_from) '
+            'FROM leave WHERE date_from <= ? AND COALESCE(date_to, date_from) >= ?', (high, low))}
+
+    ###
+    # Reading back
+    ###
+
+    #Kept values of the entries overlapping the window, ordered by date and employee
+    def entries(self, start_date, end_date, include_cancelled=True):
+        query = 'SELECT "values" FROM leave WHERE date_from <= ? AND COALESCE(date_to, date_from) >= ?'
+        if not include_cancelled:
+            query += " AND state != 'cancelled'"
+        query += ' ORDER BY date_from, employee, leave_type, day_type'
+        for (values_text,) in self._connection().execute(query, (as_date(end_date).isoformat(), as_date(start_date).isoformat())):
+            yield _loads(values_text)
+
+    #The weekly file: the entries of the window as the redacted copy with the HolidayList table
+    def write_report(self, destination, start_date, end_date):
+        _download_automation().write_holiday_list(destination, self.columns, self.entries(start_date, end_date))
+        return destination
+
+    def last_run(self):
+        row = self._connection().execute('SELECT MAX(run_id) FROM runs').fetchone()
+        return row[0] if row else None
+
+    #Changes of a run or a list of runs (the last one by default): one row per entry with its values after the change,
+    #or before it for entries no longer listed
+    def changes(self, run_ids=None):
+        run_ids = run_ids if run_ids is not None else self.last_run()
+        run_ids = list(run_ids) if isinstance(run_ids, (list, tuple)) else [run_ids]
+        for change, before, after in self._connection().execute(
+                'SELECT change, before, after FROM changes WHERE run_id IN (' + ', '.join('?' * len(run_ids)) + ') '
+                'ORDER BY date_from, employee, leave_type, day_type, run_id', run_ids):
+            before, after = _loads(before), _loads(after)
+            values = after or before
+            changed_columns = [column for column, old, new in zip(self.columns, before or [], after or []) if old != new]
+            yield [change] + values + [", ".join(changed_columns)]
+
+    def write_changes(self, destination, run_ids=None):
+        _download_automation().write_holiday_list(destination, ['Change'] + self.columns + ['Changed Columns'],
+                                                  self.changes(run_ids), sheet_title='Changes', table_name='LeaveChanges')
+        return destination
+
+def _like(original, date):
+    if isinstance(original, datetime.datetime):
+        return datetime.datetime.combine(date, original.time())
+    return date
+
+def _download_automation():
+    try:
+        from . import HolidayFileDownloadAutomation
+    except ImportError:
+        import HolidayFileDownloadAutomation
+    return HolidayFileDownloadAutomation
@@ -0,0 +1,239 @@
+'''
+Browserless export of the leave report, used by HolidayFileDownloadAutomation.py
+Starting Chrome, typing the login, hovering the menus and waiting on the export popup took 30-60 seconds and a few
+hundred MB of memory per run. The site is an ASP.NET WebForms application, so the same steps are plain form posts:
+- GET the login page and post its form back with the credentials and btnSignIn
+- GET the leave report page and post its form back with the date range and the export button
+- stream the workbook of the export response to disk, renamed into place once complete
+Every post carries the hidden fields of the page it came from (__VIEWSTATE, __EVENTVALIDATION, ...), like the browser does.
+All requests go over one pooled requests session, which also keeps the ASP.NET session cookie.
+ExportError is raised whenever the site does not answer the way the browser would see it, so the caller can fall back to Selenium.
+HolidayStub.py serves the same pages locally.
+'''
+import json
+import os
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+#IDs of the elements the Selenium steps use
+loggedInMarker = 'ctl00_cph1_lblName_eLeave'
+loginFieldIds = ('txtClientCode', 'txtUserID', 'txtPassword')
+signInButton = 'btnSignIn'
+startDateId = 'ctl00_cph1_ucDateStartEnd_dpDateStart_input'
+endDateId = 'ctl00_cph1_ucDateStartEnd_dpDateEnd_input'
+exportButton = 'ctl00$cph1$btnExportToExcelWorkbook'
+
+requestTimeout = (10, 300) #Connect and read timeout in seconds, the export can take a while to build
+chunkSize = 64 * 1024
+
+class ExportError(Exception):
+    pass
+
+###
+# Fields of the first form of a page, as the browser would post them
+###
+class Form:
+
+    def __init__(self, action):
+        self.action = action
+        self.fields = {} #name -> value of every successful control, hidden fields included
+        self.buttons = {} #name -> value of the submit buttons, only the clicked one is posted
+        self.ids = {} #element id -> control name
+
+    def name_of(self, element_id, default=None):
+        return self.ids.get(element_id, default)
+
+class _FormParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.form = None
+        self._in_form = False
+        self._select = None #[name, first option value, selected option value]
+        self._option = None #[value or None, text] of the open <option>
+        self._textarea = None #[name, text]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            if self.form is None:
+                self.form = Form(attrs.get('action') or '')
+                self._in_form = True
+            return
+        if not self._in_form:
+            return
+
+        name = attrs.get('name')
+        if name and attrs.get('id'):
+            self.form.ids[attrs['id']] = name
+        if tag == 'input' and name:
+            input_type = (attrs.get('type') or 'text').lower()
+            if input_type in ('submit', 'button', 'image', 'reset'):
+                self.form.buttons[name] = attrs.get('value') or ''
+            elif input_type in ('checkbox', 'radio'):
+                if 'checked' in attrs:
+                    self.form.fields[name] = attrs.get('value') or 'on'
+            elif input_type != 'file' and 'disabled' not in attrs:
+                self.form.fields[name] = attrs.get('value') or ''
+        elif tag == 'select' and name:
+            self._select = [name, None, None]
+        elif tag == 'option' and self._select is not None:
+            self._option = [attrs.get('value'), '']
+            if 'selected' in attrs:
+                self._select[2] = self._option
+            if self._select[1] is None:
+                self._select[1] = self._option
+        elif tag == 'textarea' and name:
+            self._textarea = [name, '']
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option[1] += data
+        elif self._textarea is not None:
+            self._textarea[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._in_form = False
+        elif tag == 'option':
+            self._option = None
+        elif tag == 'select' and self._select is not None:
+            name, first, selected = self._select
+            option = selected or first
+            if option is not None:
+                self.form.fields[name] = option[0] if option[0] is not None else option[1].strip()
+            self._select = None
+        elif tag == 'textarea' and self._textarea is not None:
+            self.form.fields[self._textarea[0]] = self._textarea[1]
+            self._textarea = None
+
+def read_form(response):
+    parser = _FormParser()
+    parser.feed(response.text)
+    parser.close()
+    if parser.form is None:
+        raise ExportError('No form on ' + response.url)
+    parser.form.action = urljoin(response.url, parser.form.action or response.url)
+    return parser.form
+
+###
+# Pooled session with retries on the idempotent GETs
+###
+def get_session(pool_size=4):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = 'Mozilla/5.0 (HolidayFileDownloadAutomation)'
+    return session
+
+#Post a form back to its page, clicking button when given
+def postback(session, form, button=None, stream=False):
+    fields = dict(form.fields)
+    if button is not None:
+        if button not in form.buttons:
+            raise ExportError('No button ' + button + ' on the page posting to ' + form.action)
+        fields[button] = form.buttons[button]
+    response = session.post(form.action, data=fields, timeout=requestTimeout, stream=stream)
+    response.raise_for_status()
+    return response
+
+###
+# Log in, retrying a few times with a fresh form like the Selenium login
+###
+def login(session, login_url, company_code, ee_id, password, max_tries=3):
+    for tries in range(max_tries):
+        response = session.get(login_url, timeout=requestTimeout)
+        response.raise_for_status()
+        if loggedInMarker in response.text:
+            return response #Session cookie still valid
+
+        form = read_form(response)
+        for element_id, value in zip(loginFieldIds, (company_code, ee_id, password)):
+            form.fields[form.name_of(element_id, element_id)] = value
+        response = postback(session, form, form.name_of(signInButton, signInButton))
+        if loggedInMarker in response.text:
+            print("Logged in successfully!")
+            return response
+        print('Still trying to log in...')
+    raise ExportError('Login failed after ' + str(max_tries) + ' tries')
+
+###
+# Date range fields of the report form
+# The text box takes the date the way it is typed in the browser (dd-mm-yyyy). A date picker also keeps the date in a
+# hidden field named after it and in a JSON client state; those are updated too when the page has them.
+###
+def set_date(form, element_id, date):
+    name = form.name_of(element_id)
+    if name is None:
+        raise ExportError('No date field ' + element_id + ' on the report page')
+    form.fields[name] = date.strftime('%d-%m-%Y')
+
+    picker_id = element_id[:-len('_input')] if element_id.endswith('_input') else element_id
+    picker_name = form.name_of(picker_id)
+    if picker_name is not None and picker_name != name:
+        form.fields[picker_name] = date.strftime('%Y-%m-%d')
+
+    for state_id, state_name in form.ids.items():
+        if state_id.startswith(picker_id) and state_id.endswith('_ClientState') and form.fields.get(state_name):
+            try:
+                state = json.loads(form.fields[state_name])
+            except ValueError:
+                continue
+            if isinstance(state, dict) and 'validationText' in state:
+                state['validationText'] = state['valueAsString'] = date.strftime('%Y-%m-%d-00-00-00')
+                state['lastSetTextBoxValue'] = date.strftime('%d-%m-%Y')
+                form.fields[state_name] = json.dumps(state, separators=(',', ':'))
+
+###
+# Export the report for the window and stream it to destination
+# Returns the path written and its size
+###
+def export_report(session, report_url, start_date, end_date, destination):
+    response = session.get(report_url, timeout=requestTimeout)
+    response.raise_for_status()
+    form = read_form(response)
+    set_date(form, startDateId, start_date)
+    set_date(form, endDateId, end_date)
+    print(start_date.strftime("%d-%m-%Y") + " to " + end_date.strftime('%d-%m-%Y'))
+
+    with postback(session, form, exportButton, stream=True) as response:
+        chunks = response.iter_content(chunk_size=chunkSize)
+        first_chunk = next(chunks, b'')
+        #A workbook is a zip file; anything else is the page again, with an error or an expired session
+        if not first_chunk.startswith(b'PK'):
+            raise ExportError('Export did not return a workbook (' + response.headers.get('Content-Type', 'no content type') + ')')
+
+        root, extension = os.path.splitext(destination)
+        temporary = root + '.tmp' + extension
+        size = len(first_chunk)
+        try:
+            with open(temporary, 'wb') as workbook_file:
+                workbook_file.write(first_chunk)
+                for chunk in chunks:
+                    workbook_file.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        os.replace(temporary, destination)
+    return destination, size
+
+###
+# Log in and export in one session
+# With a jar (HolidaySession.SessionJar) the saved cookies are tried first and the session is saved after login
+###
+def download_report(start_date, end_date, destination, login_url, report_url, company_code, ee_id, password, session=None, jar=None):
+    session = session or get_session()
+    if jar is not None:
+        jar.restore_session(session)
+    login(session, login_url, company_code, ee_id, password)
+    if jar is not None:
+        jar.save_session(session)
+    return export_report(session, report_url, start_date, end_date, destination)
@@ -0,0 +1,214 @@
+'''
+Start-up fast path for HolidayFileDownloadAutomation.py
+Every run used to resolve a chromedriver over the network with ChromeDriverManager().install() and then type the login again.
+- driver cache: the driver path is kept per installed Chrome major version, so resolution only runs after a Chrome update
+- session jar: the cookies of a logged in session are saved encrypted and loaded on the next run, for Selenium and for
+  the browserless export alike; the login form is only filled in when the saved session is no longer valid
+The jar is encrypted with Fernet from the cryptography package. The key is taken from the HOLIDAY_SESSION_KEY
+environment variable, or from a key file readable by its owner only that is created on first use.
+Without the cryptography package (installed by AutoRun.txt) the session is not saved and a warning says so; it is
+never written in clear. A jar that cannot be written only costs the next run a login, so that is a warning too.
+'''
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+driverCacheFile = '.holiday_driver.json'
+sessionFile = '.holiday_session.bin'
+sessionKeyFile = '.holiday_session.key'
+sessionKeyVariable = 'HOLIDAY_SESSION_KEY'
+sessionMaxAgeHours = 12 #Saved sessions older than this are not tried
+
+_versionRegex = re.compile(r'(\d+)\.\d+\.\d+(?:\.\d+)?')
+_chromeBinaries = ['google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome']
+_cookieKeys = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'expiry', 'sameSite') #Keys WebDriver accepts
+
+###
+# Installed Chrome version, read locally
+###
+def chrome_version():
+    if sys.platform.startswith('win'):
+        import winreg
+        for hive in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(hive, r'Software\Google\Chrome\BLBeacon') as key:
+                    return winreg.QueryValueEx(key, 'version')[0]
+            except OSError:
+                continue
+        return None
+
+    binaries = list(_chromeBinaries)
+    if sys.platform == 'darwin':
+        binaries.insert(0, '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome')
+    for binary in binaries:
+        path = binary if os.path.isabs(binary) else shutil.which(binary)
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            output = subprocess.run([path, '--version'], capture_output=True, text=True, timeout=10).stdout
+        except (OSError, subprocess.SubprocessError):
+            continue
+        match = _versionRegex.search(output)
+        if match:
+            return match.group(0)
+    return None
+
+def _major(version):
+    match = _versionRegex.search(version or '')
+    return match.group(1) if match else None
+
+###
+# Driver path for the installed Chrome major version
+# resolve() is only called when no driver is cached for it, or the cached one has gone;
+# when the Chrome version cannot be read, every run resolves like before
+###
+def cached_driver(resolve, cache_file=None, version=None):
+    cache_file = cache_file or driverCacheFile
+    major = _major(version or chrome_version())
+    cache = _read_json(cache_file)
+    entry = cache.get(major) if major else None
+    if entry and os.path.exists(entry["path"]):
+        return entry["path"]
+
+    path = resolve()
+    if major:
+        cache[major] = {"path": path, "resolved_at": time.time()}
+        _write_json(cache_file, cache)
+    return path
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w', encoding='utf-8') as json_file:
+        json.dump(data, json_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+###
+# Encrypted cookie jar
+# Cookies are kept in the WebDriver format (name, value, domain, path, ...), converted for requests sessions
+###
+class SessionJar:
+
+    def __init__(self, path=None, key_file=None, max_age_hours=None):
+        '''
+        Args
+        ----
+        path : str, defaults to sessionFile
+            Location of the encrypted jar.
+        key_file : str, defaults to sessionKeyFile
+            Key used when HOLIDAY_SESSION_KEY is not set, created with owner-only permissions if missing.
+        max_age_hours : float, defaults to sessionMaxAgeHours
+            A jar saved longer ago than this is ignored.
+        '''
+        self.path = path or sessionFile
+        self.key_file = key_file or sessionKeyFile
+        self.max_age_hours = max_age_hours or sessionMaxAgeHours
+        self._fernet = None
+        self._warned = False
+
+    def _warn(self, message):
+        if not self._warned:
+            print("Warning: " + message + ", the login session is not saved and every run logs in again")
+            self._warned = True
+
+    def _cipher(self):
+        if self._fernet is None:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                self._warn("cryptography is not installed (pip install cryptography)")
+                return None
+            key = os.environ.get(sessionKeyVariable)
+            if not key:
+                key = self._key_from_file(Fernet)
+            self._fernet = Fernet(key)
+        return self._fernet
+
+    def _key_from_file(self, Fernet):
+        try:
+            with open(self.key_file, 'rb') as key_file:
+                return key_file.read().strip()
+        except FileNotFoundError:
+            key = Fernet.generate_key()
+            descriptor = os.open(self.key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, 'wb') as key_file:
+                key_file.write(key)
+            return key
+
+    def available(self):
+        return self._cipher() is not None
+
+    #Saved cookies, empty when there is no jar, it is too old, or it cannot be decrypted with the current key
+    def load(self):
+        try:
+            fernet = self._cipher()
+        except OSError as error:
+            self._warn("the session key could not be read (" + str(error) + ")")
+            return []
+        if fernet is None or not os.path.exists(self.path):
+            return []
+        from cryptography.fernet import InvalidToken
+        try:
+            with open(self.path, 'rb') as jar_file:
+                payload = fernet.decrypt(jar_file.read(), ttl=int(self.max_age_hours * 3600))
+            return json.loads(payload)["cookies"]
+        except (OSError, ValueError, KeyError, InvalidToken):
+            return []
+
+    def save(self, cookies):
+        try:
+            fernet = self._cipher()
+            if fernet is None:
+                return False
+            token = fernet.encrypt(json.dumps({"cookies": cookies}).encode('utf-8'))
+            descriptor = os.open(self.path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(descriptor, 'wb') as jar_file:
+                jar_file.write(token)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as error:
+            self._warn("the session jar could not be written (" + str(error) + ")")
+            return False
+        return True
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    ###
+    # Selenium: cookies can only be added for the site the browser is on, so the login page is opened first
+    ###
+    def restore_driver(self, driver):
+        cookies = self.load()
+        for cookie in cookies:
+            try:
+                driver.add_cookie({key: value for key, value in cookie.items() if key in _cookieKeys})
+            except Exception: #InvalidCookieDomainException and friends: that cookie is for another site
+                continue
+        return len(cookies) > 0
+
+    def save_driver(self, driver):
+        return self.save(driver.get_cookies())
+
+    ###
+    # requests
+    ###
+    def restore_session(self, session):
+        cookies = self.load()
+        for cookie in cookies:
+            session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ''), path=cookie.get("path", '/'),
+                                secure=cookie.get("secure", False), expires=cookie.get("expiry"))
+        return len(cookies) > 0
+
+    def save_session(self, session):
+        return self.save([{"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path,
+                           "secure": bool(cookie.secure), **({"expiry": int(cookie.expires)} if cookie.expires else {})}
+                          for cookie in session.cookies])
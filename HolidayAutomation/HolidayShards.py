@@ -0,0 +1,137 @@
+'''
+Sharded export of a long window for HolidayFileDownloadAutomation.py
+A quarter or a year exported with one click of btnExportToExcelWorkbook took minutes to build on the site and
+sometimes ran into its timeout. The window is split into consecutive sub-ranges exported side by side:
+- every shard logs in on its own session (its own HTTP session, or its own Chrome), the saved session is not shared
+- every shard downloads into its own directory under shardDirectory, so a download is never taken for another's
+- at most maxParallel shards run at a time
+The shard exports are then merged into one export in outdir, named for the whole window like a single export, with
+rows listed by more than one shard (leave running over a shard boundary) kept once. redact_report and the leave
+history take it from there, so the redacted copy has the same HolidayList table.
+'''
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+shardDirectory = os.path.join('.', 'Files', 'Shards')
+defaultShards = 4
+maxParallel = 3 #Shards exported at the same time, each one is a login and an export on the site
+
+class ShardError(Exception):
+    pass
+
+###
+# Consecutive (start, end) windows covering start_date..end_date, both ends included like the report's
+###
+def split_window(start_date, end_date, shards):
+    days = (end_date - start_date).days + 1
+    shards = max(1, min(shards, days))
+    windows = []
+    shard_start = start_date
+    for number in range(shards):
+        length = days // shards + (1 if number < days % shards else 0)
+        shard_end = shard_start + timedelta(days=length - 1)
+        windows.append((shard_start, shard_end))
+        shard_start = shard_end + timedelta(days=1)
+    return windows
+
+def shard_directory(start_date, end_date, directory=None):
+    return os.path.join(directory or shardDirectory, start_date.strftime('%Y%m%d') + '_' + end_date.strftime('%Y%m%d'))
+
+###
+# Export every shard, at most max_parallel at a time
+# Returns the shard exports in window order; ShardError lists the shards that failed after all have finished,
+# the exports of the others stay in their directories
+###
+def export_shards(windows, backend=None, max_parallel=None, directory=None):
+    automation = _download_automation()
+    max_parallel = max_parallel or maxParallel
+
+    def export(window):
+        shard_start, shard_end = window
+        folder = shard_directory(shard_start, shard_end, directory)
+        os.makedirs(folder, exist_ok=True)
+        return automation.download_report(shard_start, shard_end, backend=backend, output_directory=folder,
+                                          download_directory=folder, saved_session=False)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(windows)))) as executor:
+        futures = [executor.submit(export, window) for window in windows]
+    failed = [(window, future.exception()) for window, future in zip(windows, futures) if future.exception() is not None]
+    if failed:
+        raise ShardError('Shards failed: ' + '; '.join(start.strftime('%d-%m-%Y') + ' to ' + end.strftime('%d-%m-%Y') +
+                                                        ': ' + repr(error) for (start, end), error in failed))
+    return [future.result() for future in futures]
+
+###
+# One export from the shard exports, rows in shard order and each distinct row once
+# The shards must have the same header; the sheet title and header of the first are kept
+###
+def merge_exports(paths, destination):
+    from openpyxl import Workbook, load_workbook
+
+    target = Workbook(write_only=True)
+    sheet = None
+    header = None
+    seen = set()
+    rows_written = duplicates = 0
+    try:
+        for path in paths:
+            source = load_workbook(filename=path, read_only=True)
+            try:
+                rows = source.active.iter_rows(values_only=True)
+                shard_header = next(rows, ())
+                if header is None:
+                    header = shard_header
+                    sheet = target.create_sheet(source.active.title)
+                    sheet.append(list(header))
+                elif shard_header != header:
+                    raise ShardError(os.path.basename(path) + ' does not have the columns of the other shards')
+                for row in rows:
+                    if all(value is None or value == '' for value in row):
+                        continue
+                    if row in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(row)
+                    sheet.append(list(row))
+                    rows_written += 1
+            finally:
+                source.close()
+    except BaseException:
+        if sheet is not None:
+            sheet.close() #Ends the sheet's row writer, which otherwise fails noisily when collected
+        raise
+    if sheet is None:
+        raise ShardError('No shard exports to merge')
+
+    root, extension = os.path.splitext(destination)
+    temporary = root + '.tmp' + extension
+    target.save(temporary)
+    os.replace(temporary, destination)
+    print("Merged " + str(len(paths)) + " shards: " + str(rows_written) + " rows, " + str(duplicates) + " duplicates dropped")
+    return destination
+
+###
+# Export start_date..end_date in shards and merge them into outdir
+# The shard directories are removed once merged
+###
+def download_report_sharded(start_date, end_date, shards=None, backend=None, max_parallel=None, output_directory=None, directory=None):
+    automation = _download_automation()
+    output_directory = output_directory or automation.outdir
+    os.makedirs(output_directory, exist_ok=True)
+
+    windows = split_window(start_date, end_date, shards or defaultShards)
+    print(str(len(windows)) + " shards of " + start_date.strftime("%d-%m-%Y") + " to " + end_date.strftime('%d-%m-%Y'))
+    paths = export_shards(windows, backend, max_parallel, directory)
+    destination = merge_exports(paths, os.path.join(output_directory, automation.report_filename(start_date)))
+    for shard_start, shard_end in windows:
+        shutil.rmtree(shard_directory(shard_start, shard_end, directory), ignore_errors=True)
+    return destination
+
+def _download_automation():
+    try:
+        from . import HolidayFileDownloadAutomation
+    except ImportError:
+        import HolidayFileDownloadAutomation
+    return HolidayFileDownloadAutomation
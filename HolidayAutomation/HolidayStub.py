@@ -0,0 +1,342 @@
+'''
+Local stand-in for the holiday management site, to develop and check the browserless export in HolidayHttpExport.py
+Serves an ASP.NET WebForms look-alike:
+    /prosoft/web                      login form (txtClientCode, txtUserID, txtPassword, btnSignIn)
+    /prosoft/web/LeaveReport.aspx     leave report form with the date range pickers and ctl00$cph1$btnExportToExcelWorkbook
+Like the real site, every post must carry back the __VIEWSTATE and __EVENTVALIDATION of the page it was rendered from,
+and the report only answers within a logged in session (ASP.NET_SessionId cookie).
+The export is a generated workbook with one row per leave taken between the posted dates.
+
+    python HolidayStub.py --port 8080
+'''
+import argparse
+import io
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+loginPath = '/prosoft/web'
+reportPath = '/prosoft/web/LeaveReport.aspx'
+
+#Columns of the export, the redaction in HolidayFileDownloadAutomation.py keeps 11 of them
+reportColumns = ['Employee No', 'Employee Name', 'Department', 'Designation', 'NRIC', 'Email', 'Mobile',
+                 'Leave Type', 'Date From', 'Date To', 'Day Type', 'No. of Days', 'Status', 'Applied Date'] + \
+                ['Field ' + str(number) for number in range(15, 40)] + ['Last Updated']
+leaveTypes = ['Annual Leave', 'Sick Leave', 'Childcare Leave', 'Compassionate Leave', 'Unpaid Leave']
+
+###
+# Synthetic leave records
+###
+def generate_leave(start_date, end_date, employees=50, seed=0):
+    '''
+    Args
+    ----
+    start_date, end_date : datetime
+        Window of the report, leave overlapping it is listed.
+    employees : int, defaults to 50
+        Number of employees taking leave.
+    seed : int, defaults to 0
+        Same seed, same leave calendar: the rows of a window are the leave of the calendar overlapping it,
+        so overlapping windows list the same leave, and leave running over the end of a window is in both.
+    '''
+    first_day = datetime(start_date.year, start_date.month, 1) - timedelta(days=1) #Leave of the month before can run into the window
+    rows = []
+    for number in range(1, employees + 1):
+        employee = random.Random(seed * 100003 + number) #Same person details whatever the window
+        name = 'Employee ' + str(number)
+        details = [str(number).zfill(5), name, employee.choice(['Finance', 'HR', 'IT', 'Operations', 'Sales']),
+                   employee.choice(['Analyst', 'Engineer', 'Manager', 'Associate']), 'S' + str(employee.randint(1000000, 9999999)) + 'A',
+                   name.lower().replace(' ', '.') + '@example.com', '9' + str(employee.randint(1000000, 9999999))]
+        month = datetime(first_day.year, first_day.month, 1)
+        while month.date() <= end_date.date():
+            generator = random.Random('%d-%d-%d-%d' % (seed, number, month.year, month.month)) #Leave of this person this month
+            month_days = ((month + timedelta(days=32)).replace(day=1) - month).days
+            starts = set()
+            for _ in range(generator.randint(0, 2)):
+                date_from = month + timedelta(days=generator.randint(0, month_days - 1))
+                days = generator.randint(1, 5)
+                date_to = date_from + timedelta(days=days - 1)
+                leave = [generator.choice(leaveTypes), date_from.strftime('%d-%m-%Y'), date_to.strftime('%d-%m-%Y'),
+                         'Full Day', days, generator.choice(['Approved', 'Approved', 'Approved', 'Pending', 'Cancelled']),
+                         (date_from - timedelta(days=generator.randint(1, 30))).strftime('%d-%m-%Y')]
+                if date_from in starts:
+                    continue #One leave a day per person
+                starts.add(date_from)
+                if date_from.date() <= end_date.date() and date_to.date() >= start_date.date():
+                    rows.append(details + leave + [''] * 25 + [date_from.strftime('%d-%m-%Y')])
+            month = (month + timedelta(days=32)).replace(day=1)
+    return rows
+
+def report_workbook(rows):
+    import xlsxwriter
+
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    worksheet = workbook.add_worksheet('Leave Records')
+    worksheet.write_row(0, 0, reportColumns)
+    for row_number, row in enumerate(rows, start=1):
+        worksheet.write_row(row_number, 0, row)
+    workbook.close()
+    return output.getvalue()
+
+###
+# Pages
+###
+def _hidden(name, value, element_id=None):
+    return '<input type="hidden" name="%s" id="%s" value="%s" />' % (name, element_id or name, value)
+
+def login_page(viewstate, validation, message=''):
+    return ('<html><body><form method="post" action="./web" id="form1">' +
+            _hidden('__VIEWSTATE', viewstate) + _hidden('__VIEWSTATEGENERATOR', 'C2EE9ABB') +
+            _hidden('__EVENTTARGET', '') + _hidden('__EVENTARGUMENT', '') + _hidden('__EVENTVALIDATION', validation) +
+            '<span class="error">%s</span>' % message +
+            '<input name="txtClientCode" type="text" id="txtClientCode" />'
+            '<input name="txtUserID" type="text" id="txtUserID" />'
+            '<input name="txtPassword" type="password" id="txtPassword" />'
+            '<input type="submit" name="btnSignIn" value="Sign In" id="btnSignIn" />'
+            '</form></body></html>')
+
+def home_page():
+    return ('<html><body><form method="post" action="./web" id="aspnetForm">'
+            '<a id="ctl00_cph1_lblName_eLeave" href="LeaveReport.aspx">eLeave</a>'
+            '</form></body></html>')
+
+def _date_picker(picker, label):
+    picker_id = 'ctl00_cph1_ucDateStartEnd_' + picker
+    picker_name = 'ctl00$cph1$ucDateStartEnd$' + picker
+    state = '{"enabled":true,"emptyMessage":"","validationText":"","valueAsString":"","lastSetTextBoxValue":""}'
+    return (label + _hidden(picker_name, '', picker_id) +
+            '<input name="%s$dateInput" type="text" id="%s_input" value="" />' % (picker_name, picker_id) +
+            _hidden(picker_id + '_dateInput_ClientState', state.replace('"', '&quot;')))
+
+def report_page(viewstate, validation):
+    return ('<html><body><form method="post" action="./LeaveReport.aspx" id="aspnetForm">' +
+            _hidden('__VIEWSTATE', viewstate) + _hidden('__VIEWSTATEGENERATOR', '7A1B3C5D') +
+            _hidden('__EVENTTARGET', '') + _hidden('__EVENTARGUMENT', '') + _hidden('__EVENTVALIDATION', validation) +
+            _date_picker('dpDateStart', 'From') + _date_picker('dpDateEnd', 'To') +
+            '<select name="ctl00$cph1$ddlStatus" id="ctl00_cph1_ddlStatus">'
+            '<option value="">All</option><option value="A">Approved</option></select>'
+            '<input type="checkbox" name="ctl00$cph1$chkInactive" id="ctl00_cph1_chkInactive" />'
+            '<input type="submit" name="ctl00$cph1$btnExportToExcelWorkbook" value="Export To Excel" id="ctl00_cph1_btnExportToExcelWorkbook" />'
+            '</form></body></html>')
+
+###
+# Stub server
+###
+class StubWebForms:
+
+    def __init__(self, company_code='ACME', ee_id='E001', password='secret', employees=50, latency=0.0,
+                 fail_logins=0, host='127.0.0.1', port=0, build_seconds_per_day=0.0):
+        '''
+        Args
+        ----
+        company_code, ee_id, password : str
+            Credentials accepted by the login form.
+        employees : int, defaults to 50
+            Employees listed in the export, see generate_leave.
+        latency : float, defaults to 0
+            Seconds added to every response.
+        fail_logins : int, defaults to 0
+            Number of correct logins turned down first, like the real login page sometimes does.
+        host, port : str, int
+            Address to listen on, port 0 picks a free port.
+        build_seconds_per_day : float, defaults to 0
+            Seconds the export takes to build per day of the window, the real site is slow on long windows.
+        '''
+        self.credentials = (company_code, ee_id, password)
+        self.employees = employees
+        self.latency = latency
+        self.fail_logins = fail_logins
+        self.build_seconds_per_day = build_seconds_per_day
+        self._sessions = {} #ASP.NET_SessionId -> {"logged_in": bool, "viewstate": str, "validation": str}
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "logins": 0, "failed_logins": 0, "rejected_posts": 0, "exports": 0, "bytes": 0}
+
+        stub = self
+        class Handler(_Handler):
+            server_stub = stub
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    #loginURL and leaveReportURL of HolidayFileDownloadAutomation pointing at this server
+    @property
+    def login_url(self):
+        return self.url + loginPath
+
+    @property
+    def report_url(self):
+        return self.url + reportPath
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.counters[key] += amount
+
+    def session(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = {"logged_in": False, "viewstate": None, "validation": None}
+            return self._sessions[session_id]
+
+    #Log every session out, like the site does after its idle timeout; the cookies stay known
+    def expire_sessions(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session["logged_in"] = False
+
+    #Every rendered form gets a new view state, only the latest one is accepted back
+    def render_state(self, session):
+        session["viewstate"] = secrets.token_urlsafe(48)
+        session["validation"] = secrets.token_urlsafe(24)
+        return session["viewstate"], session["validation"]
+
+    def valid_post(self, session, fields):
+        valid = (session["viewstate"] is not None and fields.get('__VIEWSTATE') == session["viewstate"] and
+                 fields.get('__EVENTVALIDATION') == session["validation"])
+        if not valid:
+            self._count("rejected_posts")
+        return valid
+
+    def try_login(self, fields):
+        posted = (fields.get('txtClientCode'), fields.get('txtUserID'), fields.get('txtPassword'))
+        with self._lock:
+            if posted == self.credentials and self.fail_logins > 0:
+                self.fail_logins -= 1
+                posted = None
+        self._count("logins" if posted == self.credentials else "failed_logins")
+        return posted == self.credentials
+
+    def export(self, fields):
+        start_date = _posted_date(fields, 'dpDateStart')
+        end_date = _posted_date(fields, 'dpDateEnd')
+        if start_date is None or end_date is None or end_date < start_date:
+            return None
+        self._count("exports")
+        if self.build_seconds_per_day:
+            time.sleep(self.build_seconds_per_day * ((end_date - start_date).days + 1))
+        return report_workbook(generate_leave(start_date, end_date, self.employees))
+
+#The hidden yyyy-mm-dd field of the picker wins over the text box, like the real picker
+def _posted_date(fields, picker):
+    picker_name = 'ctl00$cph1$ucDateStartEnd$' + picker
+    for name, date_format in ((picker_name, '%Y-%m-%d'), (picker_name + '$dateInput', '%d-%m-%Y')):
+        try:
+            return datetime.strptime(fields.get(name, ''), date_format)
+        except ValueError:
+            continue
+    return None
+
+class _Handler(BaseHTTPRequestHandler):
+    server_stub = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _session(self):
+        cookies = dict(part.strip().split('=', 1) for part in self.headers.get('Cookie', '').split(';') if '=' in part)
+        session_id = cookies.get('ASP.NET_SessionId')
+        new_cookie = None
+        if session_id is None:
+            session_id = new_cookie = secrets.token_hex(12)
+        return self.server_stub.session(session_id), new_cookie
+
+    def _start(self):
+        stub = self.server_stub
+        stub._count("requests")
+        if stub.latency:
+            time.sleep(stub.latency)
+        return stub, urlsplit(self.path).path.rstrip('/')
+
+    def do_GET(self):
+        stub, path = self._start()
+        session, new_cookie = self._session()
+        if path == loginPath:
+            if session["logged_in"]:
+                return self._send(200, home_page(), new_cookie)
+            return self._send(200, login_page(*stub.render_state(session)), new_cookie)
+        if path == reportPath:
+            if not session["logged_in"]:
+                return self._redirect(loginPath, new_cookie)
+            return self._send(200, report_page(*stub.render_state(session)), new_cookie)
+        return self._send(404, '<html><body>Not found</body></html>', new_cookie)
+
+    def do_POST(self):
+        stub, path = self._start()
+        session, new_cookie = self._session()
+        length = int(self.headers.get('Content-Length') or 0)
+        fields = {name: values[-1] for name, values in parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True).items()}
+
+        if not stub.valid_post(session, fields):
+            return self._send(500, '<html><body>Validation of viewstate MAC failed.</body></html>', new_cookie)
+        if path == loginPath:
+            if 'btnSignIn' in fields and stub.try_login(fields):
+                session["logged_in"] = True
+                return self._send(200, home_page(), new_cookie)
+            return self._send(200, login_page(*stub.render_state(session), message='Invalid login'), new_cookie)
+        if path == reportPath:
+            if not session["logged_in"]:
+                return self._redirect(loginPath, new_cookie)
+            workbook = stub.export(fields) if 'ctl00$cph1$btnExportToExcelWorkbook' in fields else None
+            if workbook is None:
+                return self._send(200, report_page(*stub.render_state(session)), new_cookie)
+            return self._send(200, workbook, new_cookie, {
+                'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                'Content-Disposition': 'attachment; filename=LeaveRecordsReport.xlsx'})
+        return self._send(404, '<html><body>Not found</body></html>', new_cookie)
+
+    def _redirect(self, location, new_cookie):
+        return self._send(302, '', new_cookie, {'Location': location})
+
+    def _send(self, status, body, new_cookie=None, headers=None):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.server_stub._count("bytes", len(body))
+        self.send_response(status)
+        headers = dict({'Content-Type': 'text/html; charset=utf-8'}, **(headers or {}))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if new_cookie is not None:
+            self.send_header('Set-Cookie', 'ASP.NET_SessionId=' + new_cookie + '; path=/; HttpOnly')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Serve a local copy of the holiday site login and leave report export')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument('--employees', type=int, default=50)
+    arg_parser.add_argument('--build-seconds-per-day', type=float, default=0.0)
+    args = arg_parser.parse_args()
+    stub = StubWebForms(employees=args.employees, port=args.port, build_seconds_per_day=args.build_seconds_per_day)
+    print('Login page:  ' + stub.login_url)
+    print('Report page: ' + stub.report_url)
+    print('Credentials: ' + ' / '.join(stub.credentials))
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
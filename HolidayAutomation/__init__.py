@@ -0,0 +1,63 @@
+'''
+Holiday report and Confluence documentation automation
+
+Every script still runs on its own (python ConfluenceRetrieval.py, python HolidayFileDownloadAutomation.py)
+and can also be used as a package:
+
+    from HolidayAutomation import iter_pages
+    for page_meta, summary_df, sections in iter_pages(['123456', '234567']):
+        ...
+
+    python -m HolidayAutomation.ConfluenceRetrieval --excel-mode streaming
+
+Modules are imported on first access, so importing the package loads neither pandas nor Selenium.
+'''
+import importlib
+
+__all__ = [
+    'ConfluenceRetrieval',
+    'HolidayFileDownloadAutomation',
+    'HolidayHttpExport',
+    'HolidayStub',
+    'DownloadWatcher',
+    'HolidaySession',
+    'HolidayHistory',
+    'HolidayShards',
+    'FileRetention',
+    'ConfluenceCache',
+    'ConfluenceInput',
+    'ConfluenceLxml',
+    'ConfluenceMetrics',
+    'ConfluencePipeline',
+    'ConfluenceScheduler',
+    'ConfluenceSections',
+    'ConfluenceStore',
+    'ConfluenceStub',
+    'ConfluenceTables',
+    'ConfluenceMemo',
+    'ConfluenceJournal',
+    'ConfluenceBenchmark',
+    'iter_pages',
+    'processPages',
+    'resolveConfIds',
+]
+
+#Functions re-exported from their module
+_functions = {
+    'iter_pages': 'ConfluenceRetrieval',
+    'processPages': 'ConfluenceRetrieval',
+    'resolveConfIds': 'ConfluenceRetrieval',
+}
+
+def __getattr__(name):
+    if name in _functions:
+        value = getattr(importlib.import_module('.' + _functions[name], __name__), name)
+    elif name in __all__:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,45 @@
+'''
+Shared fixtures: the package is imported from the folder above HolidayAutomation, and the holiday tests run
+against HolidayStub.StubWebForms with every output folder under tmp_path.
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from HolidayAutomation import HolidayFileDownloadAutomation, HolidayStub
+
+@pytest.fixture
+def stub():
+    with HolidayStub.StubWebForms(employees=40) as server:
+        yield server
+
+#HolidayFileDownloadAutomation pointed at the stub, exporting without a browser into tmp_path
+@pytest.fixture
+def automation(stub, tmp_path, monkeypatch):
+    module = HolidayFileDownloadAutomation
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(module, 'loginURL', stub.login_url)
+    monkeypatch.setattr(module, 'leaveReportURL', stub.report_url)
+    monkeypatch.setattr(module, 'myCompanyCode', 'ACME')
+    monkeypatch.setattr(module, 'myEeId', 'E001')
+    monkeypatch.setattr(module, 'myPassword', 'secret')
+    monkeypatch.setattr(module, 'exportBackend', 'http')
+    monkeypatch.setattr(module, 'outdir', str(tmp_path / 'Files'))
+    monkeypatch.setattr(module, 'finaldir', str(tmp_path / 'Files' / 'Processed'))
+    return module
+
+#Rows of the first sheet of a workbook, header included
+@pytest.fixture
+def read_rows():
+    from openpyxl import load_workbook
+
+    def read(path):
+        workbook = load_workbook(filename=path, read_only=True)
+        try:
+            return [tuple(row) for row in workbook.active.iter_rows(values_only=True)]
+        finally:
+            workbook.close()
+    return read
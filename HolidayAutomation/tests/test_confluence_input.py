@@ -0,0 +1,138 @@
+import os
+
+import pandas as pd
+import pytest
+
+from HolidayAutomation import ConfluenceInput
+from HolidayAutomation.ConfluenceInput import latest_input, load_input
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'input'
+    folder.mkdir()
+    return folder
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+def _touch(path, mtime, content=b'x'):
+    path.write_bytes(content)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+def _no_listing(monkeypatch):
+    def scandir(path):
+        raise AssertionError('directory listed again')
+    monkeypatch.setattr(ConfluenceInput.os, 'scandir', scandir)
+
+def test_latest_matching_file_by_modification_time(folder, cache_dir):
+    _touch(folder / 'List_a.xlsx', 1000)
+    newest = _touch(folder / 'List_b.xlsx', 3000)
+    _touch(folder / 'List_c.xlsx', 2000)
+    _touch(folder / 'Output_d.xlsx', 4000)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+    assert latest_input('Missing_*.xlsx', str(folder), cache_dir) is None
+
+def test_unchanged_directory_is_not_listed_again(folder, cache_dir, monkeypatch):
+    newest = _touch(folder / 'List_b.xlsx', 3000)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+    _no_listing(monkeypatch)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+
+def test_new_export_is_picked_up(folder, cache_dir):
+    _touch(folder / 'List_a.xlsx', 1000)
+    latest_input('List_*.xlsx', str(folder), cache_dir)
+    newest = _touch(folder / 'List_b.xlsx', 2000)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+
+def test_removed_latest_file_falls_back(folder, cache_dir):
+    older = _touch(folder / 'List_a.xlsx', 1000)
+    newest = _touch(folder / 'List_b.xlsx', 2000)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+    os.remove(newest)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == older
+
+def test_latest_file_rewritten_in_place_is_checked(folder, cache_dir, monkeypatch):
+    newest = _touch(folder / 'List_b.xlsx', 2000)
+    latest_input('List_*.xlsx', str(folder), cache_dir)
+    _touch(folder / 'List_b.xlsx', 2500, b'longer content')
+
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(ConfluenceInput.os, 'scandir', lambda path: listed.append(path) or scandir(path))
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+    assert listed == [str(folder)]
+
+def test_outputs_written_next_to_the_input_do_not_change_the_answer(folder, cache_dir):
+    newest = _touch(folder / 'List_b.xlsx', 2000)
+    latest_input('List_*.xlsx', str(folder), cache_dir)
+    _touch(folder / '123_Page_123.xlsx', 5000)
+    assert latest_input('List_*.xlsx', str(folder), cache_dir) == newest
+
+###
+# Sidecar of load_input
+###
+def _workbook(path, rows=3, extra=True):
+    data = {'ID': ['ID%d' % number for number in range(rows)],
+            'DocumentationLink': ['https://space.confluence.com/pageId=%d' % number for number in range(rows)],
+            'Column': ['https://space.confluence.com/'] * rows}
+    if extra:
+        data['Unused'] = list(range(rows))
+    pd.DataFrame(data).to_excel(path, index=False, engine='openpyxl')
+    return str(path)
+
+@pytest.fixture
+def read_excel_calls(monkeypatch):
+    calls = []
+    read_excel = pd.read_excel
+
+    def counted(*args, **kwargs):
+        calls.append(args[0])
+        return read_excel(*args, **kwargs)
+    monkeypatch.setattr(ConfluenceInput.pd, 'read_excel', counted)
+    return calls
+
+def test_sidecar_skips_the_workbook(folder, cache_dir, read_excel_calls):
+    path = _workbook(folder / 'List_a.xlsx')
+    first = load_input(path, cache_dir=cache_dir, engine='openpyxl')
+    second = load_input(path, cache_dir=cache_dir, engine='openpyxl')
+
+    assert list(first.columns) == ConfluenceInput.inputColumns
+    assert second.equals(first)
+    assert len(read_excel_calls) == 1
+
+def test_changed_workbook_is_read_again(folder, cache_dir, read_excel_calls):
+    path = _workbook(folder / 'List_a.xlsx', rows=3)
+    load_input(path, cache_dir=cache_dir, engine='openpyxl')
+    _workbook(folder / 'List_a.xlsx', rows=5)
+    os.utime(path, (os.stat(path).st_atime, os.stat(path).st_mtime + 10))
+
+    assert len(load_input(path, cache_dir=cache_dir, engine='openpyxl')) == 5
+    assert len(read_excel_calls) == 2
+
+def test_other_columns_refresh_or_unreadable_sidecar_read_again(folder, cache_dir, read_excel_calls):
+    path = _workbook(folder / 'List_a.xlsx')
+    load_input(path, cache_dir=cache_dir, engine='openpyxl')
+
+    assert list(load_input(path, ['ID'], cache_dir=cache_dir, engine='openpyxl').columns) == ['ID']
+    load_input(path, cache_dir=cache_dir, engine='openpyxl', refresh=True)
+    for name in os.listdir(cache_dir):
+        if name != ConfluenceInput._stateFile:
+            with open(os.path.join(cache_dir, name), 'wb') as sidecar_file:
+                sidecar_file.write(b'not a sidecar')
+    assert len(load_input(path, cache_dir=cache_dir, engine='openpyxl')) == 3
+    assert len(read_excel_calls) == 4
+
+def test_sidecars_of_removed_workbooks_are_dropped(folder, cache_dir):
+    first = _workbook(folder / 'List_a.xlsx')
+    load_input(first, cache_dir=cache_dir, engine='openpyxl')
+    os.remove(first)
+    load_input(_workbook(folder / 'List_b.xlsx'), cache_dir=cache_dir, engine='openpyxl')
+    assert len([name for name in os.listdir(cache_dir) if name != ConfluenceInput._stateFile]) == 1
+
+def test_missing_column_raises(folder, cache_dir):
+    path = str(folder / 'List_a.xlsx')
+    pd.DataFrame({'ID': ['A']}).to_excel(path, index=False, engine='openpyxl')
+    with pytest.raises(ValueError, match='DocumentationLink, Column'):
+        load_input(path, cache_dir=cache_dir, engine='openpyxl')
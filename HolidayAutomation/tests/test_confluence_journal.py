@@ -0,0 +1,92 @@
+import json
+
+import pandas as pd
+import pytest
+
+from HolidayAutomation.ConfluenceJournal import RunJournal
+
+@pytest.fixture
+def journal_file(tmp_path):
+    return str(tmp_path / 'journal.jsonl')
+
+def _links():
+    return pd.Series(['pageId=123', 'Benefit page', 'missing title'], index=[10, 11, 12])
+
+def _records(path):
+    with open(path, encoding='utf-8') as journal_file:
+        return [json.loads(line) for line in journal_file]
+
+def _output(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'excel')
+    return str(path)
+
+def _first_attempt(journal_file, tmp_path):
+    with RunJournal(journal_file) as journal:
+        journal.record_rows(_links(), ['123', '456', None])
+        journal.pending(['123', '456', '789'])
+        journal.done('123', 'Page 123', _output(tmp_path, '123_Page_123.xlsx'), version=3)
+        journal.failed('456', 'HTTP 500')
+
+def test_resume_reads_back_rows_and_pages(journal_file, tmp_path):
+    _first_attempt(journal_file, tmp_path)
+    with RunJournal(journal_file, resume=True) as journal:
+        assert journal.resolved_rows(_links()) == {10: '123', 11: '456'}
+        assert set(journal.completed()) == {'123'}
+        assert journal.completed()['123']['version'] == 3
+        assert journal.counts() == {'pending': 1, 'done': 1, 'failed': 1}
+
+def test_rows_with_another_link_are_resolved_again(journal_file, tmp_path):
+    _first_attempt(journal_file, tmp_path)
+    with RunJournal(journal_file, resume=True) as journal:
+        links = pd.Series(['pageId=123', 'Renamed page', 'missing title'], index=[10, 11, 12])
+        assert journal.resolved_rows(links) == {10: '123'}
+
+def test_resume_after_a_truncated_last_line(journal_file, tmp_path):
+    _first_attempt(journal_file, tmp_path)
+    #The process was killed halfway through the record marking page 789 done
+    with open(journal_file, 'a', encoding='utf-8') as killed:
+        killed.write('{"type": "page", "page_id": "789", "status": "do')
+
+    with RunJournal(journal_file, resume=True) as journal:
+        assert set(journal.completed()) == {'123'}
+        assert journal.pages['789']['status'] == 'pending'
+        journal.done('789', 'Page 789', _output(tmp_path, '789_Page_789.xlsx'))
+
+    #The records of the resumed run start on a line of their own and are read back by the next resume
+    with open(journal_file, encoding='utf-8') as journal_lines:
+        lines = journal_lines.read().splitlines()
+    assert lines[-3].endswith('"status": "do')
+    assert json.loads(lines[-2])['type'] == 'run'
+    with RunJournal(journal_file, resume=True) as journal:
+        assert set(journal.completed()) == {'123', '789'}
+
+def test_done_page_without_its_output_file_is_run_again(journal_file, tmp_path):
+    _first_attempt(journal_file, tmp_path)
+    (tmp_path / '123_Page_123.xlsx').unlink()
+    with RunJournal(journal_file, resume=True) as journal:
+        assert '123' not in journal.completed()
+        assert journal.completed() == {}
+
+def test_last_record_of_a_page_wins(journal_file, tmp_path):
+    _first_attempt(journal_file, tmp_path)
+    with RunJournal(journal_file, resume=True) as journal:
+        journal.pending(['456'])
+        journal.done('456', 'Page 456', _output(tmp_path, '456_Page_456.xlsx'), outcome='cached')
+    with RunJournal(journal_file, resume=True) as journal:
+        assert journal.completed()['456']['outcome'] == 'cached'
+        assert journal.counts() == {'pending': 1, 'done': 2, 'failed': 0}
+
+def test_run_without_resume_truncates_the_journal(journal_file, tmp_path):
+    _first_attempt(journal_file, tmp_path)
+    with RunJournal(journal_file) as journal:
+        assert journal.rows == {} and journal.pages == {}
+        assert journal.completed() == {}
+    records = _records(journal_file)
+    assert len(records) == 1
+    assert records[0]['type'] == 'run' and records[0]['resume'] is False
+
+def test_resume_without_a_journal_starts_one(journal_file):
+    with RunJournal(journal_file, resume=True) as journal:
+        assert journal.completed() == {}
+    assert [record['type'] for record in _records(journal_file)] == ['run']
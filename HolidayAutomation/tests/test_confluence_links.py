@@ -0,0 +1,39 @@
+import sqlite3
+
+import pandas as pd
+
+from HolidayAutomation import ConfluenceRetrieval
+from HolidayAutomation.ConfluenceStore import OutputStore
+
+def _links():
+    rows = pd.DataFrame({'ID': ['A', 'B', 'C', 'D', 'E'],
+                         'DocumentationLink': ['pageId=00123', 'Page 123', 'missing title', 'pageId=456', '']},
+                        index=[10, 11, 12, 13, 14])
+    return ConfluenceRetrieval.pageLinks(rows, ['00123', '123', None, '456', float('nan')])
+
+def test_unresolved_rows_are_kept_without_a_page():
+    links = _links()
+    assert list(links['Row']) == [10, 11, 12, 13, 14]
+    assert list(links['PageID']) == ['123', '123', None, '456', None]
+
+def test_unique_pages_leave_out_unresolved_rows():
+    assert ConfluenceRetrieval.uniquePages(_links()) == [(10, '123'), (13, '456')]
+
+def test_unresolved_rows_get_their_own_status():
+    links = ConfluenceRetrieval.linkResults(_links(), {'123': ('processed', 'Benefit page')})
+    assert list(links['Status']) == ['processed', 'processed', 'unresolved', 'failed', 'unresolved']
+    assert list(links['Title'].isna()) == [False, False, True, True, True]
+    assert links['OutputFile'][0] == ConfluenceRetrieval.outputFileName('123', 'Benefit page')
+    assert list(links['OutputFile'].isna()) == [False, False, True, True, True]
+    assert list(links['RowsForPage']) == [2, 2, 0, 1, 0]
+
+def test_store_keeps_unresolved_rows(tmp_path):
+    links = ConfluenceRetrieval.linkResults(_links(), {'123': ('processed', 'Benefit page')})
+    store = OutputStore(str(tmp_path / 'store.sqlite'))
+    store.write_links(links)
+    store.close()
+
+    with sqlite3.connect(str(tmp_path / 'store.sqlite')) as conn:
+        rows = conn.execute('SELECT row, page_id, status FROM links ORDER BY row').fetchall()
+    assert rows == [(10, '123', 'processed'), (11, '123', 'processed'), (12, None, 'unresolved'),
+                    (13, '456', 'failed'), (14, None, 'unresolved')]
@@ -0,0 +1,157 @@
+import pytest
+
+from HolidayAutomation import ConfluenceMemo, ConfluenceRetrieval, ConfluenceTables
+from HolidayAutomation.ConfluenceMemo import SectionMemo, section_key
+from HolidayAutomation.ConfluenceStub import generate_page, page_json
+
+pytest.importorskip('lxml')
+pytest.importorskip('bs4')
+
+parsers = ['bs4', 'lxml']
+pageShapes = {
+    'nested tables': dict(sections=6, nested_tables=0.5, content_wrappers=0.2, lists=0.1),
+    'nested sections': dict(sections=10, depth=2, nested_tables=0.2, merged_cells=0.3),
+    'empty sections': dict(sections=6, empty_sections=0.5),
+}
+
+@pytest.fixture
+def memo_file(tmp_path):
+    return str(tmp_path / 'memo.sqlite')
+
+#Memo of this process for the test, the one of the other tests is put back afterwards
+@pytest.fixture
+def memo(memo_file, monkeypatch):
+    monkeypatch.setattr(ConfluenceMemo, '_memo', None)
+    monkeypatch.setattr(ConfluenceMemo, '_configured', False)
+    memo = ConfluenceMemo.configure(path=memo_file)
+    yield memo
+    memo.close()
+
+def _lookups(memo):
+    stats = memo.stats()
+    return stats['hits'], stats['disk_hits'], stats['misses']
+
+#Section tables of a page through another memo than the one of this process
+def _tables_with(other, html, parser, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(ConfluenceMemo, '_memo', other)
+        return ConfluenceRetrieval.extractPage(html, parser)[1]
+
+def test_key_changes_with_the_format_and_the_memo_version(monkeypatch):
+    source = '<ac:structured-macro ac:name="ui-expand"><ac:rich-text-body><table></table></ac:rich-text-body></ac:structured-macro>'
+    assert section_key(source, 'grid') == section_key(source, 'grid')
+    assert section_key(source, 'grid') != section_key(source, 'tsv')
+    assert section_key(source + ' ', 'grid') != section_key(source, 'grid')
+
+    key = section_key(source, 'grid')
+    monkeypatch.setattr(ConfluenceMemo, 'memoVersion', ConfluenceMemo.memoVersion + 1)
+    assert section_key(source, 'grid') != key
+
+@pytest.mark.parametrize('parser', parsers)
+def test_unchanged_sections_hit_in_memory(memo, parser):
+    html = generate_page(5, sections=4)
+    ConfluenceRetrieval.extractPage(html, parser)
+    assert _lookups(memo) == (0, 0, 4)
+
+    #Another page built from the same template: same sections, different page around them
+    ConfluenceRetrieval.extractPage('<p>Other page</p>' + html, parser)
+    assert _lookups(memo) == (4, 0, 4)
+
+@pytest.mark.parametrize('parser', parsers)
+def test_unchanged_sections_hit_on_disk(memo, memo_file, monkeypatch, parser):
+    html = generate_page(5, sections=4)
+    ConfluenceRetrieval.extractPage(html, parser)
+
+    #A parse process or a later run opens the same file with an empty memory
+    other = SectionMemo(path=memo_file)
+    tables = _tables_with(other, html, parser, monkeypatch)
+    assert _lookups(other) == (0, 4, 0)
+    tables_again = _tables_with(other, html, parser, monkeypatch)
+    assert _lookups(other) == (4, 4, 0)
+    for table, table_again in zip(tables, tables_again):
+        assert table.equals(table_again)
+    other.close()
+
+@pytest.mark.parametrize('change', ['memo version', 'table format'])
+def test_changed_memo_version_or_format_misses(memo, monkeypatch, change):
+    html = generate_page(5, sections=4)
+    ConfluenceRetrieval.extractPage(html, 'lxml')
+    if change == 'memo version':
+        monkeypatch.setattr(ConfluenceMemo, 'memoVersion', ConfluenceMemo.memoVersion + 1)
+    else:
+        monkeypatch.setattr(ConfluenceTables, 'tableFormat', 'tsv')
+
+    #Missed in memory and then in the file
+    ConfluenceRetrieval.extractPage(html, 'lxml')
+    assert _lookups(memo) == (0, 0, 8)
+
+@pytest.mark.parametrize('shape', list(pageShapes))
+@pytest.mark.parametrize('parser', parsers)
+@pytest.mark.parametrize('table_format', ConfluenceTables.tableFormats)
+def test_memo_gives_the_same_tables_as_an_uncached_parse(memo, monkeypatch, shape, parser, table_format):
+    monkeypatch.setattr(ConfluenceTables, 'tableFormat', table_format)
+    page_data = page_json(123, generate_page(2, **pageShapes[shape]))
+
+    cold = ConfluenceRetrieval.parsePage(page_data, parser)
+    misses = _lookups(memo)[2]
+    warm = ConfluenceRetrieval.parsePage(page_data, parser)
+    assert misses > 0
+    assert _lookups(memo) == (misses, 0, misses)
+    monkeypatch.setattr(ConfluenceMemo, '_memo', None)
+    uncached = ConfluenceRetrieval.parsePage(page_data, parser)
+
+    for parsed in (cold, warm):
+        assert parsed[0].equals(uncached[0])
+        assert parsed[1] == uncached[1]
+        assert len(parsed[2]) == len(uncached[2]) > 0
+        for table, uncached_table in zip(parsed[2], uncached[2]):
+            assert list(table.columns) == list(uncached_table.columns)
+            assert table.equals(uncached_table)
+
+@pytest.mark.parametrize('parser', parsers)
+def test_memo_gives_the_same_rows_when_streaming(memo, monkeypatch, parser):
+    html = generate_page(2, **pageShapes['nested sections'])
+
+    def streamed():
+        _, sections = ConfluenceRetrieval.extractPageRows(html, parser)
+        return [(section, [list(parts) for parts in rows]) for section, rows in sections]
+
+    cold = streamed()
+    misses = _lookups(memo)[2]
+    warm = streamed()
+    assert misses > 0
+    assert _lookups(memo) == (misses, 0, misses)
+    monkeypatch.setattr(ConfluenceMemo, '_memo', None)
+    assert cold == warm == streamed()
+
+def test_cached_tables_are_copies(memo):
+    html = generate_page(5, sections=3)
+    _, tables = ConfluenceRetrieval.extractPage(html, 'lxml')
+    tables[0].iloc[0, 0] = 'changed'
+    _, tables = ConfluenceRetrieval.extractPage(html, 'lxml')
+    assert tables[0].iloc[0, 0] != 'changed'
+
+@pytest.mark.parametrize('parser', parsers)
+def test_page_that_cannot_be_matched_is_extracted_without_the_memo(memo, parser):
+    #The macro in the code block is text to the parser but a section to the scan of the raw body
+    code = ('<ac:structured-macro ac:name="code"><ac:plain-text-body><![CDATA['
+            '<ac:structured-macro ac:name="ui-expand"></ac:structured-macro>]]></ac:plain-text-body></ac:structured-macro>')
+    html = generate_page(5, sections=3) + code
+    _, tables = ConfluenceRetrieval.extractPage(html, parser)
+    assert len(tables) == 3
+    assert memo.stats()['unmatched_pages'] == 1
+    assert _lookups(memo) == (0, 0, 0)
+
+def test_least_recently_used_entries_leave_memory_first():
+    memo = SectionMemo(max_entries=2)
+    memo.put('a', 1)
+    memo.put('b', 2)
+    assert memo.get('a') == 1
+    memo.put('c', 3)
+    assert memo.get('b') is None
+    assert memo.get('a') == 1 and memo.get('c') == 3
+
+def test_summary_text():
+    assert ConfluenceMemo.summary_text({}) == 'Section memo: no lookups'
+    counters = {'section_memo_hits': 6, 'section_memo_disk_hits': 2, 'section_memo_misses': 2}
+    assert ConfluenceMemo.summary_text(counters) == 'Section memo: 8 of 10 sections reused (80.0%, 2 from disk)'
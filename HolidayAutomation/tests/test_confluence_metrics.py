@@ -0,0 +1,156 @@
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from HolidayAutomation import ConfluenceMetrics
+from HolidayAutomation.ConfluenceMetrics import Histogram, Metrics, collect
+
+@pytest.fixture
+def registry():
+    registry = Metrics()
+    for seconds in (0.002, 0.02, 0.02, 0.3):
+        registry.observe('parsePage', seconds, page_bytes=10 * 1024)
+    registry.observe('parsePage', 1.5, page_bytes=2 * 1024**2)
+    registry.observe('fetchPage', 0.04)
+    registry.count('pages_processed', 5)
+    registry.count('bytes_downloaded', 2048)
+    registry.gauge('queue_depth', 3, stage='parse')
+    registry.gauge('queue_depth', 1, stage='parse')
+    registry.gauge('queue_depth', 2, stage='write')
+    return registry
+
+#Prometheus text back into {metric with labels: value}
+def _prometheus_values(text):
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            metric, value = line.rsplit(' ', 1)
+            values[metric] = float(value)
+    return values
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0, math.inf))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 0]
+    assert (histogram.count, histogram.sum, histogram.min, histogram.max) == (4, 6.5, 0.5, 3.0)
+    assert histogram.quantile(0.0) == 0.5
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1.0) == 3.0
+
+def test_values_past_the_last_bound_use_the_largest_value():
+    histogram = Histogram(buckets=(1.0, math.inf))
+    for value in (10.0, 20.0):
+        histogram.observe(value)
+    assert histogram.counts == [0, 2]
+    assert 10.0 <= histogram.quantile(0.95) <= 20.0
+
+def test_prometheus_text_round_trip(registry):
+    text = registry.prometheus_text()
+    values = _prometheus_values(text)
+    snapshot = registry.snapshot()
+
+    assert '# TYPE confluence_parsePage_seconds histogram' in text
+    assert values['confluence_parsePage_seconds_bucket{le="0.001"}'] == 0
+    assert values['confluence_parsePage_seconds_bucket{le="0.005"}'] == 1
+    assert values['confluence_parsePage_seconds_bucket{le="0.025"}'] == 3
+    assert values['confluence_parsePage_seconds_bucket{le="0.5"}'] == 4
+    assert values['confluence_parsePage_seconds_bucket{le="+Inf"}'] == 5
+    for name, timer in snapshot['timers'].items():
+        assert values['confluence_' + name + '_seconds_count'] == timer['count']
+        assert values['confluence_' + name + '_seconds_sum'] == pytest.approx(timer['sum'])
+        assert values['confluence_' + name + '_seconds_bucket{le="+Inf"}'] == timer['count']
+
+    assert '# TYPE confluence_pages_processed_total counter' in text
+    for name, total in snapshot['counters'].items():
+        assert values['confluence_' + name + '_total'] == total
+
+    assert values['confluence_queue_depth{stage="parse"}'] == 1
+    assert values['confluence_queue_depth_max{stage="parse"}'] == 3
+    assert values['confluence_queue_depth{stage="write"}'] == 2
+    assert text.count('# TYPE confluence_queue_depth gauge') == 1
+
+def test_summary_table_round_trip(registry):
+    lines = registry.summary_table().splitlines()
+    snapshot = registry.snapshot()
+
+    #Timers first, the slowest in total on top
+    timers = [line.split() for line in lines[1:lines.index('')]]
+    assert [fields[0] for fields in timers] == ['parsePage', 'fetchPage']
+    for fields in timers:
+        timer = snapshot['timers'][fields[0]]
+        assert int(fields[1]) == timer['count']
+        assert float(fields[2]) == pytest.approx(timer['sum'], abs=1e-3)
+        assert float(fields[4]) == pytest.approx(timer['p50'], abs=1e-4)
+        assert float(fields[6]) == pytest.approx(timer['max'], abs=1e-4)
+
+    by_size = {(fields[0], fields[1]): int(fields[2]) for fields in (line.split() for line in lines)
+               if len(fields) == 4 and fields[1] in ('<=16KB', '>1MB')}
+    assert by_size == {('parsePage', '<=16KB'): 4, ('parsePage', '>1MB'): 1}
+
+    rows = {fields[0]: fields[1:] for fields in (line.split() for line in lines) if fields}
+    assert rows['bytes_downloaded'] == ['2048']
+    assert rows['pages_processed'] == ['5']
+    assert rows['queue_depth{stage="parse"}'] == ['1', '3']
+    assert rows['queue_depth{stage="write"}'] == ['2', '2']
+
+def test_log_has_one_line_per_logged_observation(tmp_path):
+    registry = Metrics()
+    registry.open_log(str(tmp_path / 'metrics.jsonl'))
+    with registry.timer('parsePage', page_id='123') as fields:
+        fields['tables'] = 4
+    registry.count('pages_processed')
+    registry.count('bytes_downloaded', 10, log=True)
+    registry.close_log()
+
+    with open(tmp_path / 'metrics.jsonl', encoding='utf-8') as log_file:
+        events = [json.loads(line) for line in log_file]
+    assert [(event['type'], event['name']) for event in events] == [('timer', 'parsePage'), ('counter', 'bytes_downloaded')]
+    assert events[0]['page_id'] == '123' and events[0]['tables'] == 4
+    assert 'log' not in events[0]
+
+###
+# Observations of the parse processes
+###
+def _parse_in_worker(pages):
+    for page in range(pages):
+        ConfluenceMetrics.metrics.observe('parsePage', 0.01 * (page + 1), page_bytes=1024)
+        ConfluenceMetrics.metrics.count('section_memo_misses', 2)
+    return os.getpid()
+
+def test_collect_hands_back_what_the_call_recorded(monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(ConfluenceMetrics, 'metrics', registry)
+    pid, events = collect(_parse_in_worker, 3)
+
+    assert registry.snapshot()['timers'] == {} and registry.snapshot()['counters'] == {}
+    assert len(events) == 6
+    assert {event['pid'] for event in events} == {pid}
+
+    #Recording goes to the registry again once the call returns
+    registry.count('section_memo_misses')
+    assert registry.snapshot()['counters'] == {'section_memo_misses': 1}
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='workers are forked on Linux')
+def test_collect_merges_the_worker_processes_into_the_main_registry(monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(ConfluenceMetrics, 'metrics', registry)
+    registry.count('section_memo_misses', 1)
+
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('fork')) as pool:
+        results = list(pool.map(collect, [_parse_in_worker] * 4, [2] * 4))
+    for _, events in results:
+        registry.merge(events)
+
+    snapshot = registry.snapshot()
+    assert snapshot['timers']['parsePage']['count'] == 8
+    assert snapshot['timers']['parsePage']['sum'] == pytest.approx(4 * (0.01 + 0.02))
+    assert snapshot['counters']['section_memo_misses'] == 1 + 8 * 2
+    assert snapshot['by_page_size']['parsePage']['<=16KB']['count'] == 8
+    assert all(pid != os.getpid() for pid, _ in results)
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from HolidayAutomation import ConfluenceRetrieval
+from HolidayAutomation.ConfluenceCache import PageCache
+from HolidayAutomation.ConfluenceStub import generate_page, page_json
+
+@pytest.fixture
+def page_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = PageCache(str(tmp_path / 'cache.sqlite'))
+    yield cache
+    cache.close()
+
+def _page(version):
+    return page_json(123, generate_page(5, sections=4), version)
+
+def _failing_write(data):
+    raise OSError('disk full')
+
+def test_failed_excel_write_leaves_the_page_stale(page_cache, monkeypatch):
+    ConfluenceRetrieval.getContentFromConfluence(0, '123', _page(1), page_cache)
+    output = ConfluenceRetrieval.outputFileName('123', 'Page 123')
+    assert os.path.exists(output)
+    assert page_cache.stale({'123': 1}) == []
+
+    #Version 2 fails to write: the version 1 file is still there, the next run must fetch the page again
+    with monkeypatch.context() as patch:
+        patch.setattr(ConfluenceRetrieval, 'writeDFToExcel', _failing_write)
+        with pytest.raises(OSError):
+            ConfluenceRetrieval.getContentFromConfluence(0, '123', _page(2), page_cache)
+    assert os.path.exists(output)
+    assert page_cache.stale({'123': 2}) == ['123']
+
+    ConfluenceRetrieval.getContentFromConfluence(0, '123', _page(2), page_cache)
+    assert page_cache.stale({'123': 2}) == []
+
+class _FailingStore:
+
+    def write_frames(self, *args):
+        raise OSError('database is locked')
+
+def _parsed(page_data):
+    return 0, '123', page_data, ConfluenceRetrieval.parsePage(page_data)
+
+@pytest.mark.parametrize('failure', ['excel', 'store'])
+def test_failed_write_stage_leaves_the_page_stale(page_cache, monkeypatch, failure):
+    ConfluenceRetrieval.writeStage(_parsed(_page(1)), page_cache)
+    store = None
+    if failure == 'excel':
+        monkeypatch.setattr(ConfluenceRetrieval, 'writeDFToExcel', _failing_write)
+    else:
+        store = _FailingStore()
+
+    with pytest.raises(OSError):
+        ConfluenceRetrieval.writeStage(_parsed(_page(2)), page_cache, store)
+    assert page_cache.stale({'123': 2}) == ['123']
@@ -0,0 +1,56 @@
+import pytest
+
+from HolidayAutomation import ConfluenceRetrieval, ConfluenceTables
+from HolidayAutomation.ConfluenceStub import generate_page
+
+pytest.importorskip('lxml')
+pytest.importorskip('bs4')
+
+pageShapes = {
+    'nested tables': dict(nested_tables=0.5, content_wrappers=0.2, lists=0.1),
+    'merged cells': dict(nested_tables=0.5, content_wrappers=0.2, merged_cells=0.6),
+    'empty sections': dict(empty_sections=0.4),
+    'deep sections': dict(depth=3, nested_tables=0.2, merged_cells=0.3, empty_sections=0.2),
+}
+
+def _extract_both(html):
+    return (ConfluenceRetrieval.extractPage(html, 'bs4', memo=False),
+            ConfluenceRetrieval.extractPage(html, 'lxml', memo=False))
+
+@pytest.fixture(params=ConfluenceTables.tableFormats)
+def table_format(request, monkeypatch):
+    monkeypatch.setattr(ConfluenceTables, 'tableFormat', request.param)
+    return request.param
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('shape', list(pageShapes))
+def test_backends_give_identical_dataframes(shape, seed, table_format):
+    html = generate_page(seed, **pageShapes[shape])
+    (bs4_summary, bs4_tables), (lxml_summary, lxml_tables) = _extract_both(html)
+
+    assert bs4_summary == lxml_summary
+    assert len(bs4_tables) == len(lxml_tables) > 0
+    for bs4_df, lxml_df in zip(bs4_tables, lxml_tables):
+        assert list(bs4_df.columns) == list(lxml_df.columns)
+        assert bs4_df.equals(lxml_df)
+    assert ConfluenceRetrieval.compareParsers(html) == []
+
+def test_merged_cells_are_repeated_in_every_cell_they_span():
+    html = generate_page(1, sections=4, nested_tables=1.0, merged_cells=1.0)
+    (_, bs4_tables), (_, lxml_tables) = _extract_both(html)
+
+    cell = bs4_tables[0].iloc[0, 0]
+    lines = cell.strip('`\n').split('\n')
+    spanned, carried = lines[3].strip('|').split('|'), lines[5].strip('|').split('|')
+    assert spanned[0] == spanned[1] and spanned[2] == carried[2]
+    assert lxml_tables[0].iloc[0, 0] == cell
+
+#Section 4 is a 'SomeText' section, split into its two nested sections
+def test_empty_sections_keep_their_row():
+    html = generate_page(2, sections=6, empty_sections=1.0)
+    (_, bs4_tables), (_, lxml_tables) = _extract_both(html)
+
+    assert len(bs4_tables) == len(lxml_tables) == 7
+    for bs4_df, lxml_df in zip(bs4_tables, lxml_tables):
+        assert list(bs4_df.columns) == ['Section']
+        assert bs4_df.equals(lxml_df)
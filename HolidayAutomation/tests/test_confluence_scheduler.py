@@ -0,0 +1,119 @@
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from HolidayAutomation.ConfluenceScheduler import RequestScheduler
+from HolidayAutomation.ConfluenceStub import StubConfluence
+
+#A server accepting connections and never answering
+@pytest.fixture
+def hung_server():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    connections = []
+    stop = threading.Event()
+
+    def accept():
+        listener.settimeout(0.1)
+        while not stop.is_set():
+            try:
+                connections.append(listener.accept()[0])
+            except OSError:
+                continue
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+    stop.set()
+    thread.join()
+    for connection in connections:
+        connection.close()
+    listener.close()
+
+def test_hung_request_times_out_and_is_retried(hung_server):
+    scheduler = RequestScheduler(rate=100, max_retries=1, backoff_base=0.01, timeout=(1, 0.2))
+    with pytest.raises(requests.Timeout):
+        scheduler.get(requests.Session(), hung_server)
+    counters = scheduler.counters()
+    assert counters['connection_errors'] == 2
+    assert counters['retries'] == 1
+
+###
+# Throttling against StubConfluence
+###
+def _page_url(stub, page_id=1):
+    return stub.content_url + str(page_id)
+
+def _throttled_response(retry_after):
+    with StubConfluence(throttle=1.0, retry_after=retry_after) as stub:
+        return RequestScheduler(rate=100, max_retries=0).get(requests.Session(), _page_url(stub))
+
+def test_retry_after_in_seconds_and_as_a_date():
+    scheduler = RequestScheduler(retry_after_max=120)
+    assert scheduler.retry_after(_throttled_response(7)) == 7.0
+    assert scheduler.retry_after(_throttled_response(None)) is None
+
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= scheduler.retry_after(_throttled_response(in_a_minute)) <= 60
+
+@pytest.mark.parametrize('retry_after', [86400, format_datetime(datetime(2100, 1, 1, tzinfo=timezone.utc), usegmt=True)])
+def test_long_retry_after_is_capped(retry_after):
+    response = _throttled_response(retry_after)
+    assert RequestScheduler(retry_after_max=30).retry_after(response) == 30.0
+
+    with StubConfluence(throttle=1.0, retry_after=retry_after) as stub:
+        scheduler = RequestScheduler(rate=100, max_retries=1, retry_after_max=0.2)
+        started = time.monotonic()
+        assert scheduler.get(requests.Session(), _page_url(stub)).status_code == 429
+        assert time.monotonic() - started < 5
+    counters = scheduler.counters()
+    assert counters['backoff_seconds'] == pytest.approx(0.2)
+    assert counters['throttled'] == 2 and counters['failed'] == 1
+
+def test_throttled_requests_are_retried_until_they_succeed():
+    with StubConfluence(throttle=0.5, retry_after=0) as stub:
+        scheduler = RequestScheduler(rate=200, max_retries=10)
+        session = requests.Session()
+        statuses = [scheduler.get(session, _page_url(stub, page_id)).status_code for page_id in range(1, 21)]
+    counters = scheduler.counters()
+    assert statuses == [200] * 20
+    assert counters['succeeded'] == 20
+    assert counters['throttled'] == counters['retries'] == stub.counters['throttled'] > 0
+
+def test_concurrency_limit_halves_on_429_and_grows_back():
+    with StubConfluence(throttle=1.0, retry_after=0) as stub:
+        scheduler = RequestScheduler(rate=200, initial_concurrency=8, max_concurrency=8, max_retries=0)
+        session = requests.Session()
+        host = stub.url[len('http://'):]
+
+        limits = []
+        for _ in range(4):
+            scheduler.get(session, _page_url(stub))
+            limits.append(scheduler.counters()['hosts'][host]['limit'])
+        assert limits == [4, 2, 1, 1]
+
+        stub.throttle = 0.0
+        for _ in range(10):
+            scheduler.get(session, _page_url(stub))
+        grown = scheduler.counters()['hosts'][host]['limit']
+        assert 4 < grown <= 8
+
+        for _ in range(40): #About limit ** 2 / 2 successes to grow back to the cap
+            scheduler.get(session, _page_url(stub))
+        assert scheduler.counters()['hosts'][host]['limit'] == 8
+
+def test_token_bucket_holds_the_rate():
+    with StubConfluence() as stub:
+        scheduler = RequestScheduler(rate=20, burst=1)
+        session = requests.Session()
+        started = time.monotonic()
+        for _ in range(11):
+            assert scheduler.get(session, _page_url(stub)).status_code == 200
+        elapsed = time.monotonic() - started
+    assert elapsed >= 0.45 #10 tokens refilled at 20 per second
+    assert scheduler.counters()['token_wait_seconds'] >= 0.4
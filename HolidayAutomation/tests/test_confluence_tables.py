@@ -0,0 +1,29 @@
+from importlib import metadata
+
+import pytest
+
+from HolidayAutomation.ConfluenceTables import render_grid
+
+regularTables = [
+    [['A', 'Bee'], ['x', 'long value'], ['yy', '']],
+    [['Name', 'Days', 'Type'], ['Alice', '3', 'Annual'], ['Bob', '12', 'Sick leave']],
+    [['A very wide header', 'B'], ['1', '2'], ['', '']],
+    [['Odd', 'Even'], ['ab', 'abc'], ['abcd', 'a']],
+]
+
+def _markdown_table(grid):
+    py_markdown_table = pytest.importorskip('py_markdown_table.markdown_table')
+    version = tuple(int(part) for part in metadata.version('py_markdown_table').split('.')[:2])
+    if version < (1, 2):
+        pytest.skip('py_markdown_table before 1.2 draws the outer borders without the column joints')
+    header = grid[0]
+    return py_markdown_table.markdown_table([dict(zip(header, row)) for row in grid[1:]]).get_markdown()
+
+@pytest.mark.parametrize('grid', regularTables)
+def test_grid_matches_py_markdown_table(grid):
+    assert render_grid(grid) == _markdown_table(grid)
+
+def test_outer_borders_are_the_row_separator():
+    lines = render_grid([['A', 'Bee'], ['yy', 'long value']])[len('```\n'):-len('```')].split('\n')
+    assert lines[0] == lines[2] == lines[-1] == '+--+----------+'
+    assert lines[1] == '| A|    Bee   |'
@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from HolidayAutomation.DownloadWatcher import DownloadWatcher, wait_for_download
+
+backends = ['poll', pytest.param('inotify', marks=pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux only'))]
+
+@pytest.fixture(params=backends)
+def backend(request):
+    return request.param
+
+#Run the download in the background, like the browser does after the click
+def _later(action, delay=0.2):
+    thread = threading.Thread(target=lambda: (time.sleep(delay), action()), daemon=True)
+    thread.start()
+    return thread
+
+def _write(path, chunks=1, pause=0.0, chunk=b'x' * 1024):
+    with open(path, 'wb') as download:
+        for _ in range(chunks):
+            download.write(chunk)
+            download.flush()
+            time.sleep(pause)
+
+def test_finished_file_is_returned(tmp_path, backend):
+    target = tmp_path / 'LeaveRecordsReport.xlsx'
+    path = wait_for_download(str(tmp_path), lambda: _later(lambda: _write(target)), timeout=5, settle=0.1, backend=backend)
+    assert path == str(target)
+
+def test_partial_download_is_ignored_until_renamed(tmp_path, backend):
+    partial = tmp_path / 'LeaveRecordsReport.xlsx.crdownload'
+    target = tmp_path / 'LeaveRecordsReport.xlsx'
+
+    def download():
+        _write(partial, chunks=5, pause=0.05)
+        time.sleep(0.3)
+        os.rename(partial, target)
+
+    with DownloadWatcher(str(tmp_path), settle=0.1, backend=backend) as watcher:
+        _later(download)
+        started = time.monotonic()
+        assert watcher.wait(timeout=5) == str(target)
+    assert time.monotonic() - started >= 0.7
+    assert not partial.exists()
+
+def test_file_is_returned_once_its_size_settles(tmp_path, backend):
+    target = tmp_path / 'LeaveRecordsReport.xlsx'
+
+    #Written in place in pieces, reopened between them, like a slow download without a partial file
+    def download():
+        for _ in range(5):
+            with open(target, 'ab') as report:
+                report.write(b'x' * 1024)
+            time.sleep(0.15)
+
+    with DownloadWatcher(str(tmp_path), settle=0.4, backend=backend) as watcher:
+        writer = _later(download, delay=0)
+        path = watcher.wait(timeout=5)
+    writer.join()
+    assert path == str(target)
+    assert os.path.getsize(path) == 5 * 1024
+
+def test_timeout_without_a_download(tmp_path, backend):
+    (tmp_path / 'Notes.txt').write_text('not a report')
+    with DownloadWatcher(str(tmp_path), settle=0.1, backend=backend) as watcher:
+        _later(lambda: _write(tmp_path / 'Other.txt'), delay=0.1)
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            watcher.wait(timeout=0.8)
+    assert 0.7 <= time.monotonic() - started < 3
+
+def test_files_already_there_are_not_returned(tmp_path, backend):
+    existing = tmp_path / 'Earlier.xlsx'
+    existing.write_bytes(b'earlier export')
+    target = tmp_path / 'LeaveRecordsReport.xlsx'
+
+    #Opened for writing and closed unchanged: an event for inotify, but still the file that was there before
+    def download():
+        open(existing, 'ab').close()
+        time.sleep(0.3)
+        _write(target)
+
+    with DownloadWatcher(str(tmp_path), settle=0.1, backend=backend) as watcher:
+        _later(download)
+        assert watcher.wait(timeout=5) == str(target)
+
+def test_backend_is_the_one_asked_for(tmp_path, backend):
+    with DownloadWatcher(str(tmp_path), backend=backend) as watcher:
+        assert type(watcher._source).__name__ == {'poll': 'PollSource', 'inotify': 'InotifySource'}[backend]
+
+def test_directory_is_created(tmp_path, backend):
+    folder = tmp_path / 'Files' / 'Downloads'
+    with DownloadWatcher(str(folder), backend=backend):
+        assert folder.is_dir()
@@ -0,0 +1,132 @@
+import json
+import os
+import zipfile
+from datetime import date
+
+import pytest
+
+from HolidayAutomation import FileRetention
+from HolidayAutomation.FileRetention import Archive, apply_retention
+
+today = date(2024, 6, 30)
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'Processed'
+    folder.mkdir()
+    for day in ('20240101', '20240301', '20240601', '20240615'):
+        (folder / ('SG_LeaveRecordsReportSingle_' + day + '.xlsx')).write_bytes(b'report ' + day.encode())
+    for day in ('20240501', '20240620'):
+        (folder / ('HolidayList_' + day + '.xlsx')).write_bytes(b'list ' + day.encode())
+    (folder / 'Notes.xlsx').write_bytes(b'not dated')
+    (folder / 'Summary_2024.xlsx').write_bytes(b'not a full date')
+    (folder / 'Readme_20240101.txt').write_bytes(b'other pattern')
+    return folder
+
+def _names(folder):
+    return sorted(entry.name for entry in os.scandir(folder) if entry.is_file())
+
+def _manifest(archive_folder):
+    with open(os.path.join(archive_folder, FileRetention.manifestFile), encoding='utf-8') as manifest_file:
+        return [json.loads(line) for line in manifest_file]
+
+def test_newest_of_every_base_name_stays(folder):
+    assert apply_retention(str(folder), keep=1) == 4
+    assert _names(folder) == ['HolidayList_20240620.xlsx', 'Notes.xlsx', 'Readme_20240101.txt',
+                              'SG_LeaveRecordsReportSingle_20240615.xlsx', 'Summary_2024.xlsx']
+    assert _names(folder / 'archive') == ['HolidayList_20240501.xlsx', 'SG_LeaveRecordsReportSingle_20240101.xlsx',
+                                          'SG_LeaveRecordsReportSingle_20240301.xlsx',
+                                          'SG_LeaveRecordsReportSingle_20240601.xlsx', 'manifest.jsonl']
+
+def test_keep_count_is_per_base_name(folder):
+    assert apply_retention(str(folder), keep=2) == 2
+    archived = {record["name"] for record in _manifest(folder / 'archive')}
+    assert archived == {'SG_LeaveRecordsReportSingle_20240101.xlsx', 'SG_LeaveRecordsReportSingle_20240301.xlsx'}
+
+def test_same_date_is_ordered_by_modification_time(tmp_path):
+    for name, mtime in (('Report_20240601.xlsx', 1000), ('Report_20240601.xlsm', 2000)):
+        (tmp_path / name).write_bytes(b'x')
+        os.utime(tmp_path / name, (mtime, mtime))
+    apply_retention(str(tmp_path), keep=1, patterns=('*.xlsx', '*.xlsm'))
+    assert _names(tmp_path) == ['Report_20240601.xlsm']
+
+def test_age_limit_archives_old_files_within_the_keep_count(folder):
+    assert apply_retention(str(folder), keep=10, max_age_days=45, today=today) == 3
+    assert sorted(record["name"] for record in _manifest(folder / 'archive')) == [
+        'HolidayList_20240501.xlsx', 'SG_LeaveRecordsReportSingle_20240101.xlsx', 'SG_LeaveRecordsReportSingle_20240301.xlsx']
+
+def test_age_limit_keeps_the_newest_file_however_old(folder):
+    apply_retention(str(folder), keep=10, max_age_days=1, today=date(2030, 1, 1))
+    assert _names(folder) == ['HolidayList_20240620.xlsx', 'Notes.xlsx', 'Readme_20240101.txt',
+                              'SG_LeaveRecordsReportSingle_20240615.xlsx', 'Summary_2024.xlsx']
+
+def test_both_limits_apply(folder):
+    assert apply_retention(str(folder), keep=2, max_age_days=200, today=today) == 2
+    assert {record["name"] for record in _manifest(folder / 'archive')} == {
+        'SG_LeaveRecordsReportSingle_20240101.xlsx', 'SG_LeaveRecordsReportSingle_20240301.xlsx'}
+
+def test_manifest_records_every_archived_file(folder):
+    apply_retention(str(folder), keep=1)
+    records = _manifest(folder / 'archive')
+    assert len(records) == 4
+    for record in records:
+        assert set(record) == {"base", "name", "location", "archived_at"}
+        assert record["location"] == record["name"]
+        assert record["name"].startswith(record["base"] + '_')
+    assert set(Archive(str(folder / 'archive')).index('HolidayList')) == {'HolidayList_20240501.xlsx'}
+
+def test_later_runs_append_to_the_manifest(folder):
+    apply_retention(str(folder), keep=3)
+    apply_retention(str(folder), keep=1)
+    names = [record["name"] for record in _manifest(folder / 'archive')]
+    assert names[0] == 'SG_LeaveRecordsReportSingle_20240101.xlsx'
+    assert sorted(names[1:]) == ['HolidayList_20240501.xlsx', 'SG_LeaveRecordsReportSingle_20240301.xlsx',
+                                 'SG_LeaveRecordsReportSingle_20240601.xlsx']
+
+def test_compress_appends_to_one_zip_per_base_name(folder):
+    apply_retention(str(folder), keep=1, compress=True)
+    archive_folder = folder / 'archive'
+    assert _names(archive_folder) == ['HolidayList.zip', 'SG_LeaveRecordsReportSingle.zip', 'manifest.jsonl']
+    with zipfile.ZipFile(archive_folder / 'SG_LeaveRecordsReportSingle.zip') as archive_zip:
+        assert sorted(archive_zip.namelist()) == ['SG_LeaveRecordsReportSingle_20240101.xlsx',
+                                                  'SG_LeaveRecordsReportSingle_20240301.xlsx',
+                                                  'SG_LeaveRecordsReportSingle_20240601.xlsx']
+        assert archive_zip.read('SG_LeaveRecordsReportSingle_20240101.xlsx') == b'report 20240101'
+    assert {record["location"] for record in _manifest(archive_folder)} == {'HolidayList.zip', 'SG_LeaveRecordsReportSingle.zip'}
+
+def test_name_already_in_the_zip_is_left_in_place(folder):
+    archive_folder = folder / 'archive'
+    archive_folder.mkdir()
+    with zipfile.ZipFile(archive_folder / 'HolidayList.zip', 'w') as archive_zip:
+        archive_zip.writestr('HolidayList_20240501.xlsx', b'earlier copy')
+
+    apply_retention(str(folder), keep=1, compress=True)
+    assert (folder / 'HolidayList_20240501.xlsx').exists()
+    assert 'HolidayList_20240501.xlsx' not in {record["name"] for record in _manifest(archive_folder)}
+
+def test_dry_run_moves_nothing(folder):
+    before = _names(folder)
+    assert apply_retention(str(folder), keep=1, dry_run=True) == 0
+    assert _names(folder) == before
+    assert not (folder / 'archive').exists()
+
+def test_files_outside_the_patterns_or_without_a_date_are_not_managed(folder):
+    groups = FileRetention.scan(str(folder))
+    assert set(groups) == {'SG_LeaveRecordsReportSingle', 'HolidayList'}
+    apply_retention(str(folder), keep=0)
+    assert _names(folder) == ['Notes.xlsx', 'Readme_20240101.txt', 'Summary_2024.xlsx']
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_files_gone_since_the_scan_are_skipped(folder, compress):
+    moves = list(FileRetention.expired(FileRetention.scan(str(folder)), keep=1))
+    os.remove(folder / 'SG_LeaveRecordsReportSingle_20240301.xlsx')
+
+    assert Archive(str(folder / 'archive'), compress).archive(str(folder), moves) == 3
+    assert 'SG_LeaveRecordsReportSingle_20240301.xlsx' not in {record["name"] for record in _manifest(folder / 'archive')}
+    assert len(_manifest(folder / 'archive')) == 3
+
+def test_missing_folders(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        apply_retention(str(tmp_path / 'missing'))
+    assert Archive(str(tmp_path / 'archive')).index() == {}
+    assert apply_retention(str(tmp_path), keep=1) == 0
@@ -0,0 +1,64 @@
+import datetime
+import os
+import time
+
+from HolidayAutomation import HolidayHistory
+
+def row(employee, leave_type, date_from, date_to=None, status='Approved', days=1):
+    return ['Employee ' + employee, 'IT', 'Engineer', leave_type, date_from, date_to or date_from, 'Full Day', days,
+            status, '01-01-2026', date_from]
+
+def test_new_changed_cancelled(tmp_path):
+    with HolidayHistory.LeaveHistory(str(tmp_path / 'history.db')) as history:
+        _, counts = history.merge_rows([row('1', 'Annual Leave', '05-01-2026'), row('2', 'Sick Leave', '06-01-2026'),
+                                        row('3', 'Annual Leave', '07-01-2026')], datetime.date(2026, 1, 1), datetime.date(2026, 1, 31))
+        assert counts == {'new': 3, 'changed': 0, 'cancelled': 0, 'unchanged': 0}
+
+        run_id, counts = history.merge_rows([row('1', 'Annual Leave', '05-01-2026', days=2),
+                                             row('2', 'Sick Leave', '06-01-2026', status='Cancelled')],
+                                            datetime.date(2026, 1, 1), datetime.date(2026, 1, 31))
+        assert counts == {'new': 0, 'changed': 1, 'cancelled': 2, 'unchanged': 0}
+        changes = {change[1]: (change[0], change[-1]) for change in history.changes(run_id)}
+        assert changes == {'Employee 1': ('changed', 'No. of Days'), 'Employee 2': ('cancelled', 'Status'),
+                           'Employee 3': ('cancelled', '')}
+
+#Leave starting before the window but running into it is listed, and cancelled when it is gone
+def test_entries_overlapping_the_window(tmp_path):
+    with HolidayHistory.LeaveHistory(str(tmp_path / 'history.db')) as history:
+        history.merge_rows([row('1', 'Annual Leave', '28-12-2025', '03-01-2026'), row('2', 'Annual Leave', '20-12-2025')],
+                           datetime.date(2025, 12, 1), datetime.date(2026, 1, 31))
+        listed = list(history.entries(datetime.date(2026, 1, 1), datetime.date(2026, 1, 31)))
+        assert [values[0] for values in listed] == ['Employee 1']
+
+        _, counts = history.merge_rows([], datetime.date(2026, 1, 1), datetime.date(2026, 1, 31))
+        assert counts['cancelled'] == 1
+
+def test_pending_windows(tmp_path):
+    today = datetime.date(2026, 1, 1)
+    with HolidayHistory.LeaveHistory(str(tmp_path / 'history.db')) as history:
+        assert history.pending_windows(datetime.date(2026, 1, 4), datetime.date(2026, 2, 4), today=today) == \
+            [(datetime.date(2026, 1, 4), datetime.date(2026, 2, 4))]
+        history.merge_rows([], datetime.date(2026, 1, 4), datetime.date(2026, 2, 4))
+
+        #A week later: the near-term dates and the new tail are exported, the middle comes from the history
+        assert history.pending_windows(datetime.date(2026, 1, 11), datetime.date(2026, 2, 11), today=today + datetime.timedelta(days=7)) == \
+            [(datetime.date(2026, 1, 11), datetime.date(2026, 1, 22)), (datetime.date(2026, 2, 5), datetime.date(2026, 2, 11))]
+
+        #Coverage expires
+        history._connection().execute('UPDATE coverage SET exported_at = ?', (time.time() - 40 * 86400,))
+        assert history.pending_windows(datetime.date(2026, 1, 11), datetime.date(2026, 2, 11), today=today) == \
+            [(datetime.date(2026, 1, 11), datetime.date(2026, 2, 11))]
+
+#The weekly file written from the history lists the same leave as a direct export of the window
+def test_report_from_history_matches_export(automation, stub, read_rows, tmp_path):
+    start_date, end_date = datetime.datetime(2026, 3, 5), datetime.datetime(2026, 4, 5)
+    direct = automation.redact_report(automation.download_report(start_date, end_date), str(tmp_path / 'direct'))
+    os.remove(os.path.join(automation.outdir, automation.report_filename(start_date)))
+
+    history_file = str(tmp_path / 'history.db')
+    automation.report_from_history(history_file, start_date=datetime.datetime(2026, 2, 26), end_date=datetime.datetime(2026, 3, 26))
+    weekly = automation.report_from_history(history_file, start_date=start_date, end_date=end_date)
+
+    expected, written = read_rows(direct), read_rows(weekly)
+    assert written[0] == expected[0]
+    assert sorted(written[1:]) == sorted(expected[1:])
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+
+from HolidayAutomation import HolidayHttpExport, HolidayStub
+from HolidayAutomation.HolidayHttpExport import ExportError
+
+startDate = datetime(2024, 3, 1)
+endDate = datetime(2024, 3, 31)
+
+def _download(stub, destination, start_date=startDate, end_date=endDate, session=None, password='secret'):
+    return HolidayHttpExport.download_report(start_date, end_date, str(destination), stub.login_url, stub.report_url,
+                                             'ACME', 'E001', password, session=session)
+
+def _leftovers(folder):
+    return sorted(path.name for path in folder.iterdir() if '.tmp' in path.name)
+
+def test_export_is_the_stub_workbook(stub, tmp_path, read_rows):
+    destination = tmp_path / 'LeaveRecordsReport.xlsx'
+    path, size = _download(stub, destination)
+
+    assert path == str(destination) and size == destination.stat().st_size
+    rows = read_rows(path)
+    assert rows[0] == tuple(HolidayStub.reportColumns)
+    assert len(rows) == len(HolidayStub.generate_leave(startDate, endDate, stub.employees)) + 1
+    assert stub.counters["logins"] == 1 and stub.counters["exports"] == 1
+
+def test_login_is_retried_until_the_site_accepts_it(tmp_path):
+    with HolidayStub.StubWebForms(employees=5, fail_logins=2) as stub:
+        _download(stub, tmp_path / 'report.xlsx')
+        assert stub.counters["failed_logins"] == 2
+        assert stub.counters["logins"] == 1
+    assert (tmp_path / 'report.xlsx').exists()
+
+def test_login_gives_up_after_max_tries(tmp_path):
+    with HolidayStub.StubWebForms(employees=5, fail_logins=5) as stub:
+        with pytest.raises(ExportError, match='Login failed after 3 tries'):
+            _download(stub, tmp_path / 'report.xlsx')
+        assert stub.counters["failed_logins"] == 3
+    assert list(tmp_path.iterdir()) == []
+
+def test_expired_session_logs_in_again(stub, tmp_path):
+    session = HolidayHttpExport.get_session()
+    _download(stub, tmp_path / 'first.xlsx', session=session)
+    stub.expire_sessions()
+
+    _download(stub, tmp_path / 'second.xlsx', session=session)
+    assert stub.counters["logins"] == 2
+    assert (tmp_path / 'second.xlsx').exists()
+
+def test_session_expiring_before_the_export_raises(stub, tmp_path):
+    session = HolidayHttpExport.get_session()
+    HolidayHttpExport.login(session, stub.login_url, 'ACME', 'E001', 'secret')
+    stub.expire_sessions()
+
+    #The report page redirects to the login form, which has no date fields
+    with pytest.raises(ExportError, match='No date field'):
+        HolidayHttpExport.export_report(session, stub.report_url, startDate, endDate, str(tmp_path / 'report.xlsx'))
+    assert list(tmp_path.iterdir()) == []
+
+def test_non_workbook_response_raises_and_keeps_the_previous_export(stub, tmp_path):
+    destination = tmp_path / 'report.xlsx'
+    destination.write_bytes(b'previous export')
+
+    #The stub answers a window ending before it starts with the report page again
+    with pytest.raises(ExportError, match='did not return a workbook'):
+        _download(stub, destination, start_date=endDate, end_date=startDate)
+    assert destination.read_bytes() == b'previous export'
+    assert _leftovers(tmp_path) == []
+
+def test_export_replaces_the_destination_through_a_temporary_file(stub, tmp_path, read_rows, monkeypatch):
+    destination = tmp_path / 'report.xlsx'
+    destination.write_bytes(b'previous export')
+    monkeypatch.setattr(HolidayHttpExport, 'chunkSize', 1024)
+    replaced = []
+    os_replace = HolidayHttpExport.os.replace
+
+    def replace(source, target):
+        replaced.append((source, target, _leftovers(tmp_path)))
+        return os_replace(source, target)
+    monkeypatch.setattr(HolidayHttpExport.os, 'replace', replace)
+
+    _download(stub, destination)
+    assert replaced == [(str(tmp_path / 'report.tmp.xlsx'), str(destination), ['report.tmp.xlsx'])]
+    assert _leftovers(tmp_path) == []
+    assert read_rows(str(destination))[0] == tuple(HolidayStub.reportColumns)
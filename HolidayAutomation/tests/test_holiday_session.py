@@ -0,0 +1,167 @@
+import os
+import stat
+import sys
+import time
+
+import pytest
+
+from HolidayAutomation import HolidaySession
+from HolidayAutomation.HolidaySession import SessionJar, cached_driver
+
+cookies = [{"name": "ASP.NET_SessionId", "value": "abc123", "domain": "127.0.0.1", "path": "/", "secure": False},
+           {"name": "remember", "value": "1", "domain": "127.0.0.1", "path": "/", "secure": True, "expiry": 2000000000}]
+
+@pytest.fixture
+def fernet():
+    return pytest.importorskip('cryptography.fernet')
+
+@pytest.fixture
+def jar(fernet, tmp_path, monkeypatch):
+    monkeypatch.delenv(HolidaySession.sessionKeyVariable, raising=False)
+    return SessionJar(str(tmp_path / 'session.bin'), str(tmp_path / 'session.key'))
+
+def test_saved_cookies_load_back(jar):
+    assert jar.load() == []
+    assert jar.save(cookies)
+    assert SessionJar(jar.path, jar.key_file).load() == cookies
+
+def test_jar_is_not_written_in_clear(jar):
+    jar.save(cookies)
+    with open(jar.path, 'rb') as jar_file:
+        assert b'abc123' not in jar_file.read()
+
+#A jar saved 13 hours ago, written the way save() writes it
+def test_jar_older_than_max_age_is_ignored(jar, fernet):
+    jar.save(cookies)
+    with open(jar.key_file, 'rb') as key_file:
+        key = key_file.read()
+    with open(jar.path, 'rb') as jar_file:
+        payload = fernet.Fernet(key).decrypt(jar_file.read())
+    with open(jar.path, 'wb') as jar_file:
+        jar_file.write(fernet.Fernet(key).encrypt_at_time(payload, int(time.time() - 13 * 3600)))
+
+    assert SessionJar(jar.path, jar.key_file, max_age_hours=12).load() == []
+    assert SessionJar(jar.path, jar.key_file, max_age_hours=14).load() == cookies
+    jar.save(cookies)
+    assert SessionJar(jar.path, jar.key_file, max_age_hours=12).load() == cookies
+
+def test_wrong_key_loads_nothing(jar, tmp_path, fernet, monkeypatch):
+    jar.save(cookies)
+    assert SessionJar(jar.path, str(tmp_path / 'other.key')).load() == []
+
+    monkeypatch.setenv(HolidaySession.sessionKeyVariable, fernet.Fernet.generate_key().decode())
+    assert SessionJar(jar.path, jar.key_file).load() == []
+
+def test_corrupt_jar_loads_nothing(jar):
+    jar.save(cookies)
+    with open(jar.path, 'ab') as jar_file:
+        jar_file.write(b'garbage')
+    assert jar.load() == []
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason='POSIX permissions')
+def test_key_and_jar_files_are_owner_only(jar):
+    jar.save(cookies)
+    assert stat.S_IMODE(os.stat(jar.key_file).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(jar.path).st_mode) == 0o600
+
+def test_key_from_environment_writes_no_key_file(jar, fernet, monkeypatch):
+    monkeypatch.setenv(HolidaySession.sessionKeyVariable, fernet.Fernet.generate_key().decode())
+    jar.save(cookies)
+    assert not os.path.exists(jar.key_file)
+    assert SessionJar(jar.path, jar.key_file).load() == cookies
+
+def test_requests_session_round_trip(jar):
+    requests = pytest.importorskip('requests')
+    source = requests.Session()
+    for cookie in cookies:
+        source.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"],
+                           secure=cookie["secure"], expires=cookie.get("expiry"))
+    jar.save_session(source)
+
+    target = requests.Session()
+    assert jar.restore_session(target)
+    assert {cookie.name: cookie.value for cookie in target.cookies} == {"ASP.NET_SessionId": "abc123", "remember": "1"}
+
+###
+# Driver cache
+###
+@pytest.fixture
+def resolver(tmp_path):
+    calls = []
+
+    def resolve():
+        path = tmp_path / ('chromedriver_%d' % len(calls))
+        path.write_text('driver')
+        calls.append(str(path))
+        return str(path)
+    resolve.calls = calls
+    return resolve
+
+def test_driver_is_resolved_once_per_major_version(tmp_path, resolver):
+    cache_file = str(tmp_path / 'driver.json')
+    first = cached_driver(resolver, cache_file, '120.0.6099.109')
+    assert cached_driver(resolver, cache_file, '120.0.6099.130') == first
+    assert cached_driver(resolver, cache_file, 'Google Chrome 120.0.6099.200') == first
+    assert len(resolver.calls) == 1
+
+    second = cached_driver(resolver, cache_file, '121.0.6167.85')
+    assert second != first and len(resolver.calls) == 2
+    assert cached_driver(resolver, cache_file, '120.0.6099.109') == first
+    assert len(resolver.calls) == 2
+
+def test_removed_driver_is_resolved_again(tmp_path, resolver):
+    cache_file = str(tmp_path / 'driver.json')
+    first = cached_driver(resolver, cache_file, '120.0.6099.109')
+    os.remove(first)
+    assert cached_driver(resolver, cache_file, '120.0.6099.109') != first
+    assert len(resolver.calls) == 2
+
+def test_unknown_chrome_version_resolves_every_run(tmp_path, resolver, monkeypatch):
+    monkeypatch.setattr(HolidaySession, 'chrome_version', lambda: None)
+    cache_file = str(tmp_path / 'driver.json')
+    cached_driver(resolver, cache_file)
+    cached_driver(resolver, cache_file)
+    assert len(resolver.calls) == 2
+    assert not os.path.exists(cache_file)
+
+###
+# Without cryptography, and with a jar that cannot be written
+###
+def test_without_cryptography_nothing_is_saved_and_a_warning_says_so(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, 'cryptography.fernet', None)
+    jar = SessionJar(str(tmp_path / 'session.bin'), str(tmp_path / 'session.key'))
+
+    assert not jar.save(cookies)
+    assert jar.load() == []
+    assert capsys.readouterr().out.count('Warning: cryptography is not installed') == 1
+    assert list(tmp_path.iterdir()) == []
+
+def test_unwritable_jar_warns_instead_of_raising(jar, tmp_path, capsys):
+    jar.path = str(tmp_path / 'missing' / 'session.bin')
+    assert not jar.save(cookies)
+    assert 'Warning: the session jar could not be written' in capsys.readouterr().out
+
+###
+# Saved session through the browserless export
+###
+def test_saved_session_skips_the_login_form(jar, stub, tmp_path):
+    from datetime import datetime
+
+    from HolidayAutomation import HolidayHttpExport
+
+    def download(name):
+        return HolidayHttpExport.download_report(datetime(2024, 3, 1), datetime(2024, 3, 31), str(tmp_path / name),
+                                                 stub.login_url, stub.report_url, 'ACME', 'E001', 'secret', jar=jar)
+
+    download('first.xlsx')
+    assert stub.counters["logins"] == 1
+    assert SessionJar(jar.path, jar.key_file).load() != []
+
+    #A new requests session each time, only the jar carries the login over
+    download('second.xlsx')
+    assert stub.counters["logins"] == 1
+    assert stub.counters["exports"] == 2
+
+    stub.expire_sessions()
+    download('third.xlsx')
+    assert stub.counters["logins"] == 2
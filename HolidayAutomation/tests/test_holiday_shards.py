@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from HolidayAutomation import HolidayShards, HolidayStub
+from HolidayAutomation.HolidayShards import ShardError, merge_exports, split_window
+
+startDate = datetime(2024, 1, 1)
+endDate = datetime(2024, 3, 31)
+
+@pytest.mark.parametrize('start, end, shards', [
+    (startDate, endDate, 4),
+    (startDate, endDate, 7),
+    (datetime(2024, 2, 27), datetime(2024, 3, 2), 2),
+    (startDate, startDate + timedelta(days=2), 10),
+    (startDate, startDate, 3),
+])
+def test_windows_are_consecutive_and_cover_every_day(start, end, shards):
+    windows = split_window(start, end, shards)
+    days = (end - start).days + 1
+
+    assert len(windows) == min(shards, days)
+    assert windows[0][0] == start and windows[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+        assert next_start == previous_end + timedelta(days=1)
+    lengths = [(shard_end - shard_start).days + 1 for shard_start, shard_end in windows]
+    assert sum(lengths) == days
+    assert max(lengths) - min(lengths) <= 1
+
+def _shard_exports(folder, windows, employees=20):
+    paths = []
+    for number, (shard_start, shard_end) in enumerate(windows):
+        path = folder / ('shard%d.xlsx' % number)
+        path.write_bytes(HolidayStub.report_workbook(HolidayStub.generate_leave(shard_start, shard_end, employees)))
+        paths.append(str(path))
+    return paths
+
+def test_merge_keeps_shard_order_and_drops_rows_over_boundaries(tmp_path, read_rows):
+    windows = split_window(startDate, endDate, 3)
+    paths = _shard_exports(tmp_path, windows)
+    merged = merge_exports(paths, str(tmp_path / 'merged.xlsx'))
+
+    expected = []
+    for path in paths:
+        for row in read_rows(path)[1:]:
+            if row not in expected:
+                expected.append(row)
+    rows = read_rows(merged)
+    assert rows[0] == tuple(HolidayStub.reportColumns)
+    assert rows[1:] == expected
+    assert len(expected) < sum(len(read_rows(path)) - 1 for path in paths) #Leave running over a boundary
+    assert not (tmp_path / 'merged.tmp.xlsx').exists()
+
+def test_merge_refuses_shards_with_other_columns(tmp_path):
+    from openpyxl import Workbook
+
+    paths = _shard_exports(tmp_path, split_window(startDate, endDate, 2))
+    other = Workbook()
+    other.active.append(['Employee No', 'Leave Type'])
+    other.save(str(tmp_path / 'other.xlsx'))
+
+    with pytest.raises(ShardError, match='other.xlsx'):
+        merge_exports(paths + [str(tmp_path / 'other.xlsx')], str(tmp_path / 'merged.xlsx'))
+    assert not (tmp_path / 'merged.xlsx').exists()
+
+def test_sharded_export_matches_a_single_export(automation, stub, tmp_path, read_rows):
+    single = automation.download_report(startDate, endDate)
+    sharded = HolidayShards.download_report_sharded(startDate, endDate, shards=4, max_parallel=2,
+                                                    output_directory=str(tmp_path / 'Sharded'),
+                                                    directory=str(tmp_path / 'Shards'))
+
+    assert sharded == str(tmp_path / 'Sharded' / automation.report_filename(startDate))
+    single_rows, sharded_rows = read_rows(single), read_rows(sharded)
+    assert sharded_rows[0] == single_rows[0]
+    assert len(sharded_rows) == len(single_rows)
+    assert sorted(sharded_rows[1:]) == sorted(single_rows[1:])
+    assert stub.counters["exports"] == 5
+    assert list((tmp_path / 'Shards').iterdir()) == []
+
+def test_failed_shards_are_listed(automation, tmp_path, monkeypatch):
+    monkeypatch.setattr(automation, 'myPassword', 'wrong')
+    with pytest.raises(ShardError, match='01-01-2024 to 16-01-2024.*17-01-2024 to 31-01-2024'):
+        HolidayShards.download_report_sharded(startDate, datetime(2024, 1, 31), shards=2,
+                                              output_directory=str(tmp_path / 'Sharded'), directory=str(tmp_path / 'Shards'))
+    assert not (tmp_path / 'Sharded').exists() or list((tmp_path / 'Sharded').iterdir()) == []